@@ -6,22 +6,34 @@
 提供RESTful API接口，用於控制和監控數據收集過程
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
-import subprocess
 import threading
-import time
 import json
 import os
 import logging
 import sys
-from datetime import datetime, timedelta
-import re
+import math
 import psycopg2
 import random
 import pandas as pd
 from dotenv import load_dotenv
 
+try:
+    from backend.api.db_pool import DatabasePool
+    from backend.api.kline_encoding import encode_klines, negotiate_format, rows_to_matrix
+    from backend.api.kline_cache import KlineCache, KlineChangeListener
+    from backend.api.market_stats import MarketStatsEngine
+    from backend.api.collection_jobs import CollectionJobManager, new_status
+    from backend.api.event_stream import EventBroker, KlineStreamHub, stream_events
+except ImportError:  # 在 backend/api 目錄下直接運行時
+    from db_pool import DatabasePool
+    from kline_encoding import encode_klines, negotiate_format, rows_to_matrix
+    from kline_cache import KlineCache, KlineChangeListener
+    from market_stats import MarketStatsEngine
+    from collection_jobs import CollectionJobManager, new_status
+    from event_stream import EventBroker, KlineStreamHub, stream_events
+
 # 添加項目根目錄到系統路徑，以便正確導入模塊
 script_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.abspath(os.path.join(script_dir, '../..'))
@@ -46,360 +58,295 @@ app.logger.info(f"專案根目錄: {project_root}")
 
 logger = logging.getLogger("data_collection_api")
 
-# 全局變量，用於存儲收集進程的狀態
-collection_process = None
-collection_status = {
-    "isCollecting": False,
-    "symbol": "",
-    "interval": "",
-    "startTime": "",
-    "endTime": "",
-    "totalKlines": 0,
-    "collectedKlines": 0,
-    "progress": 0,
-    "batchCount": 0,
-    "currentBatch": {
-        "startTime": "",
-        "endTime": "",
-        "count": 0
-    },
-    "collectionHistory": [],
-    "error": None
-}
+def build_collection_command(params):
+    """收集任務對應的 keep_collecting.py 命令"""
+    cmd = [
+        sys.executable,
+        os.path.join(project_root, "backend/scripts/data/keep_collecting.py"),
+        "--symbol", params["symbol"],
+        "--start_time", params["startTime"],
+        "--interval", params["interval"],
+        "--batch_size", str(params["batchSize"]),
+        "--config_path", params["configPath"],
+        "--sleep_time", str(params["sleepTime"])
+    ]
+    if params.get("endTime"):
+        cmd.extend(["--end_time", params["endTime"]])
+    if params.get("workers", 1) > 1:
+        cmd.extend(["--workers", str(params["workers"])])
+    if params.get("repair"):
+        cmd.append("--repair")
+    return cmd
 
-# 用於監控日誌文件的線程
-log_monitor_thread = None
-should_stop_monitoring = False
+def parse_exchange_limits(value):
+    """解析 COLLECTION_EXCHANGE_LIMITS，例如 "bingx=2,binance=3" """
+    limits = {}
+    for item in (value or '').split(','):
+        name, _, limit = item.partition('=')
+        if name.strip() and limit.strip().isdigit():
+            limits[name.strip()] = int(limit)
+    return limits
 
-def parse_log_line(line):
-    """解析日誌行，提取相關信息"""
-    try:
-        # 提取時間戳和消息部分
-        timestamp_match = re.match(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})', line)
-        if not timestamp_match:
-            return None
-            
-        # 提取批次信息
-        batch_match = re.search(r'收集批次 (\d+): ([\d-]+ [\d:]+) 至 ([\d-]+ [\d:]+)', line)
-        if batch_match:
-            return {
-                "type": "batch_info",
-                "batchCount": int(batch_match.group(1)),
-                "startTime": batch_match.group(2),
-                "endTime": batch_match.group(3)
-            }
-            
-        # 提取插入數據信息
-        insert_match = re.search(r'成功插入 (\d+) 條K線數據', line)
-        if insert_match:
-            return {
-                "type": "insert_info",
-                "count": int(insert_match.group(1))
-            }
-            
-        # 提取進度信息
-        progress_match = re.search(r'總進度: ([\d.]+)% 已收集: (\d+) 條', line)
-        if progress_match:
-            return {
-                "type": "progress_info",
-                "progress": float(progress_match.group(1)),
-                "totalCollected": int(progress_match.group(2))
-            }
-            
-        # 提取完成信息
-        complete_match = re.search(r'數據收集完成! 總共收集了 (\d+) 條', line)
-        if complete_match:
-            return {
-                "type": "complete_info",
-                "totalCollected": int(complete_match.group(1))
-            }
-            
-        # 提取錯誤信息
-        error_match = re.search(r'錯誤: (.+)', line)
-        if error_match:
-            return {
-                "type": "error_info",
-                "message": error_match.group(1)
-            }
-            
-        return None
-    except Exception as e:
-        logger.error(f"解析日誌行時出錯: {str(e)}")
-        return None
+# 任務狀態變化與進度增量通過 /api/data-collection/events 推送，主題為任務 ID
+collection_job_events = EventBroker()
+
+# 收集任務管理器: 多個任務並發運行，狀態保存在 collection_jobs.json，API 重啟後恢復。
+# 在提供服務的進程中首次使用時創建（load_dotenv 之後才能讀到 COLLECTION_* 設置）
+collection_jobs = None
+collection_jobs_lock = threading.Lock()
+
+def get_collection_jobs():
+    """獲取收集任務管理器，首次調用時創建並恢復上次未完成的任務"""
+    global collection_jobs
+    if collection_jobs is None:
+        with collection_jobs_lock:
+            if collection_jobs is None:
+                manager = CollectionJobManager(
+                    build_collection_command,
+                    state_path=os.getenv('COLLECTION_JOBS_STATE', os.path.join(script_dir, 'collection_jobs.json')),
+                    max_concurrent=int(os.getenv('COLLECTION_MAX_JOBS', 4)),
+                    exchange_limits=parse_exchange_limits(os.getenv('COLLECTION_EXCHANGE_LIMITS')),
+                    default_exchange_limit=int(os.getenv('COLLECTION_EXCHANGE_MAX_JOBS', 2))
+                )
+                manager.add_listener(collection_job_events.publish)
+                manager.load()
+                collection_jobs = manager
+    return collection_jobs
 
-def monitor_log_file(log_file_path):
-    """監控日誌文件並更新收集狀態"""
-    global collection_status, should_stop_monitoring
+def resolve_config_path(config_path):
+    """驗證配置文件路徑，不存在時嘗試使用已知的本地配置文件"""
+    if os.path.isfile(config_path):
+        return config_path
+    app.logger.error(f"配置文件不存在: {config_path}")
+    app.logger.info(f"嘗試尋找已知的配置文件...")
     
+    # 嘗試使用相對路徑尋找已知的配置文件
+    local_config_path = os.path.join(project_root, 'backend', 'api_config', 'BingX_api_config2_local.json')
+    if os.path.isfile(local_config_path):
+        app.logger.info(f"找到替代配置文件: {local_config_path}")
+        return local_config_path
+    return None
+
+def config_exchange_name(config_path):
+    """配置文件中第一個交易所的名稱（收集進程默認使用該交易所）"""
     try:
-        with open(log_file_path, 'r') as f:
-            # 移動到文件末尾
-            f.seek(0, 2)
-            
-            while not should_stop_monitoring:
-                line = f.readline()
-                if line:
-                    parsed_data = parse_log_line(line)
-                    if parsed_data:
-                        update_collection_status(parsed_data)
-                else:
-                    # 沒有新行，等待一下
-                    time.sleep(0.1)
-                    
-                # 檢查進程是否還在運行
-                if collection_process and collection_process.poll() is not None:
-                    # 進程已結束
-                    if collection_status["isCollecting"]:
-                        logger.info("數據收集進程已結束")
-                        collection_status["isCollecting"] = False
-                        if collection_status["progress"] < 100 and not collection_status["error"]:
-                            collection_status["progress"] = 100  # 標記為完成
-                    break
-    except Exception as e:
-        logger.error(f"監控日誌文件時出錯: {str(e)}")
-        collection_status["error"] = str(e)
-    finally:
-        logger.info("停止監控日誌文件")
-
-def update_collection_status(parsed_data):
-    """根據解析的日誌數據更新收集狀態"""
-    global collection_status
+        with open(config_path, 'r') as f:
+            exchange_configs = json.load(f).get('exchange_configs', [])
+    except (OSError, ValueError):
+        return ''
+    return exchange_configs[0].get('exchange_name', '') if exchange_configs else ''
+
+def parse_collection_request(data):
+    """把請求體解析為任務參數列表（symbols 可一次提交多個交易對），返回 (參數列表, 錯誤信息)"""
+    symbols = data.get('symbols') or ([data['symbol']] if data.get('symbol') else [])
+    start_time = data.get('startTime')
+    config_path = data.get('configPath')
     
-    if parsed_data["type"] == "batch_info":
-        collection_status["batchCount"] = parsed_data["batchCount"]
-        collection_status["currentBatch"]["startTime"] = parsed_data["startTime"]
-        collection_status["currentBatch"]["endTime"] = parsed_data["endTime"]
-        
-    elif parsed_data["type"] == "insert_info":
-        collection_status["currentBatch"]["count"] = parsed_data["count"]
-        collection_status["collectedKlines"] += parsed_data["count"]
-        
-        # 添加到歷史記錄
-        collection_status["collectionHistory"].append({
-            "timestamp": datetime.now().isoformat(),
-            "count": parsed_data["count"],
-            "progress": collection_status["progress"]
-        })
-        
-        # 保持歷史記錄在合理大小
-        if len(collection_status["collectionHistory"]) > 100:
-            collection_status["collectionHistory"] = collection_status["collectionHistory"][-100:]
-        
-    elif parsed_data["type"] == "progress_info":
-        collection_status["progress"] = parsed_data["progress"]
-        collection_status["collectedKlines"] = parsed_data["totalCollected"]
-        
-    elif parsed_data["type"] == "complete_info":
-        collection_status["collectedKlines"] = parsed_data["totalCollected"]
-        collection_status["progress"] = 100
-        collection_status["isCollecting"] = False
-        
-    elif parsed_data["type"] == "error_info":
-        collection_status["error"] = parsed_data["message"]
+    # 詳細記錄每個必要參數
+    app.logger.info(f"參數檢查 - symbols: {symbols}, start_time: {start_time}, config_path: {config_path}")
+    
+    missing_params = []
+    if not symbols: missing_params.append("symbol")
+    if not start_time: missing_params.append("startTime")
+    if not config_path: missing_params.append("configPath")
+    if missing_params:
+        return None, f"缺少必要參數: {', '.join(missing_params)}"
+    
+    resolved_path = resolve_config_path(config_path)
+    if resolved_path is None:
+        return None, f"配置文件不存在且無法找到替代: {config_path}"
+    
+    base = {
+        "startTime": start_time,
+        "endTime": data.get('endTime', ''),
+        "interval": data.get('interval', '1h'),
+        "batchSize": int(data.get('batchSize', 1000)),
+        "configPath": resolved_path,
+        "sleepTime": int(data.get('sleepTime', 0)),
+        "workers": int(data.get('workers', 1)),
+        "repair": bool(data.get('repair', False)),
+        "estimatedKlines": data.get('estimatedKlines', 0)
+    }
+    return [dict(base, symbol=symbol) for symbol in symbols], None
 
-@app.route('/api/data-collection/start', methods=['POST'])
-def start_collection():
-    """啟動數據收集任務"""
-    global collection_process, collection_status, log_monitor_thread, should_stop_monitoring
+def submit_collection_jobs(data):
+    """解析請求並提交任務，返回 (任務列表, 錯誤響應)"""
+    # 輸出原始請求數據以進行調試
+    app.logger.info(f"收到數據收集請求: {request.data}")
     
-    if collection_status["isCollecting"]:
-        return jsonify({
+    # 檢查請求格式
+    if not request.is_json:
+        app.logger.error("請求格式錯誤: 不是有效的JSON格式")
+        return None, (jsonify({
             "success": False,
-            "message": "已有數據收集任務正在運行"
-        }), 400
+            "message": "請求格式錯誤: 不是有效的JSON格式"
+        }), 400)
+    
+    params_list, error = parse_collection_request(data)
+    if error:
+        app.logger.error(error)
+        return None, (jsonify({"success": False, "message": error}), 400)
     
+    priority = int(data.get('priority', 0))
+    jobs = [
+        get_collection_jobs().submit(params, config_exchange_name(params["configPath"]), priority)
+        for params in params_list
+    ]
+    return jobs, None
+
+def idle_collection_status():
+    """沒有任何任務時的狀態"""
+    return dict(new_status({}), isCollecting=False)
+
+@app.route('/api/data-collection/jobs', methods=['POST'])
+def create_collection_jobs():
+    """提交收集任務（symbols 為列表時每個交易對一個任務），超出並發上限的任務排隊等待"""
     try:
-        # 輸出原始請求數據以進行調試
-        app.logger.info(f"收到數據收集請求: {request.data}")
-        
-        # 檢查請求格式
-        if not request.is_json:
-            app.logger.error("請求格式錯誤: 不是有效的JSON格式")
-            return jsonify({
-                "success": False,
-                "message": "請求格式錯誤: 不是有效的JSON格式"
-            }), 400
-            
-        data = request.json
-        app.logger.info(f"解析的JSON數據: {data}")
-        
-        symbol = data.get('symbol')
-        start_time = data.get('startTime')
-        end_time = data.get('endTime', '')
-        interval = data.get('interval', '1h')
-        batch_size = data.get('batchSize', 1000)
-        config_path = data.get('configPath')
-        sleep_time = data.get('sleepTime', 1)
-        
-        # 詳細記錄每個必要參數
-        app.logger.info(f"參數檢查 - symbol: {symbol}, start_time: {start_time}, config_path: {config_path}")
-        
-        if not symbol or not start_time or not config_path:
-            missing_params = []
-            if not symbol: missing_params.append("symbol")
-            if not start_time: missing_params.append("startTime")
-            if not config_path: missing_params.append("configPath")
-            
-            app.logger.error(f"缺少必要參數: {', '.join(missing_params)}")
-            return jsonify({
-                "success": False,
-                "message": f"缺少必要參數: {', '.join(missing_params)}"
-            }), 400
-            
-        # 驗證配置文件路徑是否存在
-        if not os.path.isfile(config_path):
-            app.logger.error(f"配置文件不存在: {config_path}")
-            app.logger.info(f"嘗試尋找已知的配置文件...")
-            
-            # 嘗試使用相對路徑尋找已知的配置文件
-            local_config_path = os.path.join(project_root, 'backend', 'api_config', 'BingX_api_config2_local.json')
-            
-            if os.path.isfile(local_config_path):
-                app.logger.info(f"找到替代配置文件: {local_config_path}")
-                config_path = local_config_path
-            else:
-                return jsonify({
-                    "success": False,
-                    "message": f"配置文件不存在且無法找到替代: {config_path}"
-                }), 400
-        
-        # 構建命令
-        cmd = [
-            "python",
-            os.path.join(project_root, "backend/scripts/data/keep_collecting.py"),
-            "--symbol", symbol,
-            "--start_time", start_time,
-            "--interval", interval,
-            "--batch_size", str(batch_size),
-            "--config_path", config_path,
-            "--sleep_time", str(sleep_time)
-        ]
-        
-        if end_time:
-            cmd.extend(["--end_time", end_time])
-        
-        # 重置狀態
-        collection_status = {
-            "isCollecting": True,
-            "symbol": symbol,
-            "interval": interval,
-            "startTime": start_time,
-            "endTime": end_time,
-            "totalKlines": data.get('estimatedKlines', 0),
-            "collectedKlines": 0,
-            "progress": 0,
-            "batchCount": 0,
-            "currentBatch": {
-                "startTime": "",
-                "endTime": "",
-                "count": 0
-            },
-            "collectionHistory": [],
-            "error": None
-        }
-        
-        # 啟動收集進程
-        log_file_path = os.path.join(project_root, "data_collection.log")
-        with open(log_file_path, 'w') as log_file:  # 清空日誌文件
-            pass
-        
-        logger.info(f"啟動數據收集進程: {' '.join(cmd)}")
-        collection_process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1
-        )
-        
-        # 啟動日誌監控線程
-        should_stop_monitoring = False
-        log_monitor_thread = threading.Thread(
-            target=monitor_log_file,
-            args=(log_file_path,)
-        )
-        log_monitor_thread.daemon = True
-        log_monitor_thread.start()
-        
+        jobs, error_response = submit_collection_jobs(request.get_json(silent=True) or {})
+        if error_response:
+            return error_response
         return jsonify({
             "success": True,
-            "message": "數據收集任務已啟動",
-            "status": collection_status
+            "message": f"已提交 {len(jobs)} 個數據收集任務",
+            "jobs": [job.to_dict(include_history=False) for job in jobs]
         })
-        
     except Exception as e:
-        logger.error(f"啟動數據收集任務時出錯: {str(e)}")
+        logger.error(f"提交數據收集任務時出錯: {str(e)}")
         return jsonify({
             "success": False,
-            "message": f"啟動數據收集任務時出錯: {str(e)}"
+            "message": f"提交數據收集任務時出錯: {str(e)}"
         }), 500
 
-@app.route('/api/data-collection/stop', methods=['POST'])
-def stop_collection():
-    """停止數據收集任務"""
-    global collection_process, should_stop_monitoring
-    
-    # 如果收集狀態顯示為非收集中，但前端仍然嘗試停止，可能是進程已自然完成
-    if not collection_status["isCollecting"]:
-        # 確保監控線程已停止
-        should_stop_monitoring = True
-        if log_monitor_thread and log_monitor_thread.is_alive():
-            log_monitor_thread.join(timeout=5)
-            
-        return jsonify({
-            "success": True,
-            "message": "數據收集任務已完成",
-            "status": collection_status
-        })
-    
-    # 如果進程對象不存在，但狀態顯示為收集中，修正狀態
-    if collection_status["isCollecting"] and not collection_process:
-        collection_status["isCollecting"] = False
-        should_stop_monitoring = True
-        if log_monitor_thread and log_monitor_thread.is_alive():
-            log_monitor_thread.join(timeout=5)
-            
+@app.route('/api/data-collection/jobs', methods=['GET'])
+def list_collection_jobs():
+    """列出收集任務（?state=queued|running|completed|failed|stopped 過濾）"""
+    manager = get_collection_jobs()
+    jobs = manager.list_jobs(request.args.get('state'))
+    return jsonify({
+        "jobs": [job.to_dict(include_history=False) for job in jobs],
+        "stats": manager.stats()
+    })
+
+@app.route('/api/data-collection/jobs/<job_id>', methods=['GET'])
+def get_collection_job(job_id):
+    """獲取單個任務的狀態"""
+    job = get_collection_jobs().get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": f"任務不存在: {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/data-collection/jobs/<job_id>/stop', methods=['POST'])
+def stop_collection_job(job_id):
+    """停止單個任務"""
+    try:
+        job = get_collection_jobs().stop(job_id)
+    except Exception as e:
+        logger.error(f"停止數據收集任務時出錯: {str(e)}")
         return jsonify({
-            "success": True,
-            "message": "數據收集任務已完成，狀態已更新",
-            "status": collection_status
-        })
-    
+            "success": False,
+            "message": f"停止數據收集任務時出錯: {str(e)}"
+        }), 500
+    if job is None:
+        return jsonify({"success": False, "message": f"任務不存在: {job_id}"}), 404
+    return jsonify({
+        "success": True,
+        "message": "數據收集任務已停止" if job.state == 'stopped' else "數據收集任務已完成",
+        "status": job.to_dict()
+    })
+
+@app.route('/api/data-collection/jobs/<job_id>/history', methods=['GET'])
+def get_collection_job_history(job_id):
+    """獲取單個任務的批次歷史"""
+    job = get_collection_jobs().get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": f"任務不存在: {job_id}"}), 404
+    return jsonify({"history": job.status["collectionHistory"]})
+
+def event_stream_response(body):
+    """SSE 響應：禁止緩存與反向代理緩衝，事件到達即發送"""
+    return Response(body, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/data-collection/events', methods=['GET'])
+def stream_collection_events():
+    """
+    推送收集任務事件 (Server-Sent Events)
+    連接後先發送 snapshot（任務列表與統計），之後發送:
+    - job: 任務狀態變化（提交、開始、結束），數據為不含歷史的完整任務
+    - progress: 進度增量（batch / insert / progress / complete / error）
+    - resync: 積壓過多，客戶端應重新獲取狀態
+    查詢參數:
+    - jobId: 只接收該任務的事件 (可選)
+    """
+    job_id = request.args.get('jobId')
+    manager = get_collection_jobs()
+    events = collection_job_events.subscribe(job_id)
+    if job_id:
+        job = manager.get(job_id)
+        jobs = [job] if job else []
+    else:
+        jobs = manager.list_jobs()
+    snapshot = {
+        "jobs": [job.to_dict(include_history=False) for job in jobs],
+        "stats": manager.stats()
+    }
+    return event_stream_response(stream_events(collection_job_events, events, [('snapshot', snapshot)]))
+
+# 以下為兼容單任務前端的接口，作用於最近的任務
+
+@app.route('/api/data-collection/start', methods=['POST'])
+def start_collection():
+    """啟動數據收集任務（兼容接口，不再拒絕並發任務）"""
     try:
-        # 終止進程
-        collection_process.terminate()
-        collection_process.wait(timeout=5)
-        
-        # 停止監控線程
-        should_stop_monitoring = True
-        if log_monitor_thread and log_monitor_thread.is_alive():
-            log_monitor_thread.join(timeout=5)
-        
-        collection_status["isCollecting"] = False
-        
+        jobs, error_response = submit_collection_jobs(request.get_json(silent=True) or {})
+        if error_response:
+            return error_response
         return jsonify({
             "success": True,
-            "message": "數據收集任務已停止",
-            "status": collection_status
+            "message": "數據收集任務已啟動" if jobs[-1].state == 'running' else "數據收集任務已排隊",
+            "jobId": jobs[-1].id,
+            "jobIds": [job.id for job in jobs],
+            "status": jobs[-1].to_dict()
         })
-        
     except Exception as e:
-        logger.error(f"停止數據收集任務時出錯: {str(e)}")
+        logger.error(f"啟動數據收集任務時出錯: {str(e)}")
         return jsonify({
             "success": False,
-            "message": f"停止數據收集任務時出錯: {str(e)}"
+            "message": f"啟動數據收集任務時出錯: {str(e)}"
         }), 500
 
+@app.route('/api/data-collection/stop', methods=['POST'])
+def stop_collection():
+    """停止數據收集任務（?jobId= 指定任務，默認最近的任務）"""
+    job_id = request.args.get('jobId') or (request.get_json(silent=True) or {}).get('jobId')
+    manager = get_collection_jobs()
+    job = manager.get(job_id) if job_id else manager.latest()
+    if job is None:
+        return jsonify({
+            "success": True,
+            "message": "沒有正在運行的數據收集任務",
+            "status": idle_collection_status()
+        })
+    return stop_collection_job(job.id)
+
 @app.route('/api/data-collection/status', methods=['GET'])
 def get_status():
-    """獲取數據收集狀態"""
-    return jsonify(collection_status)
+    """獲取數據收集狀態（?jobId= 指定任務，默認最近的任務）"""
+    job_id = request.args.get('jobId')
+    manager = get_collection_jobs()
+    job = manager.get(job_id) if job_id else manager.latest()
+    return jsonify(job.to_dict() if job else idle_collection_status())
 
 @app.route('/api/data-collection/history', methods=['GET'])
 def get_history():
-    """獲取收集歷史"""
+    """獲取收集歷史（?jobId= 指定任務，默認最近的任務）"""
+    job_id = request.args.get('jobId')
+    manager = get_collection_jobs()
+    job = manager.get(job_id) if job_id else manager.latest()
     return jsonify({
-        "history": collection_status["collectionHistory"]
+        "history": job.status["collectionHistory"] if job else []
     })
 
 @app.route('/api/data-collection/symbols', methods=['GET'])
@@ -677,52 +624,357 @@ def create_exchange_config():
         }), 500
 
 # 數據庫連接設定
-def get_db_connection():
+def get_db_config():
     """
-    獲取數據庫連接
+    獲取數據庫連接參數
     """
+    # 先嘗試從環境變數獲取連接信息
+    host = os.getenv('DB_HOST')
+    database = os.getenv('DB_NAME')
+    user = os.getenv('DB_USER')
+    password = os.getenv('DB_PASSWORD')
+    port = os.getenv('DB_PORT')
+    
+    # 如果環境變數不存在，嘗試從預設配置文件中讀取
+    if not all([host, database, user, password]):
+        logger.info("從配置文件中讀取數據庫連接信息")
+        config_path = os.path.join(project_root, 'settings', 'database_config.json')
+        if os.path.exists(config_path):
+            with open(config_path, 'r') as f:
+                db_config = json.load(f)
+                host = db_config.get('host', 'localhost')
+                database = db_config.get('database', 'trading_model')
+                user = db_config.get('user', 'postgres')
+                password = db_config.get('password', 'postgres')
+                port = db_config.get('port', '5432')
+    
+    # 使用預設值作為備用
+    return {
+        'host': host or 'localhost',
+        'database': database or 'trading_model',
+        'user': user or 'postgres',
+        'password': password or 'postgres',
+        'port': port or '5432'
+    }
+
+# 進程級連接池，首次使用時創建（load_dotenv 之後才能讀到環境變數）
+db_pool = None
+db_pool_lock = threading.Lock()
+
+# 派生週期的連續聚合視圖及其來源週期（與 import_to_database.DERIVED_INTERVALS 一致）
+KLINE_AGGREGATE_SOURCES = {
+    '5m': '1m', '15m': '1m', '30m': '1m', '1h': '1m', '4h': '1h', '1d': '1h'
+}
+
+# 數據庫中實際存在的連續聚合: 週期 -> 視圖名（創建連接池時檢測）
+kline_aggregate_views = {}
+
+def build_kline_statements(table, series_filter, time_column, first_param):
+    """K線讀取使用的預備語句（時間參數均為 Unix 秒）
+    
+    series_filter 使用 $1..$(first_param - 1) 選擇序列，其餘參數從 first_param 開始編號；
+    輸出列在數據庫端轉為 Unix 秒與 float8，游標直接返回 int/float 元組，無需逐行轉換
+    """
+    p1, p2, p3 = (f"${first_param + i}" for i in range(3))
+    columns = (
+        f"EXTRACT(EPOCH FROM {time_column})::int8, open_price::float8, high_price::float8, "
+        "low_price::float8, close_price::float8, volume::float8"
+    )
+    return {
+        # 起止時間（含）
+        'kline_window': f"""
+            SELECT {columns} FROM {table}
+            WHERE {series_filter}
+              AND {time_column} >= to_timestamp({p1}) AND {time_column} <= to_timestamp({p2})
+            ORDER BY {time_column} ASC
+        """,
+        'kline_bounds': f"""
+            SELECT EXTRACT(EPOCH FROM MIN({time_column})), EXTRACT(EPOCH FROM MAX({time_column}))
+            FROM {table} WHERE {series_filter}
+        """,
+        # 桶寬（秒）, 起止時間
+        'kline_downsample': f"""
+            SELECT EXTRACT(EPOCH FROM time_bucket({p1}::float8 * INTERVAL '1 second', {time_column}))::int8 AS ds_bucket,
+                   first(open_price, {time_column})::float8, MAX(high_price)::float8, MIN(low_price)::float8,
+                   last(close_price, {time_column})::float8, SUM(volume)::float8
+            FROM {table}
+            WHERE {series_filter}
+              AND {time_column} >= to_timestamp({p2}) AND {time_column} <= to_timestamp({p3})
+            GROUP BY 1
+            ORDER BY 1
+        """
+    }
+
+def kline_statement(name, symbol, interval, *params):
+    """選擇讀取 kline_data 或派生週期連續聚合的語句，返回 (語句名, 參數)"""
+    if interval in kline_aggregate_views:
+        return f"{name}_{interval}", [symbol, *params]
+    return name, [symbol, interval, *params]
+
+# K線間隔對應的秒數
+INTERVAL_SECONDS = {
+    '1m': 60, '5m': 300, '15m': 900, '30m': 1800,
+    '1h': 3600, '4h': 14400, '1d': 86400, '1w': 604800
+}
+
+MAX_PAGE_SIZE = 5000
+
+# K線塊緩存與 24 小時統計引擎，首次使用時創建並訂閱寫入通知
+kline_cache = None
+market_stats_engine = None
+kline_change_listener = None
+kline_stream_hub = None
+kline_state_lock = threading.Lock()
+
+def get_db_pool():
+    """
+    獲取進程級數據庫連接池
+    """
+    global db_pool
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                db_config = get_db_config()
+                logger.info(f"創建數據庫連接池: {db_config['host']}:{db_config['port']}/{db_config['database']}")
+                pool = DatabasePool(
+                    db_config,
+                    minconn=int(os.getenv('DB_POOL_MIN', 2)),
+                    maxconn=int(os.getenv('DB_POOL_MAX', 20)),
+                    max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+                    acquire_timeout=float(os.getenv('DB_POOL_TIMEOUT', 5))
+                )
+                # 緊湊結構下直接讀取 kline_bars: series_id 由子查詢一次確定，
+                # 之後按 (series_id, time) 索引有序掃描，不經過 kline_data 兼容視圖的連接
+                compact = detect_compact_schema(pool)
+                if compact:
+                    table, series_filter = 'kline_bars', KLINE_SERIES_FILTER.format(interval='$2')
+                else:
+                    table, series_filter = 'kline_data', 'symbol = $1 AND interval = $2'
+                for name, sql in build_kline_statements(table, series_filter, 'time', 3).items():
+                    pool.register_statement(name, sql)
+                
+                # 派生週期存在連續聚合時改為讀取聚合視圖（緊湊結構下聚合按基礎週期的 series_id 分組）
+                view_filter = KLINE_SERIES_FILTER.format(interval="'1m'") if compact else 'symbol = $1'
+                kline_aggregate_views.clear()
+                kline_aggregate_views.update(detect_kline_aggregates(pool))
+                for interval, view in kline_aggregate_views.items():
+                    for name, sql in build_kline_statements(view, view_filter, 'bucket', 2).items():
+                        pool.register_statement(f"{name}_{interval}", sql)
+                if kline_aggregate_views:
+                    logger.info(f"以下週期從連續聚合讀取: {', '.join(kline_aggregate_views)}")
+                db_pool = pool
+    return db_pool
+
+# 緊湊結構下按 (symbol, interval) 選擇序列
+KLINE_SERIES_FILTER = "series_id = (SELECT series_id FROM kline_series WHERE symbol = $1 AND interval = {interval})"
+
+def detect_compact_schema(pool):
+    """kline_data 是否為緊湊結構（kline_bars + kline_series）的兼容視圖"""
     try:
-        # 先嘗試從環境變數獲取連接信息
-        host = os.getenv('DB_HOST')
-        database = os.getenv('DB_NAME')
-        user = os.getenv('DB_USER')
-        password = os.getenv('DB_PASSWORD')
-        port = os.getenv('DB_PORT')
-        
-        # 如果環境變數不存在，嘗試從預設配置文件中讀取
-        if not all([host, database, user, password]):
-            logger.info("從配置文件中讀取數據庫連接信息")
-            config_path = os.path.join(project_root, 'settings', 'database_config.json')
-            if os.path.exists(config_path):
-                with open(config_path, 'r') as f:
-                    db_config = json.load(f)
-                    host = db_config.get('host', 'localhost')
-                    database = db_config.get('database', 'trading_model')
-                    user = db_config.get('user', 'postgres')
-                    password = db_config.get('password', 'postgres')
-                    port = db_config.get('port', '5432')
-        
-        # 使用預設值作為備用
-        host = host or 'localhost'
-        database = database or 'trading_model'
-        user = user or 'postgres'
-        password = password or 'postgres'
-        port = port or '5432'
-        
-        logger.info(f"嘗試連接到數據庫: {host}:{port}/{database}")
-        
-        conn = psycopg2.connect(
-            host=host,
-            database=database,
-            user=user,
-            password=password,
-            port=port
-        )
-        logger.info("數據庫連接成功")
-        return conn
+        with pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('kline_data')")
+                row = cursor.fetchone()
+    except psycopg2.Error as e:
+        logger.warning(f"無法檢測 kline_data 表結構: {e}")
+        return False
+    return bool(row) and row[0] == 'v'
+
+def detect_kline_aggregates(pool):
+    """檢測已創建的派生週期連續聚合（未安裝 TimescaleDB 時返回空）"""
+    views = {interval: f"kline_data_{interval}" for interval in KLINE_AGGREGATE_SOURCES}
+    try:
+        with pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT view_name FROM timescaledb_information.continuous_aggregates "
+                    "WHERE view_name = ANY(%s)", (list(views.values()),))
+                existing = {row[0] for row in cursor.fetchall()}
+    except psycopg2.Error as e:
+        logger.warning(f"無法檢測連續聚合，全部週期從 kline_data 讀取: {e}")
+        return {}
+    return {interval: view for interval, view in views.items() if view in existing}
+
+def load_kline_window(symbol, interval, start, end):
+    """從數據庫讀取 [start, end] 內的K線矩陣（緩存未命中時調用）"""
+    pool = get_db_pool()
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            pool.execute(cursor, *kline_statement('kline_window', symbol, interval, start, end))
+            return rows_to_matrix(cursor.fetchall())
+
+def load_kline_bounds(symbol, interval):
+    """從數據庫讀取序列的最早與最新時間"""
+    pool = get_db_pool()
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            pool.execute(cursor, *kline_statement('kline_bounds', symbol, interval))
+            first_time, last_time = cursor.fetchone()
+    if first_time is None:
+        return None
+    return int(first_time), int(last_time)
+
+def query_all(sql, params):
+    """在連接池的連接上執行一次查詢並返回全部行"""
+    with get_db_pool().connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+def get_change_listener():
+    """獲取K線寫入通知監聽線程（調用方持有 kline_state_lock）"""
+    global kline_change_listener
+    if kline_change_listener is None:
+        kline_change_listener = KlineChangeListener(get_db_config())
+        kline_change_listener.start()
+    return kline_change_listener
+
+def get_kline_cache():
+    """獲取進程級K線緩存（KLINE_CACHE_MB=0 時不保留任何塊，所有讀取直達數據庫）"""
+    global kline_cache
+    if kline_cache is None:
+        with kline_state_lock:
+            if kline_cache is None:
+                cache = KlineCache(
+                    load_kline_window,
+                    load_kline_bounds,
+                    INTERVAL_SECONDS,
+                    max_bytes=int(float(os.getenv('KLINE_CACHE_MB', 256)) * 1024 * 1024),
+                    block_candles=int(os.getenv('KLINE_CACHE_BLOCK_CANDLES', 1000)),
+                    spill_dir=os.getenv('KLINE_CACHE_SPILL_DIR') or None
+                )
+                # 基礎週期的寫入通知同時使由其聚合而來的週期失效
+                get_db_pool()
+                for interval in kline_aggregate_views:
+                    cache.dependents.setdefault(KLINE_AGGREGATE_SOURCES[interval], []).append(interval)
+                get_change_listener().add_subscriber(cache)
+                kline_cache = cache
+    return kline_cache
+
+def get_market_stats_engine():
+    """獲取進程級 24 小時統計引擎"""
+    global market_stats_engine
+    if market_stats_engine is None:
+        with kline_state_lock:
+            if market_stats_engine is None:
+                engine = MarketStatsEngine(query_all, INTERVAL_SECONDS)
+                get_change_listener().add_subscriber(engine)
+                market_stats_engine = engine
+    return market_stats_engine
+
+def get_kline_stream_hub():
+    """獲取K線推送中心（在緩存之後訂閱寫入通知，推送時讀到的是已失效重載的數據）"""
+    global kline_stream_hub
+    if kline_stream_hub is None:
+        cache = get_kline_cache()
+        with kline_state_lock:
+            if kline_stream_hub is None:
+                hub = KlineStreamHub(cache.read_range, INTERVAL_SECONDS, cache.dependents)
+                get_change_listener().add_subscriber(hub)
+                kline_stream_hub = hub
+    return kline_stream_hub
+
+@app.route('/api/kline-cache/stats', methods=['GET'])
+def get_kline_cache_stats():
+    """
+    獲取K線緩存指標
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': get_kline_cache().stats()
+        })
     except Exception as e:
-        logger.error(f"數據庫連接失敗: {e}")
+        logger.error(f"獲取K線緩存指標失敗: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'獲取K線緩存指標失敗: {str(e)}',
+            'data': {}
+        }), 500
+
+@app.route('/api/db-pool/stats', methods=['GET'])
+def get_db_pool_stats():
+    """
+    獲取數據庫連接池指標
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': get_db_pool().stats()
+        })
+    except Exception as e:
+        logger.error(f"獲取連接池指標失敗: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'獲取連接池指標失敗: {str(e)}',
+            'data': None
+        }), 500
+
+def kline_response(rows, meta):
+    """按 Accept 頭或 ?format= 編碼K線查詢結果（rows 按時間正序）"""
+    mimetype = negotiate_format(request.accept_mimetypes, request.args.get('format'))
+    payload = {'success': True, 'message': '成功獲取K線數據'}
+    payload.update(meta)
+    response = Response(encode_klines(rows, payload, mimetype), mimetype=mimetype)
+    response.headers['Vary'] = 'Accept'
+    return response
+
+def parse_time_param(value):
+    """解析時間參數：Unix 秒或 ISO 日期字符串，返回 Unix 秒"""
+    if value is None or value == '':
         return None
+    try:
+        return float(value)
+    except ValueError:
+        timestamp = pd.Timestamp(value)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.tz_localize('UTC')
+        return timestamp.timestamp()
+
+def query_kline_page(symbol, interval, before, after, page_size):
+    """游標分頁：before 向更早翻頁，after 向更新翻頁，都不提供時返回最新一頁；返回 (rows, meta)"""
+    cache = get_kline_cache()
+    # 多取一條用於判斷是否還有下一頁（K線時間均為整秒）
+    if after is not None:
+        rows = cache.read_first(symbol, interval, page_size + 1, start=math.floor(after) + 1)
+    else:
+        end = math.ceil(before) - 1 if before is not None else None
+        rows = cache.read_last(symbol, interval, page_size + 1, end=end)
+    
+    has_more = len(rows) > page_size
+    if has_more:
+        rows = rows[:page_size] if after is not None else rows[1:]
+    return rows, {
+        'pagination': {
+            'pageSize': page_size,
+            'hasMore': has_more,
+            'nextBefore': int(rows[0, 0]) if len(rows) else before,
+            'nextAfter': int(rows[-1, 0]) if len(rows) else after
+        }
+    }
+
+def query_kline_downsampled(symbol, interval, start, end, max_points):
+    """按視窗分辨率降採樣：桶寬取 (end - start) / max_points 並向上取整到K線間隔的整數倍；返回 (rows, meta)"""
+    step = INTERVAL_SECONDS.get(interval, 3600)
+    cache = get_kline_cache()
+    if start is None or end is None:
+        bounds = cache.bounds(symbol, interval)
+        if bounds is None:
+            return [], {'bucketSeconds': step}
+        start = bounds[0] if start is None else start
+        end = bounds[1] if end is None else end
+    
+    bucket = max(step, -(-int(end - start) // max_points // step) * step)
+    if bucket <= step:
+        # 視窗內的K線不超過 max_points，直接從緩存讀取原始數據
+        return cache.read_range(symbol, interval, start, end), {'bucketSeconds': bucket}
+    
+    pool = get_db_pool()
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            pool.execute(cursor, *kline_statement('kline_downsample', symbol, interval, bucket, start, end))
+            rows = cursor.fetchall()
+    return rows, {'bucketSeconds': bucket}
 
 @app.route('/api/kline-data', methods=['GET'])
 def get_kline_data():
@@ -733,6 +985,11 @@ def get_kline_data():
     - interval: 時間間隔 (例如: 1m, 5m, 1h)
     - start_time: 開始時間 (可選)
     - end_time: 結束時間 (可選)
+    - before / after: 游標分頁，返回早於 / 晚於該 Unix 秒的K線 (可選)
+    - page_size: 每頁條數，提供任一分頁參數時啟用游標分頁 (可選)
+    - max_points: 最多返回的點數，超過時按 time_bucket 降採樣 (可選)
+    - format: json / columnar / binary / arrow，優先於 Accept 頭 (可選)
+    響應格式按 Accept 頭協商，默認為行式 JSON
     """
     try:
         symbol = request.args.get('symbol', 'BTC-USDT')
@@ -740,84 +997,40 @@ def get_kline_data():
         start_time = request.args.get('start_time')
         end_time = request.args.get('end_time')
         
-        # 從請求中獲取限制數量，如果未提供則不限制數量
-        limit = request.args.get('limit')
-        limit = int(limit) if limit and limit.isdigit() else None
-        
-        # 連接數據庫
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({
-                'success': False,
-                'message': '無法連接到數據庫',
-                'data': []
-            }), 500
-        
-        # 構建SQL查詢
-        cursor = conn.cursor()
-        
-        # 將symbol格式轉換為數據庫中的格式 (例如: BTC-USDT -> BTCUSDT)
-        db_symbol = symbol.replace('-', '')
-        
-        # 構建基本查詢
-        query = f"""
-        SELECT 
-            time, open_price as open, high_price as high, low_price as low, close_price as close, volume 
-        FROM 
-            kline_data
-        """
-        
-        # 添加過濾條件
-        conditions = ["symbol = %s", "interval = %s"]
-        params = [symbol, interval]
-        
-        if start_time:
-            conditions.append("time >= %s")
-            params.append(start_time)
-        
-        if end_time:
-            conditions.append("time <= %s")
-            params.append(end_time)
+        before = parse_time_param(request.args.get('before'))
+        after = parse_time_param(request.args.get('after'))
+        page_size = request.args.get('page_size', type=int)
+        max_points = request.args.get('max_points', type=int)
         
-        # 添加WHERE子句
-        query += " WHERE " + " AND ".join(conditions)
+        if max_points and max_points > 0:
+            start = parse_time_param(start_time)
+            end = parse_time_param(end_time)
+            if after is not None:
+                start = after if start is None else max(start, after)
+            if before is not None:
+                end = before if end is None else min(end, before)
+            return kline_response(*query_kline_downsampled(symbol, interval, start, end, max_points))
         
-        # 添加排序
-        query += """
-        ORDER BY time DESC 
-        """
-        
-        # 如果提供了limit參數，則添加限制
-        if limit:
-            query += f"LIMIT {limit}"
+        if page_size or before is not None or after is not None:
+            page_size = min(max(page_size or 1000, 1), MAX_PAGE_SIZE)
+            return kline_response(*query_kline_page(symbol, interval, before, after, page_size))
         
-        # 執行查詢
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
-        # 轉換為JSON格式
-        data = []
-        for row in rows:
-            data.append({
-                'time': int(row[0].timestamp()),  # 轉換為Unix時間戳
-                'open': float(row[1]),
-                'high': float(row[2]),
-                'low': float(row[3]),
-                'close': float(row[4]),
-                'volume': float(row[5])
-            })
-        
-        # 按時間正序排序
-        data.sort(key=lambda x: x['time'])
-        
-        cursor.close()
-        conn.close()
+        # 從請求中獲取限制數量，如果未提供則不限制數量
+        limit = request.args.get('limit')
+        limit = int(limit) if limit and limit.isdigit() else None
         
-        return jsonify({
-            'success': True,
-            'message': '成功獲取K線數據',
-            'data': data
-        })
+        # 通過塊緩存讀取：有 limit 時取範圍內最新的 limit 根
+        cache = get_kline_cache()
+        start = parse_time_param(start_time)
+        end = parse_time_param(end_time)
+        start = math.ceil(start) if start is not None else None
+        end = math.floor(end) if end is not None else None
+        if limit is not None:
+            rows = cache.read_last(symbol, interval, limit, start=start, end=end)
+        else:
+            rows = cache.read_range(symbol, interval, start, end)
+        
+        return kline_response(rows, {})
     
     except Exception as e:
         logger.error(f"獲取K線數據失敗: {e}")
@@ -828,79 +1041,72 @@ def get_kline_data():
             'data': []
         }), 500
 
+@app.route('/api/kline-stream', methods=['GET'])
+def stream_kline_data():
+    """
+    推送最新K線 (Server-Sent Events)
+    每次寫入通知後發送 candles 事件，data 為寫入範圍內的K線（與 /api/kline-data 行式 JSON 相同字段），
+    前端按 time 更新或追加最後一根；resync 表示可能錯過了寫入，應重新加載
+    查詢參數:
+    - symbol: 交易對 (例如: BTC-USDT)
+    - interval: 時間間隔 (例如: 1m, 5m, 1h)
+    """
+    symbol = request.args.get('symbol', 'BTC-USDT')
+    interval = request.args.get('interval', '1h')
+    try:
+        hub = get_kline_stream_hub()
+    except Exception as e:
+        logger.error(f"創建K線推送失敗: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'創建K線推送失敗: {str(e)}'
+        }), 500
+    events = hub.subscribe(symbol, interval)
+    ready = {'symbol': symbol, 'interval': interval, 'listening': hub.listening}
+    return event_stream_response(stream_events(hub.broker, events, [('ready', ready)]))
+
+@app.route('/api/market-stats', methods=['GET'])
+def get_all_market_stats():
+    """
+    獲取全部交易對的 24 小時統計
+    查詢參數:
+    - symbols: 逗號分隔的交易對，省略時返回全部 (可選)
+    """
+    try:
+        symbols = request.args.get('symbols')
+        symbols = [symbol.strip() for symbol in symbols.split(',') if symbol.strip()] if symbols else None
+        return jsonify({
+            'success': True,
+            'message': '成功獲取市場統計數據',
+            'data': get_market_stats_engine().get_all(symbols)
+        })
+    
+    except Exception as e:
+        logger.error(f"獲取市場統計數據失敗: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'獲取市場統計數據失敗: {str(e)}',
+            'data': {}
+        }), 500
+
 @app.route('/api/market-stats/<symbol>', methods=['GET'])
 def get_market_stats(symbol):
     """
     獲取市場統計數據
     """
     try:
-        # 連接數據庫
-        conn = get_db_connection()
-        if not conn:
+        stats = get_market_stats_engine().get(symbol)
+        if stats is None:
             return jsonify({
                 'success': False,
-                'message': '無法連接到數據庫',
-                'data': {}
-            }), 500
-        
-        # 將symbol格式轉換為數據庫中的格式
-        db_symbol = symbol.replace('-', '')
-        
-        # 獲取最新價格
-        cursor = conn.cursor()
-        cursor.execute(f"""
-        SELECT close 
-        FROM kline_1h_{db_symbol.lower()} 
-        ORDER BY time DESC 
-        LIMIT 1
-        """)
-        
-        latest_price_row = cursor.fetchone()
-        current_price = float(latest_price_row[0]) if latest_price_row else 0
-        
-        # 獲取24小時前的價格
-        yesterday = datetime.now() - timedelta(days=1)
-        cursor.execute(f"""
-        SELECT close 
-        FROM kline_1h_{db_symbol.lower()} 
-        WHERE time <= %s 
-        ORDER BY time DESC 
-        LIMIT 1
-        """, (yesterday,))
-        
-        yesterday_price_row = cursor.fetchone()
-        yesterday_price = float(yesterday_price_row[0]) if yesterday_price_row else current_price
-        
-        # 計算24小時變化
-        price_change = current_price - yesterday_price
-        price_change_percent = (price_change / yesterday_price * 100) if yesterday_price > 0 else 0
-        
-        # 獲取24小時最高最低價和成交量
-        cursor.execute(f"""
-        SELECT MAX(high), MIN(low), SUM(volume) 
-        FROM kline_1h_{db_symbol.lower()} 
-        WHERE time >= %s
-        """, (yesterday,))
-        
-        stats_row = cursor.fetchone()
-        high_24h = float(stats_row[0]) if stats_row and stats_row[0] else current_price
-        low_24h = float(stats_row[1]) if stats_row and stats_row[1] else current_price
-        volume_24h = float(stats_row[2]) if stats_row and stats_row[2] else 0
-        
-        cursor.close()
-        conn.close()
+                'message': f'沒有 {symbol} 最近 24 小時的K線數據',
+                'data': None
+            }), 404
         
         return jsonify({
             'success': True,
             'message': '成功獲取市場統計數據',
-            'data': {
-                'currentPrice': current_price,
-                'priceChange24h': price_change,
-                'priceChangePercent24h': price_change_percent,
-                'high24h': high_24h,
-                'low24h': low_24h,
-                'volume24h': volume_24h
-            }
+            'data': stats
         })
     
     except Exception as e:
@@ -924,4 +1130,9 @@ if __name__ == '__main__':
     parser.add_argument('--port', type=int, default=5000, help='服務端口號')
     args = parser.parse_args()
     
-    app.run(host='0.0.0.0', port=args.port, debug=True)
\ No newline at end of file
+    # debug 模式的重載器會再啟動一個子進程提供服務（WERKZEUG_RUN_MAIN=true），
+    # 只在該進程中恢復收集任務，避免父子進程各啟動一次相同的任務
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_collection_jobs()
+
+    app.run(host='0.0.0.0', port=args.port, debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+數據收集任務管理
+同時運行多個 keep_collecting.py 收集進程：任務按優先級排隊，受全局與每個交易所的並發上限約束；
+每個任務通過專用管道接收結構化進度事件，並以增量事件轉發給監聽者（SSE 推送）。
+任務狀態持久化到 JSON 文件，API 重啟後未完成的任務以修復模式重新排隊（只補齊覆蓋索引中缺失的區間）
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional
+
+logger = logging.getLogger("data_collection_api")
+
+ACTIVE_STATES = ('queued', 'running')
+FINISHED_STATES = ('completed', 'failed', 'stopped')
+
+# 每個任務保留的批次歷史條數，以及持久化時保留的已結束任務數
+HISTORY_LIMIT = 100
+FINISHED_JOBS_LIMIT = 200
+
+
+def new_status(params: Dict[str, Any]) -> Dict[str, Any]:
+    """與原 /api/data-collection/status 相同格式的初始狀態"""
+    return {
+        "isCollecting": True,
+        "symbol": params.get("symbol", ""),
+        "interval": params.get("interval", ""),
+        "startTime": params.get("startTime", ""),
+        "endTime": params.get("endTime", ""),
+        "totalKlines": params.get("estimatedKlines", 0),
+        "collectedKlines": 0,
+        "progress": 0,
+        "batchCount": 0,
+        "currentBatch": {
+            "startTime": "",
+            "endTime": "",
+            "count": 0
+        },
+        "collectionHistory": [],
+        "error": None
+    }
+
+
+class CollectionJob:
+    """單個收集任務"""
+
+    __slots__ = ('id', 'params', 'exchange', 'priority', 'seq', 'state', 'status', 'process',
+                 'pid', 'stop_requested', 'created_at', 'started_at', 'finished_at', 'resumed')
+
+    def __init__(self, job_id: str, params: Dict[str, Any], exchange: str, priority: int, seq: int):
+        self.id = job_id
+        self.params = params
+        self.exchange = exchange
+        self.priority = priority
+        self.seq = seq
+        self.state = 'queued'
+        self.status = new_status(params)
+        self.process: Optional[subprocess.Popen] = None
+        self.pid: Optional[int] = None
+        self.stop_requested = False
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # 由 API 重啟恢復的任務
+        self.resumed = False
+
+    def apply_event(self, event: Dict[str, Any]) -> None:
+        """根據收集進程發送的進度事件更新狀態"""
+        status = self.status
+        event_type = event.get("type")
+
+        if event_type == "start":
+            status["totalKlines"] = event.get("estimatedKlines", status["totalKlines"])
+
+        elif event_type == "batch":
+            status["batchCount"] = event["batch"]
+            status["currentBatch"]["startTime"] = event["startTime"]
+            status["currentBatch"]["endTime"] = event["endTime"]
+
+        elif event_type == "insert":
+            status["currentBatch"]["count"] = event["count"]
+            status["collectedKlines"] += event["count"]
+            status["collectionHistory"].append({
+                "timestamp": datetime.fromtimestamp(event["ts"]).isoformat(),
+                "count": event["count"],
+                "progress": status["progress"]
+            })
+            if len(status["collectionHistory"]) > HISTORY_LIMIT:
+                status["collectionHistory"] = status["collectionHistory"][-HISTORY_LIMIT:]
+
+        elif event_type == "progress":
+            status["progress"] = event["progress"]
+            status["collectedKlines"] = event["collected"]
+
+        elif event_type == "complete":
+            status["collectedKlines"] = event["collected"]
+            status["progress"] = 100
+
+        elif event_type == "error":
+            status["error"] = event["message"]
+
+    def delta(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """進度事件對應的增量更新，只包含該事件改變的字段"""
+        status = self.status
+        event_type = event.get("type")
+        result = {
+            "jobId": self.id,
+            "event": event_type,
+            "progress": status["progress"],
+            "collectedKlines": status["collectedKlines"]
+        }
+        if event_type == "start":
+            result["totalKlines"] = status["totalKlines"]
+        elif event_type == "batch":
+            result["batchCount"] = status["batchCount"]
+            result["currentBatch"] = dict(status["currentBatch"])
+        elif event_type == "insert":
+            result["currentBatch"] = dict(status["currentBatch"])
+            result["history"] = status["collectionHistory"][-1]
+        elif event_type == "error":
+            result["error"] = status["error"]
+            result["fatal"] = bool(event.get("fatal"))
+        return result
+
+    def to_dict(self, include_history: bool = True) -> Dict[str, Any]:
+        """API 響應格式: 原狀態字段加上任務信息"""
+        result = dict(self.status)
+        if not include_history:
+            result.pop("collectionHistory")
+        result.update({
+            "jobId": self.id,
+            "state": self.state,
+            "priority": self.priority,
+            "exchange": self.exchange,
+            "repair": bool(self.params.get("repair")),
+            "resumed": self.resumed,
+            "createdAt": datetime.fromtimestamp(self.created_at).isoformat(),
+            "startedAt": datetime.fromtimestamp(self.started_at).isoformat() if self.started_at else None,
+            "finishedAt": datetime.fromtimestamp(self.finished_at).isoformat() if self.finished_at else None
+        })
+        return result
+
+    def to_record(self) -> Dict[str, Any]:
+        """持久化記錄"""
+        return {
+            "id": self.id,
+            "params": self.params,
+            "exchange": self.exchange,
+            "priority": self.priority,
+            "state": self.state,
+            "status": self.status,
+            "pid": self.pid,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+            "resumed": self.resumed
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], seq: int) -> 'CollectionJob':
+        job = cls(record["id"], record["params"], record.get("exchange", ""), record.get("priority", 0), seq)
+        job.state = record.get("state", "failed")
+        job.status = record.get("status") or new_status(job.params)
+        job.pid = record.get("pid")
+        job.created_at = record.get("createdAt", job.created_at)
+        job.started_at = record.get("startedAt")
+        job.finished_at = record.get("finishedAt")
+        job.resumed = record.get("resumed", False)
+        return job
+
+
+class CollectionJobManager:
+    """收集任務隊列與進程管理
+
+    build_command(params) 返回啟動收集進程的命令（不含 --progress_fd）。
+    同時運行的任務數不超過 max_concurrent，同一交易所不超過 exchange_limits 中的上限
+    （未列出的交易所使用 default_exchange_limit），同一交易所的進程共享交易所的請求額度。
+    add_listener 註冊的回調以 (事件名, 數據, 任務 ID) 調用: 'job' 為狀態變化後的完整任務，
+    'progress' 為 CollectionJob.delta 的增量。回調在讀取或調度線程中調用，不應阻塞。
+    """
+
+    def __init__(self, build_command: Callable[[Dict[str, Any]], List[str]], state_path: Optional[str] = None,
+                 max_concurrent: int = 4, exchange_limits: Optional[Dict[str, int]] = None,
+                 default_exchange_limit: int = 2, persist_interval: float = 2.0):
+        self.build_command = build_command
+        self.state_path = state_path
+        self.max_concurrent = max_concurrent
+        self.exchange_limits = {name.lower(): limit for name, limit in (exchange_limits or {}).items()}
+        self.default_exchange_limit = default_exchange_limit
+        self.persist_interval = persist_interval
+
+        self._lock = threading.RLock()
+        self._jobs: Dict[str, CollectionJob] = {}
+        # (-priority, seq, job_id)，優先級高、提交早的任務先運行
+        self._queue: List = []
+        self._seq = itertools.count()
+        self._persisted_at = 0.0
+        self._persist_lock = threading.Lock()
+        self._listeners: List[Callable[[str, Dict[str, Any], str], None]] = []
+
+    # ---- 事件 ----
+
+    def add_listener(self, listener: Callable[[str, Dict[str, Any], str], None]) -> None:
+        self._listeners.append(listener)
+
+    def _notify(self, name: str, data: Dict[str, Any], job_id: str) -> None:
+        for listener in self._listeners:
+            try:
+                listener(name, data, job_id)
+            except Exception as e:
+                logger.error(f"發送任務 {job_id} 事件失敗: {e}")
+
+    def _notify_job(self, job: CollectionJob) -> None:
+        with self._lock:
+            data = job.to_dict(include_history=False)
+        self._notify('job', data, job.id)
+
+    # ---- 持久化 ----
+
+    def load(self) -> None:
+        """從狀態文件恢復任務；上次未完成的任務以修復模式重新排隊，收集進程仍在運行的任務標記為失敗"""
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                records = json.load(f).get("jobs", [])
+        except (OSError, ValueError) as e:
+            logger.error(f"讀取收集任務狀態失敗: {e}")
+            return
+
+        resumed = orphaned = 0
+        with self._lock:
+            for record in records:
+                job = CollectionJob.from_record(record, next(self._seq))
+                if job.state == 'running' and job.pid and self._pid_alive(job.pid):
+                    # 舊的收集進程仍在寫入，再啟動一個會重複收集同一序列；無法重新接管其進度管道，標記為失敗
+                    logger.warning(f"任務 {job.id} 的收集進程 (pid {job.pid}) 仍在運行，不重新排隊")
+                    job.state = 'failed'
+                    job.status["isCollecting"] = False
+                    job.status["error"] = f"API 重啟時收集進程 (pid {job.pid}) 仍在運行，已脫離管理，結束後可重新提交"
+                    job.finished_at = time.time()
+                    orphaned += 1
+                elif job.state in ACTIVE_STATES:
+                    # 已寫入的數據由覆蓋索引記錄，修復模式只補齊缺失區間
+                    job.params = dict(job.params, repair=True)
+                    job.state = 'queued'
+                    job.status = new_status(job.params)
+                    job.pid = None
+                    job.started_at = None
+                    job.resumed = True
+                    heapq.heappush(self._queue, (-job.priority, job.seq, job.id))
+                    resumed += 1
+                self._jobs[job.id] = job
+        if resumed:
+            logger.info(f"已恢復 {resumed} 個未完成的收集任務（修復模式）")
+        if orphaned:
+            self._persist(force=True)
+        self._schedule()
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def _persist(self, force: bool = False) -> None:
+        """寫入狀態文件（原子替換）；進度更新按 persist_interval 節流，狀態變化時立即寫入"""
+        if not self.state_path:
+            return
+        now = time.monotonic()
+        if not force and now - self._persisted_at < self.persist_interval:
+            return
+        with self._lock:
+            self._persisted_at = now
+            jobs = sorted(self._jobs.values(), key=lambda job: job.created_at)
+            finished = [job for job in jobs if job.state in FINISHED_STATES]
+            drop = {job.id for job in finished[:max(0, len(finished) - FINISHED_JOBS_LIMIT)]}
+            for job_id in drop:
+                del self._jobs[job_id]
+            payload = json.dumps({"jobs": [job.to_record() for job in jobs if job.id not in drop]},
+                                 ensure_ascii=False)
+        with self._persist_lock:
+            tmp_path = f"{self.state_path}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                os.replace(tmp_path, self.state_path)
+            except OSError as e:
+                logger.error(f"保存收集任務狀態失敗: {e}")
+
+    # ---- 任務操作 ----
+
+    def submit(self, params: Dict[str, Any], exchange: str = '', priority: int = 0) -> CollectionJob:
+        """提交任務，有空閒額度時立即啟動"""
+        with self._lock:
+            job = CollectionJob(uuid.uuid4().hex[:12], params, exchange, priority, next(self._seq))
+            self._jobs[job.id] = job
+            heapq.heappush(self._queue, (-job.priority, job.seq, job.id))
+        logger.info(f"收集任務 {job.id} 已提交: {params.get('symbol')} {params.get('interval')} "
+                    f"({exchange or '未知交易所'}, 優先級 {priority})")
+        self._notify_job(job)
+        self._schedule()
+        self._persist(force=True)
+        return job
+
+    def stop(self, job_id: str) -> Optional[CollectionJob]:
+        """停止任務：排隊中的直接取消，運行中的終止進程"""
+        process = None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.state == 'queued':
+                job.state = 'stopped'
+                job.status["isCollecting"] = False
+                job.finished_at = time.time()
+                # 隊列中的條目在調度時跳過
+            elif job.state == 'running':
+                job.stop_requested = True
+                process = job.process
+            else:
+                return job
+        if process is None:
+            self._notify_job(job)
+        else:
+            process.terminate()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._persist(force=True)
+        return job
+
+    def get(self, job_id: str) -> Optional[CollectionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self, state: Optional[str] = None) -> List[CollectionJob]:
+        """按提交時間倒序列出任務"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if state is None or job.state == state]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def latest(self) -> Optional[CollectionJob]:
+        """最近提交的任務（兼容單任務接口）；優先返回未結束的任務"""
+        jobs = self.list_jobs()
+        return next((job for job in jobs if job.state in ACTIVE_STATES), jobs[0] if jobs else None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            running = [job for job in self._jobs.values() if job.state == 'running']
+            per_exchange: Dict[str, int] = {}
+            for job in running:
+                per_exchange[job.exchange] = per_exchange.get(job.exchange, 0) + 1
+            return {
+                "running": len(running),
+                "queued": sum(1 for job in self._jobs.values() if job.state == 'queued'),
+                "maxConcurrent": self.max_concurrent,
+                "runningPerExchange": per_exchange,
+                "exchangeLimits": self.exchange_limits,
+                "defaultExchangeLimit": self.default_exchange_limit
+            }
+
+    # ---- 調度 ----
+
+    def _exchange_limit(self, exchange: str) -> int:
+        return self.exchange_limits.get(exchange.lower(), self.default_exchange_limit)
+
+    def _schedule(self) -> None:
+        """按優先級啟動排隊任務，直到達到全局或交易所上限"""
+        to_launch = []
+        with self._lock:
+            running = [job for job in self._jobs.values() if job.state == 'running']
+            per_exchange: Dict[str, int] = {}
+            for job in running:
+                per_exchange[job.exchange] = per_exchange.get(job.exchange, 0) + 1
+            slots = self.max_concurrent - len(running)
+
+            blocked = []
+            while self._queue and slots > 0:
+                entry = heapq.heappop(self._queue)
+                job = self._jobs.get(entry[2])
+                if job is None or job.state != 'queued':
+                    continue
+                if per_exchange.get(job.exchange, 0) >= self._exchange_limit(job.exchange):
+                    blocked.append(entry)
+                    continue
+                per_exchange[job.exchange] = per_exchange.get(job.exchange, 0) + 1
+                slots -= 1
+                job.state = 'running'
+                job.started_at = time.time()
+                to_launch.append(job)
+            for entry in blocked:
+                heapq.heappush(self._queue, entry)
+
+        for job in to_launch:
+            self._notify_job(job)
+            self._launch(job)
+        if to_launch:
+            self._persist(force=True)
+
+    def _launch(self, job: CollectionJob) -> None:
+        """啟動收集進程，進度通過專用管道傳遞
+
+        收集進程的日誌寫入它自己的 data_collection.log，標準輸出不接 PIPE（無人讀取時寫滿會阻塞）。
+        """
+        read_fd, write_fd = os.pipe()
+        cmd = self.build_command(job.params) + ["--progress_fd", str(write_fd)]
+        logger.info(f"啟動收集任務 {job.id}: {' '.join(cmd)}")
+        try:
+            process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                       pass_fds=(write_fd,))
+        except Exception as e:
+            os.close(read_fd)
+            logger.error(f"啟動收集任務 {job.id} 失敗: {e}")
+            with self._lock:
+                job.status["error"] = f"啟動收集進程失敗: {e}"
+            self._finish(job, None)
+            return
+        finally:
+            # 父進程不持有寫端，子進程退出後讀端才能收到 EOF
+            os.close(write_fd)
+
+        with self._lock:
+            job.process = process
+            job.pid = process.pid
+            if job.stop_requested:
+                # 啟動期間收到停止請求
+                process.terminate()
+        reader = threading.Thread(target=self._read_events, args=(job, read_fd), daemon=True)
+        reader.start()
+
+    def _read_events(self, job: CollectionJob, read_fd: int) -> None:
+        """阻塞讀取任務的進度事件（每行一個 JSON），進程退出後讀到 EOF"""
+        try:
+            with os.fdopen(read_fd, 'r', encoding='utf-8') as stream:
+                for line in stream:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"任務 {job.id} 的進度事件無法解析: {line.strip()}")
+                        continue
+                    with self._lock:
+                        job.apply_event(event)
+                        delta = job.delta(event)
+                    self._notify('progress', delta, job.id)
+                    self._persist()
+        except Exception as e:
+            logger.error(f"讀取任務 {job.id} 進度事件時出錯: {e}")
+            with self._lock:
+                job.status["error"] = str(e)
+        finally:
+            self._finish(job, job.process.wait() if job.process else None)
+
+    def _finish(self, job: CollectionJob, returncode: Optional[int]) -> None:
+        """記錄任務結束狀態並啟動排隊中的任務"""
+        with self._lock:
+            job.process = None
+            job.finished_at = time.time()
+            job.status["isCollecting"] = False
+            if job.stop_requested:
+                job.state = 'stopped'
+            elif returncode == 0:
+                job.state = 'completed'
+                job.status["progress"] = 100
+            else:
+                job.state = 'failed'
+                if not job.status["error"]:
+                    job.status["error"] = f"收集進程異常退出 (退出碼 {returncode})"
+        logger.info(f"收集任務 {job.id} 已結束: {job.state}")
+        self._notify_job(job)
+        self._persist(force=True)
+        self._schedule()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+API 數據庫連接池
+進程級共享的 psycopg2 連接池：阻塞等待空閒連接、借出前健康檢查、按最大存活時間回收，
+並在每個連接上按需 PREPARE 常用查詢；同時記錄池大小與等待時間等指標
+"""
+
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Sequence
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+
+logger = logging.getLogger("data_collection_api")
+
+
+class PoolTimeoutError(Exception):
+    """等待空閒連接超時"""
+
+
+class _ConnectionInfo:
+    """連接的元數據"""
+
+    __slots__ = ('created_at', 'checked_at', 'prepared')
+
+    def __init__(self):
+        self.created_at = time.monotonic()
+        self.checked_at = self.created_at
+        self.prepared = set()
+
+
+class DatabasePool:
+    """帶健康檢查、最大存活時間與預備語句的線程安全連接池"""
+
+    def __init__(self, db_config: Dict[str, Any], minconn: int = 2, maxconn: int = 20,
+                 max_lifetime: float = 1800.0, health_check_interval: float = 30.0,
+                 acquire_timeout: float = 5.0):
+        self.db_config = db_config
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, **db_config)
+        # psycopg2 的池在空閒連接達到 minconn 後會關閉歸還的連接；
+        # 啟動時只預建 minconn 個，之後保留最多 maxconn 個空閒連接以避免反覆握手
+        self._pool.minconn = maxconn
+        # ThreadedConnectionPool 在連接耗盡時直接拋錯，用信號量實現阻塞等待
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._info: Dict[int, _ConnectionInfo] = {}
+        self._statements: Dict[str, str] = {}
+
+        self._in_use = 0
+        self._waiting = 0
+        self._metrics = {
+            'acquired': 0,
+            'timeouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'health_check_failures': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0
+        }
+        self._wait_samples = deque(maxlen=1000)
+
+    def register_statement(self, name: str, sql: str) -> None:
+        """註冊預備語句（使用 $1, $2 ... 參數），在每個連接首次使用時 PREPARE"""
+        self._statements[name] = sql
+
+    def _info_for(self, conn) -> _ConnectionInfo:
+        info = self._info.get(id(conn))
+        if info is None:
+            info = self._info[id(conn)] = _ConnectionInfo()
+            conn.autocommit = True
+            self._metrics['created'] += 1
+        return info
+
+    def _discard(self, conn) -> None:
+        self._info.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def _checkout(self):
+        """從池中取出一個可用連接：過期的回收，閒置過久的先做健康檢查"""
+        while True:
+            conn = self._pool.getconn()
+            with self._lock:
+                info = self._info_for(conn)
+            now = time.monotonic()
+
+            if conn.closed or now - info.created_at > self.max_lifetime:
+                with self._lock:
+                    self._metrics['recycled'] += 1
+                self._discard(conn)
+                continue
+
+            if now - info.checked_at > self.health_check_interval:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                except psycopg2.Error as e:
+                    logger.warning(f"連接健康檢查失敗，重新建立連接: {e}")
+                    with self._lock:
+                        self._metrics['health_check_failures'] += 1
+                    self._discard(conn)
+                    continue
+                info.checked_at = now
+            return conn
+
+    @contextmanager
+    def connection(self):
+        """借出一個連接，使用完畢自動歸還"""
+        started = time.perf_counter()
+        with self._lock:
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=self.acquire_timeout)
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._waiting -= 1
+            if not acquired:
+                self._metrics['timeouts'] += 1
+        if not acquired:
+            raise PoolTimeoutError(f"等待數據庫連接超時 ({self.acquire_timeout} 秒)")
+
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._metrics['acquired'] += 1
+            self._metrics['wait_seconds_total'] += waited
+            self._metrics['wait_seconds_max'] = max(self._metrics['wait_seconds_max'], waited)
+            self._wait_samples.append(waited)
+
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            if broken or conn.closed:
+                self._discard(conn)
+            else:
+                self._info[id(conn)].checked_at = time.monotonic()
+                self._pool.putconn(conn)
+            self._slots.release()
+
+    def execute(self, cursor, name: str, params: Sequence[Any] = ()) -> None:
+        """在游標所屬連接上執行已註冊的預備語句"""
+        info = self._info[id(cursor.connection)]
+        if name not in info.prepared:
+            cursor.execute(f"PREPARE {name} AS {self._statements[name]}")
+            info.prepared.add(name)
+        if params:
+            placeholders = ', '.join(['%s'] * len(params))
+            cursor.execute(f"EXECUTE {name} ({placeholders})", tuple(params))
+        else:
+            cursor.execute(f"EXECUTE {name}")
+
+    def stats(self) -> Dict[str, Any]:
+        """連接池指標"""
+        with self._lock:
+            samples = sorted(self._wait_samples)
+            acquired = self._metrics['acquired']
+
+            def percentile(p):
+                if not samples:
+                    return 0.0
+                return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+            return {
+                'minConnections': self.minconn,
+                'maxConnections': self.maxconn,
+                'open': len(self._info),
+                'inUse': self._in_use,
+                'idle': len(self._info) - self._in_use,
+                'waiting': self._waiting,
+                'acquired': acquired,
+                'timeouts': self._metrics['timeouts'],
+                'created': self._metrics['created'],
+                'recycled': self._metrics['recycled'],
+                'healthCheckFailures': self._metrics['health_check_failures'],
+                'waitMsAvg': (self._metrics['wait_seconds_total'] / acquired * 1000) if acquired else 0.0,
+                'waitMsMax': self._metrics['wait_seconds_max'] * 1000,
+                'waitMsP50': percentile(0.5),
+                'waitMsP99': percentile(0.99)
+            }
+
+    def close(self) -> None:
+        """關閉所有連接"""
+        self._pool.closeall()
+        with self._lock:
+            self._info.clear()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+服務器推送事件 (Server-Sent Events)
+EventBroker 把事件分發到每個連接自己的有界隊列，stream_events 把隊列轉為 text/event-stream 響應體；
+沒有事件時連接只在心跳間隔發送一行註釋。KlineStreamHub 訂閱K線寫入通知，
+只為有連接訂閱的序列讀取一次新寫入的K線並推送
+"""
+
+import json
+import queue
+import threading
+import logging
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("data_collection_api")
+
+# 心跳間隔（秒）：防止代理因空閒斷開連接，同時及時發現已關閉的連接
+HEARTBEAT_INTERVAL = 15.0
+
+# 斷線後瀏覽器自動重連的等待時間（毫秒）
+RETRY_MS = 3000
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+def format_event(name: str, data: Dict[str, Any]) -> str:
+    """按 SSE 格式編碼一個事件"""
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+class EventBroker:
+    """按主題分發事件
+
+    訂閱時 topic 為 None 的連接接收全部事件，否則只接收該主題的事件。
+    連接的隊列寫滿（客戶端讀取太慢）時丟棄積壓並發送 resync，由客戶端重新獲取完整狀態。
+    """
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers: Dict[queue.Queue, Optional[str]] = {}
+
+    def subscribe(self, topic: Optional[str] = None) -> queue.Queue:
+        events: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers[events] = topic
+        return events
+
+    def unsubscribe(self, events: queue.Queue) -> None:
+        with self._lock:
+            self._subscribers.pop(events, None)
+
+    def has_subscribers(self, topic: Optional[str] = None) -> bool:
+        """是否有連接會收到該主題的事件"""
+        with self._lock:
+            return any(subscribed is None or subscribed == topic for subscribed in self._subscribers.values())
+
+    def topics(self) -> List[str]:
+        """當前被訂閱的主題"""
+        with self._lock:
+            return sorted({topic for topic in self._subscribers.values() if topic is not None})
+
+    def publish(self, name: str, data: Dict[str, Any], topic: Optional[str] = None) -> None:
+        """發布事件；topic 為 None 時發給全部連接"""
+        with self._lock:
+            targets = [events for events, subscribed in self._subscribers.items()
+                       if topic is None or subscribed is None or subscribed == topic]
+        for events in targets:
+            try:
+                events.put_nowait((name, data))
+            except queue.Full:
+                self._overflow(events)
+
+    @staticmethod
+    def _overflow(events: queue.Queue) -> None:
+        try:
+            while True:
+                events.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            events.put_nowait(('resync', {}))
+        except queue.Full:
+            pass
+
+
+def stream_events(broker: EventBroker, events: queue.Queue, initial: Iterable[Event] = (),
+                  heartbeat: float = HEARTBEAT_INTERVAL) -> Iterator[str]:
+    """SSE 響應體：先發送 initial，再阻塞等待隊列中的事件；連接關閉時取消訂閱"""
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        for name, data in initial:
+            yield format_event(name, data)
+        while True:
+            try:
+                name, data = events.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            yield format_event(name, data)
+    finally:
+        broker.unsubscribe(events)
+
+
+def kline_topic(symbol: str, interval: str) -> str:
+    return f"{symbol}|{interval}"
+
+
+def matrix_to_candles(matrix: np.ndarray) -> List[Dict[str, Any]]:
+    """(n, 6) K線矩陣轉為與 /api/kline-data 行式 JSON 相同的對象"""
+    return [
+        {'time': int(row[0]), 'open': row[1], 'high': row[2], 'low': row[3], 'close': row[4], 'volume': row[5]}
+        for row in matrix.tolist()
+    ]
+
+
+class KlineStreamHub:
+    """K線寫入通知的訂閱者，把新寫入的K線推送給訂閱了該序列的連接
+
+    reader(symbol, interval, start, end) 返回 [start, end] 內的K線矩陣（通常為 KlineCache.read_range）；
+    須在緩存之後訂閱寫入通知，讀到的是緩存失效後的新數據。
+    """
+
+    def __init__(self, reader: Callable[[str, str, float, float], np.ndarray],
+                 interval_seconds: Dict[str, int], dependents: Optional[Dict[str, List[str]]] = None,
+                 broker: Optional[EventBroker] = None):
+        self.reader = reader
+        self.interval_seconds = interval_seconds
+        # 週期 -> 由它聚合而來的週期，基礎週期寫入時這些週期的最新一根也會變化
+        self.dependents = dependents if dependents is not None else {}
+        self.broker = broker or EventBroker()
+        self.listening = False
+
+    def subscribe(self, symbol: str, interval: str) -> queue.Queue:
+        return self.broker.subscribe(kline_topic(symbol, interval))
+
+    def invalidate(self, symbol: str, interval: str, start: float, end: float) -> None:
+        """推送 [start, end] 所在的K線（派生週期推送覆蓋該範圍的聚合K線）"""
+        topic = kline_topic(symbol, interval)
+        if self.broker.has_subscribers(topic):
+            step = self.interval_seconds.get(interval, 60)
+            matrix = self.reader(symbol, interval, start // step * step, end)
+            if len(matrix):
+                self.broker.publish('candles', {
+                    'symbol': symbol,
+                    'interval': interval,
+                    'data': matrix_to_candles(matrix)
+                }, topic)
+
+        for dependent in self.dependents.get(interval, []):
+            self.invalidate(symbol, dependent, start, end)
+
+    def clear(self) -> None:
+        """重新監聽：斷線期間可能錯過寫入，通知全部連接重新加載"""
+        for topic in self.broker.topics():
+            self.broker.publish('resync', {}, topic)
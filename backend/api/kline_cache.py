@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+K線讀穿緩存
+按 (symbol, interval, 對齊的時間塊) 緩存查詢結果。已收盤的塊不再變化，常駐於按字節數限制的 LRU 中，
+淘汰時可落盤；仍在形成中的尾部塊在收到寫入通知（LISTEN/NOTIFY）時失效
+"""
+
+import json
+import os
+import re
+import select
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import psycopg2
+
+logger = logging.getLogger("data_collection_api")
+
+# 與 import_to_database.KLINE_CHANGED_CHANNEL 一致
+KLINE_CHANGED_CHANNEL = 'kline_data_changed'
+
+# 塊內數據為按時間正序的 (n, 6) float64 矩陣: time(Unix 秒), open, high, low, close, volume
+ROW_WIDTH = 6
+
+BlockKey = Tuple[str, str, int]
+
+
+def _empty_matrix() -> np.ndarray:
+    return np.empty((0, ROW_WIDTH), dtype=np.float64)
+
+
+class _Block:
+    __slots__ = ('matrix', 'closed', 'loaded_at')
+
+    def __init__(self, matrix: np.ndarray, closed: bool):
+        self.matrix = matrix
+        self.closed = closed
+        self.loaded_at = time.monotonic()
+
+
+class KlineCache:
+    """按時間塊緩存K線的讀穿緩存
+
+    loader(symbol, interval, start, end) 返回 [start, end]（Unix 秒，含兩端）內按時間正序的矩陣；
+    bounds_loader(symbol, interval) 返回該序列的 (最早, 最新) 時間，無數據時返回 None。
+    """
+
+    def __init__(self, loader: Callable[[str, str, int, int], np.ndarray],
+                 bounds_loader: Callable[[str, str], Optional[Tuple[int, int]]],
+                 interval_seconds: Dict[str, int], max_bytes: int = 256 * 1024 * 1024,
+                 block_candles: int = 1000, spill_dir: Optional[str] = None,
+                 open_block_ttl: float = 5.0):
+        self.loader = loader
+        self.bounds_loader = bounds_loader
+        self.interval_seconds = interval_seconds
+        self.max_bytes = max_bytes
+        self.block_candles = block_candles
+        self.spill_dir = spill_dir
+        self.open_block_ttl = open_block_ttl
+        # 監聽線程在線時尾部塊與序列邊界只靠寫入通知失效，否則按 open_block_ttl 過期
+        self.listening = False
+        # 週期 -> 由它聚合而來的週期（連續聚合），寫入通知需要一併失效
+        self.dependents: Dict[str, List[str]] = {}
+
+        self._lock = threading.Lock()
+        self._blocks: 'OrderedDict[BlockKey, _Block]' = OrderedDict()
+        self._bytes = 0
+        self._bounds: Dict[Tuple[str, str], Tuple[int, int, float]] = {}
+        # 每個序列的失效代數：加載期間發生失效時丟棄加載結果，避免把舊數據放回緩存
+        self._generations: Dict[Tuple[str, str], int] = {}
+        self._metrics = {
+            'hits': 0, 'misses': 0, 'disk_hits': 0, 'evictions': 0,
+            'spilled': 0, 'invalidations': 0, 'db_loads': 0
+        }
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            # 停機期間數據可能被修復，上次落盤的塊不可信
+            for name in os.listdir(spill_dir):
+                if name.endswith('.npy'):
+                    os.remove(os.path.join(spill_dir, name))
+
+    # ---- 塊定位 ----
+
+    def block_span(self, interval: str) -> int:
+        return self.interval_seconds.get(interval, 3600) * self.block_candles
+
+    def block_start(self, interval: str, timestamp: float) -> int:
+        span = self.block_span(interval)
+        return int(timestamp // span) * span
+
+    def _is_closed(self, interval: str, block_start: int) -> bool:
+        """塊內最後一根K線已收盤"""
+        step = self.interval_seconds.get(interval, 3600)
+        current_open = int(time.time() // step) * step
+        return block_start + self.block_span(interval) <= current_open
+
+    def _spill_path(self, key: BlockKey) -> str:
+        symbol, interval, block_start = key
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', f"{symbol}_{interval}_{block_start}")
+        return os.path.join(self.spill_dir, f"{name}.npy")
+
+    # ---- LRU ----
+
+    def _lookup(self, key: BlockKey) -> Optional[np.ndarray]:
+        """在內存或落盤文件中查找塊（調用方持有鎖）"""
+        block = self._blocks.get(key)
+        if block is not None:
+            if not block.closed and not self.listening and \
+                    time.monotonic() - block.loaded_at > self.open_block_ttl:
+                self._remove(key)
+            else:
+                self._blocks.move_to_end(key)
+                self._metrics['hits'] += 1
+                return block.matrix
+
+        if self.spill_dir:
+            path = self._spill_path(key)
+            if os.path.exists(path):
+                matrix = np.load(path)
+                os.remove(path)
+                self._insert(key, _Block(matrix, True))
+                self._metrics['disk_hits'] += 1
+                return matrix
+
+        self._metrics['misses'] += 1
+        return None
+
+    def _insert(self, key: BlockKey, block: _Block) -> None:
+        self._remove(key)
+        if block.matrix.nbytes > self.max_bytes:
+            return
+        self._blocks[key] = block
+        self._bytes += block.matrix.nbytes
+        while self._bytes > self.max_bytes and self._blocks:
+            evicted_key, evicted = self._blocks.popitem(last=False)
+            self._bytes -= evicted.matrix.nbytes
+            self._metrics['evictions'] += 1
+            if self.spill_dir and evicted.closed:
+                np.save(self._spill_path(evicted_key), evicted.matrix)
+                self._metrics['spilled'] += 1
+
+    def _remove(self, key: BlockKey) -> None:
+        block = self._blocks.pop(key, None)
+        if block is not None:
+            self._bytes -= block.matrix.nbytes
+
+    # ---- 讀取 ----
+
+    def bounds(self, symbol: str, interval: str) -> Optional[Tuple[int, int]]:
+        """序列的 (最早, 最新) 時間（Unix 秒），無數據時返回 None"""
+        series = (symbol, interval)
+        with self._lock:
+            cached = self._bounds.get(series)
+            if cached is not None and (self.listening or time.monotonic() - cached[2] <= self.open_block_ttl):
+                return cached[0], cached[1]
+            generation = self._generations.get(series, 0)
+
+        bounds = self.bounds_loader(symbol, interval)
+        if bounds is None:
+            return None
+        with self._lock:
+            if self._generations.get(series, 0) == generation:
+                self._bounds[series] = (int(bounds[0]), int(bounds[1]), time.monotonic())
+        return int(bounds[0]), int(bounds[1])
+
+    def _load_blocks(self, symbol: str, interval: str, first_block: int, last_block: int) -> List[np.ndarray]:
+        """返回 [first_block, last_block] 內的全部塊，缺失的連續塊合併為一次數據庫查詢"""
+        span = self.block_span(interval)
+        starts = list(range(first_block, last_block + 1, span))
+        series = (symbol, interval)
+        with self._lock:
+            found = {start: self._lookup((symbol, interval, start)) for start in starts}
+            generation = self._generations.get(series, 0)
+
+        missing = [start for start in starts if found[start] is None]
+        runs: List[List[int]] = []
+        for start in missing:
+            if runs and runs[-1][-1] + span == start:
+                runs[-1].append(start)
+            else:
+                runs.append([start])
+
+        for run in runs:
+            matrix = self.loader(symbol, interval, run[0], run[-1] + span - 1)
+            times = matrix[:, 0]
+            loaded = {}
+            for start in run:
+                lo, hi = np.searchsorted(times, [start, start + span])
+                loaded[start] = np.ascontiguousarray(matrix[lo:hi])
+            found.update(loaded)
+            with self._lock:
+                self._metrics['db_loads'] += 1
+                if self._generations.get(series, 0) == generation:
+                    for start, block_matrix in loaded.items():
+                        self._insert((symbol, interval, start), _Block(block_matrix, self._is_closed(interval, start)))
+
+        return [found[start] for start in starts]
+
+    def read_range(self, symbol: str, interval: str, start: Optional[float] = None,
+                   end: Optional[float] = None) -> np.ndarray:
+        """讀取 [start, end]（含兩端）內的K線，未指定的一端取序列邊界"""
+        bounds = self.bounds(symbol, interval)
+        if bounds is None:
+            return _empty_matrix()
+        start = bounds[0] if start is None else max(start, bounds[0])
+        end = bounds[1] if end is None else min(end, bounds[1])
+        if start > end:
+            return _empty_matrix()
+
+        blocks = self._load_blocks(symbol, interval, self.block_start(interval, start), self.block_start(interval, end))
+        matrix = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+        times = matrix[:, 0]
+        return matrix[np.searchsorted(times, start, side='left'):np.searchsorted(times, end, side='right')]
+
+    def _collect(self, symbol: str, interval: str, count: int, start: int, end: int,
+                 newest_first: bool) -> np.ndarray:
+        """從 end（或 start）一側逐批加載塊，直到湊夠 count 根或到達另一端"""
+        span = self.block_span(interval)
+        batch = -(-count // self.block_candles) + 1
+        lowest_block = self.block_start(interval, start)
+        highest_block = self.block_start(interval, end)
+        collected: List[np.ndarray] = []
+        total = 0
+        cursor = highest_block if newest_first else lowest_block
+        while total < count and lowest_block <= cursor <= highest_block:
+            if newest_first:
+                first_block, last_block = max(lowest_block, cursor - (batch - 1) * span), cursor
+                cursor = first_block - span
+            else:
+                first_block, last_block = cursor, min(highest_block, cursor + (batch - 1) * span)
+                cursor = last_block + span
+            blocks = self._load_blocks(symbol, interval, first_block, last_block)
+            chunk = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+            times = chunk[:, 0]
+            chunk = chunk[np.searchsorted(times, start, side='left'):np.searchsorted(times, end, side='right')]
+            if newest_first:
+                collected.insert(0, chunk)
+            else:
+                collected.append(chunk)
+            total += len(chunk)
+
+        if not collected:
+            return _empty_matrix()
+        matrix = np.concatenate(collected) if len(collected) > 1 else collected[0]
+        return matrix[-count:] if newest_first else matrix[:count]
+
+    def read_last(self, symbol: str, interval: str, count: int, start: Optional[int] = None,
+                  end: Optional[int] = None) -> np.ndarray:
+        """讀取 [start, end] 內最新的 count 根K線"""
+        bounds = self.bounds(symbol, interval)
+        if bounds is None or count <= 0:
+            return _empty_matrix()
+        start = bounds[0] if start is None else max(start, bounds[0])
+        end = bounds[1] if end is None else min(end, bounds[1])
+        if start > end:
+            return _empty_matrix()
+        return self._collect(symbol, interval, count, start, end, newest_first=True)
+
+    def read_first(self, symbol: str, interval: str, count: int, start: Optional[int] = None,
+                   end: Optional[int] = None) -> np.ndarray:
+        """讀取 [start, end] 內最早的 count 根K線"""
+        bounds = self.bounds(symbol, interval)
+        if bounds is None or count <= 0:
+            return _empty_matrix()
+        start = bounds[0] if start is None else max(start, bounds[0])
+        end = bounds[1] if end is None else min(end, bounds[1])
+        if start > end:
+            return _empty_matrix()
+        return self._collect(symbol, interval, count, start, end, newest_first=False)
+
+    # ---- 失效 ----
+
+    def invalidate(self, symbol: str, interval: str, start: float, end: float) -> None:
+        """[start, end] 內有新寫入：丟棄重疊的塊（含落盤文件）並擴展序列邊界"""
+        series = (symbol, interval)
+        first_block = self.block_start(interval, start)
+        last_block = self.block_start(interval, end)
+        with self._lock:
+            self._generations[series] = self._generations.get(series, 0) + 1
+            for block_start in range(first_block, last_block + 1, self.block_span(interval)):
+                key = (symbol, interval, block_start)
+                self._remove(key)
+                if self.spill_dir:
+                    path = self._spill_path(key)
+                    if os.path.exists(path):
+                        os.remove(path)
+            bounds = self._bounds.get(series)
+            if bounds is not None:
+                self._bounds[series] = (min(bounds[0], int(start)), max(bounds[1], int(end)), bounds[2])
+            self._metrics['invalidations'] += 1
+
+        for dependent in self.dependents.get(interval, []):
+            self.invalidate(symbol, dependent, start, end)
+
+    def clear(self) -> None:
+        """清空全部緩存（例如錯過了寫入通知）"""
+        with self._lock:
+            for series in list(self._generations) + list(self._bounds):
+                self._generations[series] = self._generations.get(series, 0) + 1
+            self._blocks.clear()
+            self._bounds.clear()
+            self._bytes = 0
+            if self.spill_dir:
+                for name in os.listdir(self.spill_dir):
+                    if name.endswith('.npy'):
+                        os.remove(os.path.join(self.spill_dir, name))
+
+    def stats(self) -> Dict[str, Any]:
+        """緩存指標"""
+        with self._lock:
+            lookups = self._metrics['hits'] + self._metrics['disk_hits'] + self._metrics['misses']
+            return {
+                'blocks': len(self._blocks),
+                'bytes': self._bytes,
+                'maxBytes': self.max_bytes,
+                'blockCandles': self.block_candles,
+                'hits': self._metrics['hits'],
+                'diskHits': self._metrics['disk_hits'],
+                'misses': self._metrics['misses'],
+                'hitRate': (self._metrics['hits'] + self._metrics['disk_hits']) / lookups if lookups else 0.0,
+                'dbLoads': self._metrics['db_loads'],
+                'evictions': self._metrics['evictions'],
+                'spilled': self._metrics['spilled'],
+                'invalidations': self._metrics['invalidations'],
+                'listening': self.listening
+            }
+
+
+class KlineChangeListener(threading.Thread):
+    """在獨立連接上 LISTEN 寫入通知，轉發給訂閱者使其失效
+
+    訂閱者需提供 invalidate(symbol, interval, start, end)、clear() 與 listening 屬性。
+    """
+
+    def __init__(self, db_config: Dict[str, Any], subscribers: Optional[List[Any]] = None,
+                 channel: str = KLINE_CHANGED_CHANNEL, poll_timeout: float = 5.0):
+        super().__init__(name='kline-change-listener', daemon=True)
+        self.db_config = db_config
+        self.subscribers = list(subscribers or [])
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.connected = False
+        self._stop_event = threading.Event()
+
+    def add_subscriber(self, subscriber: Any) -> None:
+        """添加訂閱者（新訂閱者應為空狀態，無需補發之前的通知）"""
+        self.subscribers.append(subscriber)
+        subscriber.listening = self.connected
+
+    def _set_connected(self, connected: bool) -> None:
+        self.connected = connected
+        for subscriber in self.subscribers:
+            if connected:
+                # 斷線期間可能錯過通知，重新監聽後清空
+                subscriber.clear()
+            subscriber.listening = connected
+
+    def _handle(self, payload: str) -> None:
+        try:
+            change = json.loads(payload)
+            symbol, interval = change['symbol'], change['interval']
+            start, end = change['start_ms'] / 1000.0, change['end_ms'] / 1000.0
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"無法解析K線寫入通知 {payload!r}: {e}")
+            return
+        for subscriber in self.subscribers:
+            try:
+                subscriber.invalidate(symbol, interval, start, end)
+            except Exception as e:
+                logger.error(f"處理K線寫入通知失敗 ({type(subscriber).__name__}): {e}")
+
+    def run(self) -> None:
+        backoff = 1.0
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.db_config)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                self._set_connected(True)
+                backoff = 1.0
+                logger.info(f"開始監聽K線寫入通知 {self.channel}")
+
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle(conn.notifies.pop(0).payload)
+            except (psycopg2.Error, OSError, select.error) as e:
+                logger.warning(f"K線寫入通知監聽中斷，{backoff:.0f} 秒後重連: {e}")
+            finally:
+                self._set_connected(False)
+                if conn is not None:
+                    conn.close()
+            self._stop_event.wait(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    def stop(self) -> None:
+        self._stop_event.set()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+K線響應編碼
+把數據庫游標返回的元組一次性轉為列式 NumPy 數組，再按內容協商編碼為
+行式 JSON（兼容舊前端）、列式 JSON、緊湊二進制或 Arrow IPC 流
+"""
+
+import itertools
+import json
+import struct
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# 列順序與查詢語句的 SELECT 列表一致
+KLINE_COLUMNS = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+MIME_JSON = 'application/json'
+MIME_COLUMNAR_JSON = 'application/vnd.kline.columnar+json'
+MIME_BINARY = 'application/vnd.kline.binary'
+MIME_ARROW = 'application/vnd.apache.arrow.stream'
+
+# ?format= 參數的別名，方便在瀏覽器中調試
+FORMAT_ALIASES = {
+    'json': MIME_JSON,
+    'columnar': MIME_COLUMNAR_JSON,
+    'binary': MIME_BINARY,
+    'arrow': MIME_ARROW
+}
+
+# 二進制格式: 'KLB1' | uint32 行數 | uint32 元數據長度 | 元數據 JSON | 補齊到 8 字節 |
+#             int64 time[n] | float64 open[n] | high[n] | low[n] | close[n] | volume[n]（均為小端）
+BINARY_MAGIC = b'KLB1'
+_BINARY_HEADER = struct.Struct('<4sII')
+
+
+def available_formats() -> List[str]:
+    """當前環境支持的響應格式，第一個為默認格式"""
+    formats = [MIME_JSON, MIME_COLUMNAR_JSON, MIME_BINARY]
+    if pa is not None:
+        formats.append(MIME_ARROW)
+    return formats
+
+
+def negotiate_format(accept_mimetypes, format_param: Optional[str] = None) -> str:
+    """根據 ?format= 或 Accept 頭選擇響應格式；無法滿足時回退到行式 JSON"""
+    formats = available_formats()
+    if format_param:
+        mimetype = FORMAT_ALIASES.get(format_param.lower(), format_param)
+        return mimetype if mimetype in formats else MIME_JSON
+    return accept_mimetypes.best_match(formats, default=MIME_JSON) or MIME_JSON
+
+
+def rows_to_matrix(rows: Sequence[Tuple]) -> np.ndarray:
+    """把 (time, open, high, low, close, volume) 元組轉為 (n, 6) float64 矩陣"""
+    width = len(KLINE_COLUMNS)
+    # 逐值流入預分配的數組，比 np.array(rows) 少一次嵌套序列的形狀推斷
+    return np.fromiter(itertools.chain.from_iterable(rows), dtype=np.float64,
+                       count=len(rows) * width).reshape(len(rows), width)
+
+
+def rows_to_columns(rows: Union[Sequence[Tuple], np.ndarray]) -> Dict[str, np.ndarray]:
+    """把查詢結果（元組序列或 rows_to_matrix 的矩陣）轉為列數組，time 為 Unix 秒"""
+    matrix = rows if isinstance(rows, np.ndarray) else rows_to_matrix(rows)
+    columns = {name: np.ascontiguousarray(matrix[:, i]) for i, name in enumerate(KLINE_COLUMNS)}
+    columns['time'] = columns['time'].astype(np.int64)
+    return columns
+
+
+def _dumps(payload: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=lambda value: value.tolist()).encode('utf-8')
+
+
+def encode_row_json(columns: Dict[str, np.ndarray], meta: Dict[str, Any]) -> bytes:
+    """行式 JSON: data 為 {time, open, ...} 對象數組"""
+    payload = dict(meta)
+    values = [columns[name].tolist() for name in KLINE_COLUMNS]
+    payload['data'] = [dict(zip(KLINE_COLUMNS, row)) for row in zip(*values)]
+    return _dumps(payload)
+
+
+def encode_columnar_json(columns: Dict[str, np.ndarray], meta: Dict[str, Any]) -> bytes:
+    """列式 JSON: columns 為每列一個數組"""
+    payload = dict(meta)
+    payload['count'] = len(columns['time'])
+    payload['columns'] = columns
+    return _dumps(payload)
+
+
+def encode_binary(columns: Dict[str, np.ndarray], meta: Dict[str, Any]) -> bytes:
+    """緊湊二進制，列數組按 8 字節對齊，前端可直接構造 TypedArray 視圖"""
+    meta_bytes = _dumps(meta)
+    header = _BINARY_HEADER.pack(BINARY_MAGIC, len(columns['time']), len(meta_bytes))
+    padding = b'\x00' * (-(len(header) + len(meta_bytes)) % 8)
+    parts = [header, meta_bytes, padding]
+    parts.extend(columns[name].astype('<i8' if name == 'time' else '<f8', copy=False).tobytes()
+                 for name in KLINE_COLUMNS)
+    return b''.join(parts)
+
+
+def encode_arrow(columns: Dict[str, np.ndarray], meta: Dict[str, Any]) -> bytes:
+    """Arrow IPC 流，元數據以 JSON 寫入 schema metadata"""
+    table = pa.table(
+        {name: columns[name] for name in KLINE_COLUMNS},
+        metadata={'meta': _dumps(meta)}
+    )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_klines(rows: Union[Sequence[Tuple], np.ndarray], meta: Dict[str, Any], mimetype: str) -> bytes:
+    """按選定格式編碼查詢結果（rows 按時間正序）"""
+    columns = rows_to_columns(rows)
+    if mimetype == MIME_JSON:
+        return encode_row_json(columns, meta)
+    if mimetype == MIME_COLUMNAR_JSON:
+        return encode_columnar_json(columns, meta)
+    if mimetype == MIME_ARROW:
+        return encode_arrow(columns, meta)
+    return encode_binary(columns, meta)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+24 小時滾動市場統計
+基於 kline_data 為每個交易對維護最近 24 小時的K線窗口：最高/最低價用單調隊列維護，
+成交量用滑動和維護；收到K線寫入通知時只拉取新增的K線，所有交易對的統計可一次返回
+"""
+
+import threading
+import time
+import logging
+from collections import deque
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("data_collection_api")
+
+WINDOW_SECONDS = 24 * 60 * 60
+
+# 選擇統計所用週期時的優先順序（越細越準確）
+INTERVAL_PREFERENCE = ['1m', '5m', '15m', '30m', '1h', '4h', '1d']
+
+# (time, high, low, close, volume)，time 為K線開盤時間（Unix 秒）
+Candle = Tuple[int, float, float, float, float]
+
+
+class RollingWindow:
+    """單個交易對最近 24 小時的K線窗口"""
+
+    __slots__ = ('symbol', 'interval', 'step', 'window', 'candles', 'max_high', 'min_low',
+                 'volume_sum', 'reference_close')
+
+    def __init__(self, symbol: str, interval: str, step: int, window: int = WINDOW_SECONDS):
+        self.symbol = symbol
+        self.interval = interval
+        self.step = step
+        self.window = window
+        self.candles: deque = deque()
+        # 單調隊列: max_high 中 high 遞減，min_low 中 low 遞增，隊首即窗口極值
+        self.max_high: deque = deque()
+        self.min_low: deque = deque()
+        self.volume_sum = 0.0
+        # 最近一根移出窗口的K線收盤價，即 24 小時前的價格
+        self.reference_close: Optional[float] = None
+
+    @property
+    def last_time(self) -> Optional[int]:
+        return self.candles[-1][0] if self.candles else None
+
+    def _push_extrema(self, candle: Candle) -> None:
+        t, high, low = candle[0], candle[1], candle[2]
+        while self.max_high and self.max_high[-1][1] <= high:
+            self.max_high.pop()
+        self.max_high.append((t, high))
+        while self.min_low and self.min_low[-1][1] >= low:
+            self.min_low.pop()
+        self.min_low.append((t, low))
+
+    def _rebuild_extrema(self) -> None:
+        self.max_high.clear()
+        self.min_low.clear()
+        for candle in self.candles:
+            self._push_extrema(candle)
+
+    def push(self, candle: Candle) -> bool:
+        """追加或更新最新一根K線；更早的K線被修改時返回 False（需要重新加載）"""
+        last_time = self.last_time
+        if last_time is not None and candle[0] < last_time:
+            return False
+
+        if last_time is not None and candle[0] == last_time:
+            # 未收盤的K線被更新：替換隊尾。被舊值擠出單調隊列的元素可能重新成為極值，
+            # 因此從窗口重建（最多 24 小時的K線）
+            self.volume_sum -= self.candles.pop()[4]
+            self.candles.append(candle)
+            self.volume_sum += candle[4]
+            self._rebuild_extrema()
+            return True
+
+        self.candles.append(candle)
+        self.volume_sum += candle[4]
+        self._push_extrema(candle)
+        return True
+
+    def evict(self, now: float) -> None:
+        """移出開盤時間早於 now - 24h 的K線"""
+        cutoff = now - self.window
+        while self.candles and self.candles[0][0] < cutoff:
+            t, _, _, close, volume = self.candles.popleft()
+            self.volume_sum -= volume
+            self.reference_close = close
+            if self.max_high and self.max_high[0][0] == t:
+                self.max_high.popleft()
+            if self.min_low and self.min_low[0][0] == t:
+                self.min_low.popleft()
+        if not self.candles:
+            self.volume_sum = 0.0
+
+    def snapshot(self) -> Optional[Dict[str, Any]]:
+        """與 /api/market-stats/<symbol> 相同格式的統計"""
+        if not self.candles:
+            return None
+        current_price = self.candles[-1][3]
+        reference = self.reference_close if self.reference_close is not None else self.candles[0][3]
+        price_change = current_price - reference
+        return {
+            'symbol': self.symbol,
+            'interval': self.interval,
+            'currentPrice': current_price,
+            'priceChange24h': price_change,
+            'priceChangePercent24h': (price_change / reference * 100) if reference > 0 else 0,
+            'high24h': self.max_high[0][1],
+            'low24h': self.min_low[0][1],
+            'volume24h': max(self.volume_sum, 0.0),
+            'lastTime': self.candles[-1][0]
+        }
+
+
+class MarketStatsEngine:
+    """全部交易對的 24 小時滾動統計
+
+    query(sql, params) 在數據庫上執行查詢並返回全部行。收到寫入通知時增量更新；
+    未連接通知頻道時每 refresh_interval 秒整體重新加載。
+    """
+
+    SERIES_SQL = """
+        SELECT DISTINCT symbol, interval FROM kline_data
+        WHERE time >= to_timestamp(%s)
+    """
+
+    CANDLES_SQL = """
+        SELECT symbol, EXTRACT(EPOCH FROM time)::int8, high_price::float8, low_price::float8,
+               close_price::float8, volume::float8
+        FROM kline_data
+        WHERE interval = %s AND symbol = ANY(%s) AND time >= to_timestamp(%s)
+        ORDER BY symbol, time
+    """
+
+    def __init__(self, query: Callable[[str, Sequence[Any]], List[Tuple]],
+                 interval_seconds: Dict[str, int], window: int = WINDOW_SECONDS,
+                 refresh_interval: float = 30.0):
+        self.query = query
+        self.interval_seconds = interval_seconds
+        self.window = window
+        self.refresh_interval = refresh_interval
+        self.listening = False
+
+        self._lock = threading.RLock()
+        self._windows: Dict[str, RollingWindow] = {}
+        self._loaded_at: Optional[float] = None
+
+    def _preferred(self, intervals) -> Optional[str]:
+        for interval in INTERVAL_PREFERENCE:
+            if interval in intervals:
+                return interval
+        return None
+
+    def _load(self, series: Dict[str, str], now: float) -> Dict[str, RollingWindow]:
+        """按週期分組，每組一次查詢加載窗口（多取一根作為 24 小時前的參考價）"""
+        by_interval: Dict[str, List[str]] = {}
+        for symbol, interval in series.items():
+            by_interval.setdefault(interval, []).append(symbol)
+
+        windows = {}
+        for interval, symbols in by_interval.items():
+            step = self.interval_seconds.get(interval, 3600)
+            for symbol in symbols:
+                windows[symbol] = RollingWindow(symbol, interval, step, self.window)
+            for symbol, t, high, low, close, volume in self.query(
+                    self.CANDLES_SQL, (interval, symbols, now - self.window - step)):
+                windows[symbol].push((t, high, low, close, volume))
+        for window in windows.values():
+            window.evict(now)
+        return windows
+
+    def reload(self) -> None:
+        """重新發現交易對並加載全部窗口"""
+        now = time.time()
+        rows = self.query(self.SERIES_SQL, (now - 2 * self.window,))
+        intervals: Dict[str, set] = {}
+        for symbol, interval in rows:
+            intervals.setdefault(symbol, set()).add(interval)
+        series = {symbol: self._preferred(found) for symbol, found in intervals.items()}
+        series = {symbol: interval for symbol, interval in series.items() if interval is not None}
+
+        windows = self._load(series, now)
+        with self._lock:
+            self._windows = windows
+            self._loaded_at = time.monotonic()
+        logger.info(f"市場統計已加載 {len(windows)} 個交易對")
+
+    def _ensure_loaded(self) -> None:
+        with self._lock:
+            stale = self._loaded_at is None or (
+                not self.listening and time.monotonic() - self._loaded_at > self.refresh_interval)
+        if stale:
+            self.reload()
+
+    def invalidate(self, symbol: str, interval: str, start: float, end: float) -> None:
+        """處理K線寫入通知：只拉取並追加新K線，歷史K線被改動時重新加載該交易對"""
+        if self._preferred({interval}) is None:
+            return
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            window = self._windows.get(symbol)
+            if window is not None and self._preferred({window.interval, interval}) != interval:
+                return
+            if window is not None and window.interval != interval:
+                window = None  # 出現了更細的週期，改用新週期
+
+        now = time.time()
+        if end < now - self.window - self.interval_seconds.get(interval, 3600):
+            return
+        if window is None:
+            windows = self._load({symbol: interval}, now)
+            with self._lock:
+                self._windows.update(windows)
+            return
+
+        with self._lock:
+            since = start if window.last_time is None else min(start, window.last_time)
+        rows = self.query(self.CANDLES_SQL, (interval, [symbol], since))
+        with self._lock:
+            if all(window.push((t, high, low, close, volume)) for _, t, high, low, close, volume in rows):
+                window.evict(now)
+                return
+        # 窗口內較早的K線被修復，重新加載該交易對
+        windows = self._load({symbol: interval}, now)
+        with self._lock:
+            self._windows.update(windows)
+
+    def clear(self) -> None:
+        """丟棄全部狀態，下次讀取時重新加載"""
+        with self._lock:
+            self._windows = {}
+            self._loaded_at = None
+
+    def get(self, symbol: str) -> Optional[Dict[str, Any]]:
+        """單個交易對的統計，兼容帶或不帶 '-' 的交易對格式"""
+        stats = self.get_all([symbol, symbol.replace('-', '')])
+        return next(iter(stats.values()), None)
+
+    def get_all(self, symbols: Optional[Sequence[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """全部（或指定）交易對的統計"""
+        self._ensure_loaded()
+        now = time.time()
+        result = {}
+        with self._lock:
+            names = self._windows.keys() if symbols is None else [s for s in symbols if s in self._windows]
+            for symbol in names:
+                window = self._windows[symbol]
+                window.evict(now)
+                snapshot = window.snapshot()
+                if snapshot is not None:
+                    result[symbol] = snapshot
+        return result
@@ -0,0 +1,100 @@
+-- ========================================
+-- K線緊湊表結構遷移
+-- ========================================
+-- kline_data（每行重複存儲 symbol/interval 字符串，DECIMAL 價格，唯一約束 + 3 個索引）
+--   -> kline_series 維度表 + kline_bars 超表（float8 價格，只有 (series_id, time) 主鍵索引）
+-- 遷移後 kline_data 變為同名兼容視圖，讀取方無需修改；原表重命名為 kline_data_legacy，確認無誤後可手動刪除。
+--
+-- 使用方法（先停止採集進程）:
+--   psql -h localhost -U postgres -d crypto_data -f migrations/04_compact_kline_schema.sql
+-- 然後在配置文件的 database 中設置 "kline_schema": "compact"
+--
+-- 不遷移、只去掉冗餘索引時，單獨執行第 1 步即可。
+
+-- ========================================
+-- 1. 刪除冗餘索引
+-- ========================================
+-- 所有查詢都按 (symbol, interval) 過濾，idx_kline_symbol_interval_time 已覆蓋這兩個索引的用途
+DROP INDEX IF EXISTS idx_kline_symbol_time;
+DROP INDEX IF EXISTS idx_kline_interval;
+
+BEGIN;
+
+-- ========================================
+-- 2. 刪除派生週期連續聚合
+-- ========================================
+-- 連續聚合按 symbol 分組且依賴原表，開啟 derive_intervals 時管道會按 series_id 重新創建
+DROP MATERIALIZED VIEW IF EXISTS kline_data_4h, kline_data_1d CASCADE;
+DROP MATERIALIZED VIEW IF EXISTS kline_data_5m, kline_data_15m, kline_data_30m, kline_data_1h CASCADE;
+
+-- ========================================
+-- 3. 創建緊湊表
+-- ========================================
+CREATE TABLE IF NOT EXISTS kline_series (
+    series_id SERIAL PRIMARY KEY,
+    symbol VARCHAR(50) NOT NULL,
+    interval VARCHAR(10) NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE(symbol, interval)
+);
+
+CREATE TABLE IF NOT EXISTS kline_bars (
+    time TIMESTAMPTZ NOT NULL,
+    series_id INTEGER NOT NULL REFERENCES kline_series(series_id),
+    trade_count INTEGER,
+    open_price FLOAT8 NOT NULL,
+    high_price FLOAT8 NOT NULL,
+    low_price FLOAT8 NOT NULL,
+    close_price FLOAT8 NOT NULL,
+    volume FLOAT8 NOT NULL,
+    quote_volume FLOAT8,
+    taker_buy_volume FLOAT8,
+    taker_buy_quote_volume FLOAT8,
+    PRIMARY KEY (series_id, time)
+);
+
+SELECT create_hypertable('kline_bars', 'time', if_not_exists => TRUE);
+
+-- ========================================
+-- 4. 複製數據
+-- ========================================
+INSERT INTO kline_series (symbol, interval)
+SELECT DISTINCT symbol, interval FROM kline_data
+ON CONFLICT (symbol, interval) DO NOTHING;
+
+INSERT INTO kline_bars (
+    time, series_id, trade_count, open_price, high_price, low_price,
+    close_price, volume, quote_volume, taker_buy_volume, taker_buy_quote_volume
+)
+SELECT k.time, s.series_id, k.trade_count, k.open_price, k.high_price, k.low_price,
+       k.close_price, k.volume, k.quote_volume, k.taker_buy_volume, k.taker_buy_quote_volume
+FROM kline_data k
+JOIN kline_series s ON s.symbol = k.symbol AND s.interval = k.interval
+ON CONFLICT (series_id, time) DO NOTHING;
+
+-- ========================================
+-- 5. 用兼容視圖替換原表
+-- ========================================
+ALTER TABLE kline_data RENAME TO kline_data_legacy;
+
+CREATE VIEW kline_data AS
+SELECT b.time, s.symbol, s.interval, b.open_price, b.high_price, b.low_price,
+       b.close_price, b.volume, b.quote_volume, b.trade_count,
+       b.taker_buy_volume, b.taker_buy_quote_volume
+FROM kline_bars b
+JOIN kline_series s ON s.series_id = b.series_id;
+
+COMMIT;
+
+ANALYZE kline_series;
+ANALYZE kline_bars;
+
+-- ========================================
+-- 6. 對比存儲佔用
+-- ========================================
+SELECT 'kline_data_legacy' AS hypertable, pg_size_pretty(table_bytes) AS table_size,
+       pg_size_pretty(index_bytes) AS index_size, pg_size_pretty(total_bytes) AS total_size
+FROM hypertable_detailed_size('kline_data_legacy')
+UNION ALL
+SELECT 'kline_bars', pg_size_pretty(table_bytes), pg_size_pretty(index_bytes), pg_size_pretty(total_bytes)
+FROM hypertable_detailed_size('kline_bars');
@@ -0,0 +1,40 @@
+-- ========================================
+-- 訂單簿緊湊存儲
+-- ========================================
+-- orderbook_snapshots 每行以 JSONB 保存完整的買賣盤（每個價位一個 {"price", "quantity"} 對象）。
+-- orderbook_frames 把價位打包為小端 float8 (price, quantity) 對的 bytea（每個價位 16 字節），
+-- 每個交易對每 N 次更新寫一個完整快照 (is_snapshot)，其間只寫增量（quantity 為 0 表示刪除價位）。
+-- 讀取某一時刻的訂單簿 = 最近的快照 + 其後按 sequence_id 排序的增量。
+--
+-- 使用方法:
+--   psql -h localhost -U postgres -d crypto_data -f migrations/05_compact_orderbook.sql
+-- 然後以 DataAccess(..., orderbook_storage='compact', snapshot_every=N) 寫入
+
+CREATE TABLE IF NOT EXISTS orderbook_frames (
+    time TIMESTAMPTZ NOT NULL,
+    pair_id INTEGER NOT NULL REFERENCES trading_pairs(pair_id),
+    sequence_id BIGINT NOT NULL,
+    is_snapshot BOOLEAN NOT NULL,
+    bids BYTEA NOT NULL,
+    asks BYTEA NOT NULL,
+    PRIMARY KEY (pair_id, sequence_id, time)
+);
+
+SELECT create_hypertable('orderbook_frames', 'time',
+    chunk_time_interval => INTERVAL '1 hour',
+    if_not_exists => TRUE
+);
+
+-- 重建時按時間查找最近的快照，只索引快照行
+CREATE INDEX IF NOT EXISTS idx_orderbook_frames_snapshot
+    ON orderbook_frames(pair_id, time DESC) WHERE is_snapshot;
+
+-- 打包的價位已很緊湊，壓縮主要合併行頭與 sequence_id/time 列
+ALTER TABLE orderbook_frames SET (
+    timescaledb.compress,
+    timescaledb.compress_segmentby = 'pair_id',
+    timescaledb.compress_orderby = 'sequence_id'
+);
+
+SELECT add_compression_policy('orderbook_frames', INTERVAL '1 day', if_not_exists => TRUE);
+SELECT add_retention_policy('orderbook_frames', INTERVAL '30 days', if_not_exists => TRUE);
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+K線寫入性能測試腳本
+比較 execute_values 與二進制 COPY 兩種寫入路徑的吞吐量（條/秒），並報告K線超表的索引大小。
+分別以 --kline_schema legacy / compact 運行可對比原表與緊湊表結構（compact 需先執行 04_compact_kline_schema.sql）
+
+使用方法:
+python backend/scripts/data/benchmark_kline_insert.py --config_path backend/api_config/BingX_api_config2_local.json --rows 1000000
+python backend/scripts/data/benchmark_kline_insert.py --config_path ... --rows 1000000 --kline_schema compact
+python backend/scripts/data/benchmark_kline_insert.py --rows 1000000 --dry_run   # 只測試數據轉換，不連接數據庫
+"""
+
+import sys
+import os
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, '../../..'))
+sys.path.insert(0, project_root)
+
+from backend.services.data_tools.import_to_database import (
+    ConfigManager, ErrorHandler, TimescaleDBManager
+)
+
+
+def parse_arguments():
+    """解析命令行參數"""
+    parser = argparse.ArgumentParser(description='K線寫入性能測試')
+    parser.add_argument('--config_path', type=str, help='配置文件路徑（--dry_run 時可省略）')
+    parser.add_argument('--rows', type=int, default=1000000, help='測試數據行數')
+    parser.add_argument('--dry_run', action='store_true', help='只測試數據轉換，不寫入數據庫')
+    parser.add_argument('--kline_schema', type=str, choices=['legacy', 'compact'],
+                        help='覆蓋配置文件中的 database.kline_schema')
+    return parser.parse_args()
+
+
+def make_kline_frame(rows, symbol, interval='1m'):
+    """生成隨機K線數據"""
+    rng = np.random.default_rng(42)
+    start_ms = 1577836800000  # 2020-01-01
+    timestamps = start_ms + np.arange(rows, dtype=np.int64) * 60000
+    close = 30000 + rng.standard_normal(rows).cumsum()
+    open_ = close + rng.standard_normal(rows)
+    high = np.maximum(open_, close) + rng.random(rows)
+    low = np.minimum(open_, close) - rng.random(rows)
+    df = pd.DataFrame({
+        'timestamp': timestamps,
+        'open': open_,
+        'high': high,
+        'low': low,
+        'close': close,
+        'volume': rng.random(rows) * 100,
+        'quote_volume': rng.random(rows) * 3000000,
+        'trade_count': rng.integers(0, 1000, rows),
+        'taker_buy_volume': rng.random(rows) * 50,
+        'taker_buy_quote_volume': rng.random(rows) * 1500000
+    })
+    df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
+    df['symbol'] = symbol
+    df['interval'] = interval
+    return df
+
+
+def benchmark_conversion(df):
+    """只比較兩種路徑的 Python 端數據轉換耗時"""
+    started = time.perf_counter()
+    values = []
+    for _, row in df.iterrows():
+        values.append((
+            row['datetime'], row['symbol'], row['interval'],
+            float(row['open']), float(row['high']), float(row['low']),
+            float(row['close']), float(row['volume']),
+            float(row.get('quote_volume', 0)), int(row.get('trade_count', 0)),
+            float(row.get('taker_buy_volume', 0)), float(row.get('taker_buy_quote_volume', 0))
+        ))
+    iterrows_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    TimescaleDBManager._to_copy_binary(df)
+    copy_elapsed = time.perf_counter() - started
+
+    print(f"iterrows 元組構造: {len(df) / iterrows_elapsed:,.0f} 條/秒 ({iterrows_elapsed:.2f} 秒)")
+    print(f"COPY 二進制編碼:   {len(df) / copy_elapsed:,.0f} 條/秒 ({copy_elapsed:.2f} 秒)")
+
+
+def benchmark_insert(db_manager, df, method):
+    """測試完整寫入路徑並清理測試數據"""
+    symbol = df['symbol'].iloc[0]
+    started = time.perf_counter()
+    success = db_manager.insert_kline_data(df, method=method)
+    elapsed = time.perf_counter() - started
+
+    with db_manager.connection.cursor() as cursor:
+        cursor.execute(f"SELECT index_bytes FROM hypertable_detailed_size('{db_manager.kline_table}')")
+        index_bytes = cursor.fetchone()[0] or 0
+        if db_manager.compact:
+            cursor.execute("DELETE FROM kline_bars WHERE series_id IN "
+                           "(SELECT series_id FROM kline_series WHERE symbol = %s)", (symbol,))
+        else:
+            cursor.execute("DELETE FROM kline_data WHERE symbol = %s", (symbol,))
+
+    status = '成功' if success else '失敗'
+    print(f"{method:>6} 寫入{status}: {len(df) / elapsed:,.0f} 條/秒 ({elapsed:.2f} 秒), "
+          f"寫入後索引 {index_bytes / 1024 / 1024:,.1f} MB")
+
+
+def main():
+    """主函數"""
+    args = parse_arguments()
+    print(f"生成 {args.rows} 條測試數據...")
+
+    if args.dry_run:
+        benchmark_conversion(make_kline_frame(args.rows, 'BENCH-CONVERT'))
+        return 0
+
+    if not args.config_path:
+        print("非 --dry_run 模式需要 --config_path")
+        return 1
+
+    config_manager = ConfigManager(args.config_path)
+    db_config = dict(config_manager.get_database_config())
+    if args.kline_schema:
+        db_config['kline_schema'] = args.kline_schema
+    db_manager = TimescaleDBManager(db_config, ErrorHandler())
+    print(f"表結構: {'緊湊 (kline_bars)' if db_manager.compact else '原表 (kline_data)'}")
+    try:
+        benchmark_insert(db_manager, make_kline_frame(args.rows, 'BENCH-VALUES'), 'values')
+        benchmark_insert(db_manager, make_kline_frame(args.rows, 'BENCH-COPY'), 'copy')
+    finally:
+        db_manager.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+K線存儲壓縮測試腳本
+記錄K線超表（kline_data，緊湊結構下為 kline_bars）壓縮前後的磁盤佔用，以及典型範圍查詢（單交易對最近 N 天）的耗時
+
+使用方法:
+python backend/scripts/data/benchmark_kline_storage.py --config_path backend/api_config/BingX_api_config2_local.json
+python backend/scripts/data/benchmark_kline_storage.py --config_path ... --compress_older_than "1 day" --repeat 10
+"""
+
+import sys
+import os
+import argparse
+import statistics
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, '../../..'))
+sys.path.insert(0, project_root)
+
+from backend.services.data_tools.import_to_database import (
+    ConfigManager, ErrorHandler, TimescaleDBManager
+)
+
+
+def parse_arguments():
+    """解析命令行參數"""
+    parser = argparse.ArgumentParser(description='K線存儲壓縮測試')
+    parser.add_argument('--config_path', type=str, required=True, help='配置文件路徑')
+    parser.add_argument('--symbol', type=str, help='查詢測試使用的交易對（默認取數據最多的一個）')
+    parser.add_argument('--interval', type=str, default='1m', help='查詢測試使用的時間週期')
+    parser.add_argument('--days', type=int, default=30, help='範圍查詢覆蓋的天數')
+    parser.add_argument('--repeat', type=int, default=5, help='每個查詢重複次數（取中位數）')
+    parser.add_argument('--compress_older_than', type=str, default='7 days', help='壓縮早於該時間的分塊')
+    parser.add_argument('--skip_compress', action='store_true', help='只報告當前狀態，不執行壓縮')
+    return parser.parse_args()
+
+
+def format_bytes(size):
+    """格式化字節數"""
+    size = float(size or 0)
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def report_storage(cursor, table, label):
+    """打印K線超表的表、索引與壓縮後大小"""
+    cursor.execute("SELECT table_bytes, index_bytes, toast_bytes, total_bytes "
+                   "FROM hypertable_detailed_size(%s)", (table,))
+    table_bytes, index_bytes, toast_bytes, total_bytes = cursor.fetchone()
+    cursor.execute("SELECT COUNT(*), COUNT(*) FILTER (WHERE is_compressed) "
+                   "FROM timescaledb_information.chunks WHERE hypertable_name = %s", (table,))
+    chunks, compressed = cursor.fetchone()
+    print(f"[{label}] 總計 {format_bytes(total_bytes)} (表 {format_bytes(table_bytes)}, "
+          f"索引 {format_bytes(index_bytes)}, TOAST {format_bytes(toast_bytes)}), "
+          f"分塊 {chunks} 個, 已壓縮 {compressed} 個")
+
+    if compressed:
+        cursor.execute("SELECT before_compression_total_bytes, after_compression_total_bytes "
+                       "FROM hypertable_compression_stats(%s)", (table,))
+        before, after = cursor.fetchone()
+        if before and after:
+            print(f"[{label}] 已壓縮分塊: {format_bytes(before)} -> {format_bytes(after)} "
+                  f"(壓縮比 {before / after:.1f}x)")
+    return total_bytes
+
+
+def pick_symbol(cursor, interval):
+    """選擇該週期下數據最多的交易對"""
+    cursor.execute("SELECT symbol FROM kline_data WHERE interval = %s "
+                   "GROUP BY symbol ORDER BY COUNT(*) DESC LIMIT 1", (interval,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def benchmark_scans(cursor, symbol, interval, days, repeat, label):
+    """單交易對最近 N 天的範圍查詢與聚合查詢耗時（中位數）"""
+    queries = {
+        '範圍讀取': """
+            SELECT time, open_price, high_price, low_price, close_price, volume
+            FROM kline_data
+            WHERE symbol = %s AND interval = %s AND time >= NOW() - %s * INTERVAL '1 day'
+            ORDER BY time
+        """,
+        '日線聚合': """
+            SELECT time_bucket('1 day', time), MAX(high_price), MIN(low_price), SUM(volume)
+            FROM kline_data
+            WHERE symbol = %s AND interval = %s AND time >= NOW() - %s * INTERVAL '1 day'
+            GROUP BY 1 ORDER BY 1
+        """
+    }
+    for name, sql in queries.items():
+        timings = []
+        rows = 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cursor.execute(sql, (symbol, interval, days))
+            rows = len(cursor.fetchall())
+            timings.append(time.perf_counter() - started)
+        print(f"[{label}] {name}: {rows} 行, 中位數 {statistics.median(timings) * 1000:.1f} ms")
+
+
+def compress_chunks(cursor, table, older_than):
+    """壓縮早於 older_than 的分塊"""
+    started = time.perf_counter()
+    cursor.execute("SELECT compress_chunk(c, if_not_compressed => TRUE) "
+                   "FROM show_chunks(%s, older_than => %s::interval) c", (table, older_than))
+    chunks = len(cursor.fetchall())
+    print(f"壓縮 {chunks} 個分塊，耗時 {time.perf_counter() - started:.1f} 秒")
+
+
+def main():
+    """主函數"""
+    args = parse_arguments()
+    config_manager = ConfigManager(args.config_path)
+    db_manager = TimescaleDBManager(config_manager.get_database_config(), ErrorHandler())
+    try:
+        with db_manager.connection.cursor() as cursor:
+            symbol = args.symbol or pick_symbol(cursor, args.interval)
+            if symbol is None:
+                print(f"kline_data 中沒有 {args.interval} 數據")
+                return 1
+            print(f"查詢測試: {symbol} {args.interval} 最近 {args.days} 天, 重複 {args.repeat} 次")
+
+            table = db_manager.kline_table
+            before = report_storage(cursor, table, '壓縮前')
+            benchmark_scans(cursor, symbol, args.interval, args.days, args.repeat, '壓縮前')
+            if args.skip_compress:
+                return 0
+
+            settings = dict(config_manager.config.get('storage_settings', {}))
+            settings.setdefault('compress_after', args.compress_older_than)
+            if not db_manager.configure_storage(settings):
+                return 1
+            compress_chunks(cursor, table, args.compress_older_than)
+
+            after = report_storage(cursor, table, '壓縮後')
+            benchmark_scans(cursor, symbol, args.interval, args.days, args.repeat, '壓縮後')
+            if before and after:
+                print(f"磁盤佔用變化: {format_bytes(before)} -> {format_bytes(after)} ({after / before:.1%})")
+    finally:
+        db_manager.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,15 +8,27 @@ K線數據持續收集腳本
 
 使用方法:
 python backend/scripts/data/keep_collecting.py --symbol BTC-USDT --start_time 2025-01-01 --end_time 2025-07-02 --interval 1h --config_path /Users/cliffyang/Documents/Program/Crypto_Trading_Bot/TradingModel_V3/backend/api_config/BingX_api_config2_local.json
+
+並發回補模式（多個時間窗口同時獲取，受交易所限流器控制）:
+python backend/scripts/data/keep_collecting.py --symbol BTC-USDT --start_time 2022-01-01 --interval 1m --workers 8 --config_path backend/api_config/BingX_api_config2_local.json
+
+修復模式（只補齊歷史中的缺口）:
+python backend/scripts/data/keep_collecting.py --symbol BTC-USDT --start_time 2022-01-01 --interval 1m --repair --config_path backend/api_config/BingX_api_config2_local.json
+
+由 API 啟動時通過 --progress_fd 傳入管道的寫端，進度以 JSON Lines 事件寫入管道（見 ProgressReporter）
 """
 
 import sys
 import os
 import argparse
+import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timedelta
 import time
 import pandas as pd
+import psycopg2
 
 # 添加項目根目錄到系統路徑，以便正確導入模塊
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -24,7 +36,7 @@ project_root = os.path.abspath(os.path.join(current_dir, '../../..'))
 sys.path.insert(0, project_root)
 
 # 直接導入模塊，不使用backend前綴
-from backend.services.data_tools.import_to_database import KlineDataPipeline, ErrorHandler
+from backend.services.data_tools.import_to_database import KlineDataPipeline, ErrorHandler, INTERVAL_MS, BASE_INTERVAL
 
 def setup_logger():
     """設置日誌記錄器"""
@@ -50,6 +62,41 @@ def setup_logger():
     
     return logger
 
+class ProgressReporter:
+    """向父進程發送結構化進度事件
+    
+    每個事件是一行 JSON: {"type": ..., "ts": Unix 秒, ...}，type 為
+    start / batch / insert / progress / complete / error。未指定文件描述符時不輸出。
+    """
+    
+    def __init__(self, fd=None):
+        self._stream = os.fdopen(fd, 'w', encoding='utf-8', buffering=1) if fd is not None else None
+        self._lock = threading.Lock()
+    
+    def emit(self, event_type, **fields):
+        """發送一個事件（行緩衝，寫入即可被讀端收到）"""
+        if self._stream is None:
+            return
+        fields['type'] = event_type
+        fields['ts'] = time.time()
+        line = json.dumps(fields, ensure_ascii=False) + '\n'
+        with self._lock:
+            try:
+                self._stream.write(line)
+            except (BrokenPipeError, OSError):
+                # 讀端已關閉（API 已退出），收集繼續進行
+                self._stream = None
+    
+    def close(self):
+        """關閉管道，讀端收到 EOF"""
+        with self._lock:
+            if self._stream is not None:
+                try:
+                    self._stream.close()
+                except OSError:
+                    pass
+                self._stream = None
+
 def parse_arguments():
     """解析命令行參數"""
     parser = argparse.ArgumentParser(description='從交易所API收集K線數據')
@@ -60,7 +107,11 @@ def parse_arguments():
     parser.add_argument('--interval', type=str, default='1h', help='K線間隔，例如 1m, 5m, 15m, 30m, 1h, 4h, 1d')
     parser.add_argument('--batch_size', type=int, default=1000, help='每批次請求的K線數量，最大1000')
     parser.add_argument('--config_path', type=str, required=True, help='配置文件路徑')
-    parser.add_argument('--sleep_time', type=int, default=1, help='每批次請求之間的休眠時間（秒）')
+    parser.add_argument('--sleep_time', type=int, default=0,
+                        help='每批次請求之間的額外休眠時間（秒），請求頻率默認由交易所限流器控制')
+    parser.add_argument('--workers', type=int, default=1, help='並發回補的工作線程數，大於1時啟用多窗口回補模式')
+    parser.add_argument('--repair', action='store_true', help='修復模式: 只獲取覆蓋索引中缺失的時間區間')
+    parser.add_argument('--progress_fd', type=int, help='寫入 JSON Lines 進度事件的文件描述符（由 API 傳入）')
     
     return parser.parse_args()
 
@@ -74,7 +125,116 @@ def timestamp_to_str(timestamp_ms):
     dt = datetime.fromtimestamp(timestamp_ms / 1000)
     return dt.strftime('%Y-%m-%d %H:%M:%S')
 
-def collect_kline_data(args, logger):
+def resolve_time_range(args):
+    """解析命令行參數中的時間範圍，返回毫秒時間戳 (start, end)"""
+    start_timestamp = str_to_timestamp(args.start_time)
+    
+    if args.end_time:
+        end_timestamp = str_to_timestamp(args.end_time)
+        # 設置為當天的23:59:59
+        end_timestamp += 86399000  # 23小時59分59秒的毫秒數
+    else:
+        end_timestamp = int(datetime.now().timestamp() * 1000)
+    
+    return start_timestamp, end_timestamp
+
+def split_time_windows(start_timestamp, end_timestamp, window_ms):
+    """將 [start, end] 切分為互不重疊的時間窗口"""
+    windows = []
+    current_start = start_timestamp
+    while current_start < end_timestamp:
+        current_end = min(current_start + window_ms, end_timestamp)
+        windows.append((current_start, current_end))
+        current_start = current_end
+    return windows
+
+def fetch_window(pipeline, args, window):
+    """在工作線程中獲取單個時間窗口的全部K線數據（按交易所的頁長與翻頁方向分頁）；API 請求失敗時拋出異常"""
+    window_start, window_end = window
+    batch = pipeline.api_client.get_kline_batch(args.symbol, args.interval, window_start, window_end)
+    if batch is None:
+        raise RuntimeError("交易所API請求失敗")
+    return batch.validated().to_dataframe()
+
+def collect_kline_data_concurrent(args, logger, progress, pipeline, exchange_name, start_timestamp, end_timestamp):
+    """多窗口並發回補：工作線程並發獲取，主線程按完成順序逐窗口寫入數據庫"""
+    window_ms = args.batch_size * INTERVAL_MS.get(args.interval, 3600000)
+    windows = split_time_windows(start_timestamp, end_timestamp, window_ms)
+    total_time_range = end_timestamp - start_timestamp
+    
+    # 所有工作線程的請求都經過 api_client 的限流器，共享同一份交易所請求預算
+    logger.info(f"回補模式: {len(windows)} 個窗口, {args.workers} 個工作線程, 使用 {exchange_name} 限流器")
+    
+    total_collected = 0
+    completed_range = 0
+    batch_count = 0
+    failed_windows = []
+    
+    # 最多 workers * 2 個窗口在途，寫入慢於獲取時已獲取的數據不會在內存中堆積
+    pending_windows = iter(windows)
+    max_in_flight = args.workers * 2
+    
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        
+        def submit_next():
+            window = next(pending_windows, None)
+            if window is not None:
+                futures[executor.submit(fetch_window, pipeline, args, window)] = window
+        
+        for _ in range(max_in_flight):
+            submit_next()
+        
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            future = done.pop()
+            window_start, window_end = futures.pop(future)
+            submit_next()
+            batch_count += 1
+            completed_range += window_end - window_start
+            logger.info(f"收集批次 {batch_count}: {timestamp_to_str(window_start)} 至 {timestamp_to_str(window_end)}")
+            progress.emit('batch', batch=batch_count,
+                          startTime=timestamp_to_str(window_start), endTime=timestamp_to_str(window_end))
+            
+            try:
+                df = future.result()
+            except Exception as e:
+                logger.error(f"窗口獲取錯誤: {timestamp_to_str(window_start)} 至 {timestamp_to_str(window_end)}: {str(e)}")
+                progress.emit('error', message=f"窗口獲取錯誤: {str(e)}", fatal=False)
+                failed_windows.append((window_start, window_end))
+                continue
+            
+            # 數據庫寫入只在主線程進行，每個窗口完成即提交
+            if not df.empty:
+                success = pipeline.db_manager.insert_kline_data(df)
+                if success:
+                    logger.info(f"成功插入 {len(df)} 條K線數據")
+                    total_collected += len(df)
+                    progress.emit('insert', count=len(df))
+                else:
+                    logger.error("數據庫插入失敗")
+                    progress.emit('error', message="數據庫插入失敗", fatal=False)
+                    failed_windows.append((window_start, window_end))
+            else:
+                logger.warning(f"該時間段沒有獲取到有效數據: {timestamp_to_str(window_start)} 至 {timestamp_to_str(window_end)}")
+            
+            percent = min(100, completed_range / total_time_range * 100)
+            logger.info(f"總進度: {percent:.2f}% 已收集: {total_collected} 條")
+            progress.emit('progress', progress=round(percent, 2), collected=total_collected)
+    
+    for window_start, window_end in failed_windows:
+        logger.error(f"失敗窗口: {timestamp_to_str(window_start)} 至 {timestamp_to_str(window_end)}")
+    
+    logger.info(f"數據收集完成! 總共收集了 {total_collected} 條 {args.symbol} 的 {args.interval} K線數據")
+    progress.emit('complete', collected=total_collected, failedWindows=len(failed_windows))
+    return not failed_windows
+
+def refresh_derived_intervals(pipeline, args, start_timestamp, end_timestamp):
+    """歷史回補超出刷新策略的窗口，需要顯式刷新由基礎週期派生的連續聚合"""
+    if pipeline.derive_intervals and args.interval == BASE_INTERVAL:
+        pipeline.db_manager.refresh_continuous_aggregates(start_timestamp, end_timestamp)
+
+def collect_kline_data(args, logger, progress):
     """收集K線數據的主函數"""
     try:
         # 初始化數據管道
@@ -83,15 +243,14 @@ def collect_kline_data(args, logger):
         logger.info(f"使用配置文件: {args.config_path}")
         logger.info(f"使用交易所: {exchange_name}")
         
-        # 解析時間範圍
-        start_timestamp = str_to_timestamp(args.start_time)
+        # 派生模式下派生週期由連續聚合生成，改為收集基礎週期
+        source_interval = pipeline.source_interval(args.interval)
+        if source_interval != args.interval:
+            logger.info(f"{args.interval} 由 {source_interval} 連續聚合生成，改為收集 {source_interval} K線數據")
+            args.interval = source_interval
         
-        if args.end_time:
-            end_timestamp = str_to_timestamp(args.end_time)
-            # 設置為當天的23:59:59
-            end_timestamp += 86399000  # 23小時59分59秒的毫秒數
-        else:
-            end_timestamp = int(datetime.now().timestamp() * 1000)
+        # 解析時間範圍
+        start_timestamp, end_timestamp = resolve_time_range(args)
         
         logger.info(f"開始收集 {args.symbol} 的 {args.interval} K線數據")
         logger.info(f"時間範圍: {timestamp_to_str(start_timestamp)} 至 {timestamp_to_str(end_timestamp)}")
@@ -100,18 +259,28 @@ def collect_kline_data(args, logger):
         total_time_range = end_timestamp - start_timestamp
         
         # 估算K線數量（粗略計算）
-        interval_ms = {
-            '1m': 60 * 1000,
-            '5m': 5 * 60 * 1000,
-            '15m': 15 * 60 * 1000,
-            '30m': 30 * 60 * 1000,
-            '1h': 60 * 60 * 1000,
-            '4h': 4 * 60 * 60 * 1000,
-            '1d': 24 * 60 * 60 * 1000
-        }
+        interval_ms = INTERVAL_MS
         
         estimated_klines = total_time_range / interval_ms.get(args.interval, 3600000)
         logger.info(f"預計需要收集約 {int(estimated_klines)} 條K線數據")
+        progress.emit('start', symbol=args.symbol, interval=args.interval, exchange=exchange_name,
+                      startTime=timestamp_to_str(start_timestamp), endTime=timestamp_to_str(end_timestamp),
+                      estimatedKlines=int(estimated_klines))
+        
+        if args.repair:
+            stats = pipeline.repair_kline_data(args.symbol, args.interval, start_timestamp, end_timestamp)
+            if stats is None:
+                progress.emit('error', message="修復失敗", fatal=True)
+                return False
+            logger.info(f"數據收集完成! 總共收集了 {stats['inserted']} 條 {args.symbol} 的 {args.interval} K線數據")
+            progress.emit('complete', collected=stats['inserted'], failedWindows=stats['failed'])
+            return stats['failed'] == 0
+        
+        if args.workers > 1:
+            success = collect_kline_data_concurrent(args, logger, progress, pipeline, exchange_name,
+                                                    start_timestamp, end_timestamp)
+            refresh_derived_intervals(pipeline, args, start_timestamp, end_timestamp)
+            return success
         
         # 分批收集數據
         current_start = start_timestamp
@@ -123,15 +292,11 @@ def collect_kline_data(args, logger):
             current_end = min(current_start + (args.batch_size * interval_ms.get(args.interval, 3600000)), end_timestamp)
             
             logger.info(f"收集批次 {batch_count}: {timestamp_to_str(current_start)} 至 {timestamp_to_str(current_end)}")
+            progress.emit('batch', batch=batch_count,
+                          startTime=timestamp_to_str(current_start), endTime=timestamp_to_str(current_end))
             
-            # 獲取K線數據
-            df = pipeline.fetch_kline_data(
-                symbol=args.symbol,
-                interval=args.interval,
-                limit=args.batch_size,
-                start_time=current_start,
-                end_time=current_end
-            )
+            # 獲取K線數據（交易所單頁上限小於批次大小時自動分頁）
+            df = pipeline.fetch_kline_range(args.symbol, args.interval, current_start, current_end)
             
             # 插入數據庫
             if not df.empty:
@@ -139,8 +304,10 @@ def collect_kline_data(args, logger):
                 if success:
                     logger.info(f"成功插入 {len(df)} 條K線數據")
                     total_collected += len(df)
+                    progress.emit('insert', count=len(df))
                 else:
                     logger.error("數據庫插入失敗")
+                    progress.emit('error', message="數據庫插入失敗", fatal=False)
             else:
                 logger.warning(f"該時間段沒有獲取到有效數據: {timestamp_to_str(current_start)} 至 {timestamp_to_str(current_end)}")
             
@@ -153,19 +320,24 @@ def collect_kline_data(args, logger):
                 # 如果沒有數據，則按照批次大小向前移動
                 current_start = current_end
             
-            # 休眠一段時間，避免API請求過於頻繁
-            logger.info(f"休眠 {args.sleep_time} 秒...")
-            time.sleep(args.sleep_time)
+            # 請求頻率由限流器控制，僅在指定時額外休眠
+            if args.sleep_time > 0:
+                logger.info(f"休眠 {args.sleep_time} 秒...")
+                time.sleep(args.sleep_time)
             
             # 顯示進度
-            progress = min(100, (current_start - start_timestamp) / total_time_range * 100)
-            logger.info(f"總進度: {progress:.2f}% 已收集: {total_collected} 條")
+            percent = min(100, (current_start - start_timestamp) / total_time_range * 100)
+            logger.info(f"總進度: {percent:.2f}% 已收集: {total_collected} 條")
+            progress.emit('progress', progress=round(percent, 2), collected=total_collected)
         
         logger.info(f"數據收集完成! 總共收集了 {total_collected} 條 {args.symbol} 的 {args.interval} K線數據")
+        progress.emit('complete', collected=total_collected, failedWindows=0)
+        refresh_derived_intervals(pipeline, args, start_timestamp, end_timestamp)
         return True
         
     except Exception as e:
         logger.error(f"數據收集過程中發生錯誤: {str(e)}")
+        progress.emit('error', message=str(e), fatal=True)
         import traceback
         logger.error(traceback.format_exc())
         return False
@@ -174,6 +346,7 @@ def main():
     """主函數"""
     args = parse_arguments()
     logger = setup_logger()
+    progress = ProgressReporter(args.progress_fd)
     
     logger.info("開始執行數據收集腳本")
     logger.info(f"參數信息: symbol={args.symbol}, 開始時間={args.start_time}, 結束時間={args.end_time}")
@@ -190,25 +363,31 @@ def main():
             args.config_path = corrected_path
             logger.info(f"修正後的配置文件是否存在: {os.path.exists(args.config_path)}")
             
-        success = collect_kline_data(args, logger)
+        success = collect_kline_data(args, logger, progress)
         logger.info("數據收集完成")
     except FileNotFoundError as e:
         logger.error(f"配置文件未找到: {str(e)}")
         logger.error(f"完整路徑: {os.path.abspath(args.config_path)}")
         logger.error(f"項目根目錄: {project_root}")
         logger.error(f"目錄內容: {os.listdir(os.path.dirname(args.config_path) if os.path.exists(os.path.dirname(args.config_path)) else project_root)}")
+        progress.emit('error', message=f"配置文件未找到: {str(e)}", fatal=True)
         sys.exit(1)
     except ValueError as e:
         logger.error(f"參數錯誤: {str(e)}")
+        progress.emit('error', message=f"參數錯誤: {str(e)}", fatal=True)
         sys.exit(1)
     except psycopg2.OperationalError as e:
         logger.error(f"數據庫連線錯誤: {str(e)}")
+        progress.emit('error', message=f"數據庫連線錯誤: {str(e)}", fatal=True)
         sys.exit(1)
     except Exception as e:
         logger.error(f"數據收集失敗: {str(e)}")
+        progress.emit('error', message=f"數據收集失敗: {str(e)}", fatal=True)
         import traceback
         logger.error(f"詳細錯誤信息: {traceback.format_exc()}")
         sys.exit(1)
+    finally:
+        progress.close()
     
     if success:
         logger.info("腳本執行成功")
@@ -0,0 +1,586 @@
+"""
+異步K線數據到TimescaleDB同步程式
+描述: 基於 httpx (HTTP/2 + 長連接池) 與 asyncpg 的異步交易所客戶端及K線數據管道，
+      單個進程即可並發同步大量交易對
+"""
+
+import asyncio
+import functools
+import hashlib
+import hmac
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Tuple, Union
+from urllib.parse import urlencode, urlparse
+
+import asyncpg
+import httpx
+import pandas as pd
+
+try:
+    from backend.services.data_tools.import_to_database import (
+        ConfigManager, ErrorHandler, KlineDataPipeline, TimescaleDBManager, INTERVAL_MS, contiguous_runs,
+        KLINE_CHANGED_CHANNEL, kline_change_payload, ApiClient, API_CLIENTS, create_api_client
+    )
+    from backend.services.data_tools.rate_limiter import RateLimiter
+    from backend.services.data_tools.kline_batch import json_loads
+except ImportError:  # 直接在 data_tools 目錄下運行時
+    from import_to_database import (
+        ConfigManager, ErrorHandler, KlineDataPipeline, TimescaleDBManager, INTERVAL_MS, contiguous_runs,
+        KLINE_CHANGED_CHANNEL, kline_change_payload, ApiClient, API_CLIENTS, create_api_client
+    )
+    from rate_limiter import RateLimiter
+    from kline_batch import json_loads
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依賴 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class AsyncApiClient:
+    """異步API客戶端基類"""
+
+    exchange_name = 'unknown'
+    # 原始K線到 KlineBatch 列的映射（與同步客戶端一致，None 使用默認格式）
+    kline_row_layout: Optional[Dict[str, int]] = None
+    kline_dict_keys: Optional[Dict[str, str]] = None
+    # 通過 ALPN 協商，交易所不支持時自動回退到 HTTP/1.1
+    supports_http2 = True
+
+    def __init__(self, api_config: Dict[str, Any], error_handler: ErrorHandler,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0):
+        self.api_config = api_config
+        self.error_handler = error_handler
+        self.rate_limiter = rate_limiter or RateLimiter(self.exchange_name, api_config.get('rate_limits'))
+        self.client = httpx.AsyncClient(
+            http2=self.supports_http2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            headers={
+                'User-Agent': 'KlineSync/1.0.0',
+                'Content-Type': 'application/json'
+            }
+        )
+
+    async def make_request(self, endpoint: str, params: Dict[str, Any] = None,
+                           headers: Dict[str, str] = None,
+                           max_retries: int = 3) -> Optional[Dict[str, Any]]:
+        """發送異步API請求"""
+        path = urlparse(endpoint).path
+        loop = asyncio.get_running_loop()
+        for attempt in range(max_retries):
+            try:
+                # 限流器使用文件鎖，在線程池中預扣令牌與更新配額，避免阻塞事件循環
+                wait = await loop.run_in_executor(None, self.rate_limiter.reserve, path)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                response = await self.client.get(endpoint, params=params, headers=headers)
+                await loop.run_in_executor(None, self.rate_limiter.observe_response,
+                                           path, response.status_code, response.headers)
+                response.raise_for_status()
+
+                try:
+                    return json_loads(response.content)
+                except ValueError as e:
+                    self.error_handler.logger.error(f"JSON解析錯誤: {str(e)}")
+                    return None
+
+            except httpx.HTTPError as e:
+                self.error_handler.handle_api_error(e, f"請求失敗 (嘗試 {attempt + 1})")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(2 ** attempt)  # 指數退避
+                else:
+                    return None
+        return None
+
+    async def aclose(self) -> None:
+        """關閉連接池"""
+        await self.client.aclose()
+        self.rate_limiter.close()
+
+
+class AsyncBingXApiClient(AsyncApiClient):
+    """BingX 異步API客戶端"""
+
+    exchange_name = 'bingx'
+
+    def __init__(self, api_config: Dict[str, Any], error_handler: ErrorHandler,
+                 rate_limiter: Optional[RateLimiter] = None, **pool_options):
+        super().__init__(api_config, error_handler, rate_limiter, **pool_options)
+        self.base_url = api_config.get('api_url', 'https://open-api.bingx.com')
+        self.api_key = api_config.get('api_key', '')
+        self.secret_key = api_config.get('secret_key', '')
+
+    def _generate_signature(self, params: Dict[str, Any]) -> str:
+        """生成API簽名"""
+        if not self.secret_key:
+            return ''
+
+        query_string = urlencode(sorted(params.items()))
+        return hmac.new(
+            self.secret_key.encode('utf-8'),
+            query_string.encode('utf-8'),
+            hashlib.sha256
+        ).hexdigest()
+
+    async def get_kline_data(self, symbol: str, interval: str, limit: int = 500,
+                             start_time: Optional[int] = None,
+                             end_time: Optional[int] = None) -> Optional[List[Union[List, Dict]]]:
+        """獲取K線數據"""
+        endpoint = f"{self.base_url}/openApi/swap/v3/quote/klines"
+
+        params = {
+            'symbol': symbol,
+            'interval': interval,
+            'limit': min(limit, 1000)  # BingX限制最大1000
+        }
+
+        if start_time:
+            params['startTime'] = start_time
+        if end_time:
+            params['endTime'] = end_time
+
+        headers = None
+        if self.api_key:
+            params['timestamp'] = int(time.time() * 1000)
+            params['signature'] = self._generate_signature(params)
+            headers = {'X-BX-APIKEY': self.api_key}
+
+        response = await self.make_request(endpoint, params, headers=headers)
+        if response and response.get('code') == 0:
+            return response.get('data', [])
+        else:
+            error_msg = response.get('msg', '未知錯誤') if response else 'API請求失敗'
+            self.error_handler.handle_api_error(Exception(error_msg), f"獲取K線數據: {symbol}")
+            return None
+
+
+class AsyncExecutorApiClient:
+    """在線程池中運行同步API客戶端（用於尚無異步實現的交易所）"""
+
+    def __init__(self, sync_client: ApiClient):
+        self.sync_client = sync_client
+        self.exchange_name = sync_client.exchange_name
+        self.kline_row_layout = sync_client.kline_row_layout
+        self.kline_dict_keys = sync_client.kline_dict_keys
+        self.rate_limiter = sync_client.rate_limiter
+
+    async def get_kline_data(self, symbol: str, interval: str, limit: int = 500,
+                             start_time: Optional[int] = None,
+                             end_time: Optional[int] = None) -> Optional[List[Union[List, Dict]]]:
+        """獲取K線數據"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(
+            self.sync_client.get_kline_data, symbol, interval, limit, start_time, end_time))
+
+    async def aclose(self) -> None:
+        """關閉 HTTP 會話"""
+        self.sync_client.session.close()
+        self.rate_limiter.close()
+
+
+# 有異步實現的交易所，其他交易所在線程池中運行同步客戶端
+ASYNC_API_CLIENTS = {
+    'bingx': AsyncBingXApiClient
+}
+
+
+class AsyncTimescaleDBManager:
+    """TimescaleDB 異步數據庫管理器"""
+
+    INSERT_SQL = """
+    INSERT INTO kline_data (
+        time, symbol, interval, open_price, high_price, low_price,
+        close_price, volume, quote_volume, trade_count,
+        taker_buy_volume, taker_buy_quote_volume
+    ) VALUES (
+        $1, $2, $3, $4::float8, $5::float8, $6::float8,
+        $7::float8, $8::float8, $9::float8, $10, $11::float8, $12::float8
+    )
+    ON CONFLICT (time, symbol, interval)
+    DO UPDATE SET
+        open_price = EXCLUDED.open_price,
+        high_price = EXCLUDED.high_price,
+        low_price = EXCLUDED.low_price,
+        close_price = EXCLUDED.close_price,
+        volume = EXCLUDED.volume,
+        quote_volume = EXCLUDED.quote_volume,
+        trade_count = EXCLUDED.trade_count,
+        taker_buy_volume = EXCLUDED.taker_buy_volume,
+        taker_buy_quote_volume = EXCLUDED.taker_buy_quote_volume
+    """
+
+    # 緊湊結構: 第 2 列為 series_id（參數順序與 INSERT_SQL 相同，只是 symbol, interval 換成 series_id）
+    INSERT_COMPACT_SQL = """
+    INSERT INTO kline_bars (
+        time, series_id, open_price, high_price, low_price,
+        close_price, volume, quote_volume, trade_count,
+        taker_buy_volume, taker_buy_quote_volume
+    ) VALUES (
+        $1, $2, $3::float8, $4::float8, $5::float8,
+        $6::float8, $7::float8, $8::float8, $9, $10::float8, $11::float8
+    )
+    ON CONFLICT (series_id, time)
+    DO UPDATE SET
+        open_price = EXCLUDED.open_price,
+        high_price = EXCLUDED.high_price,
+        low_price = EXCLUDED.low_price,
+        close_price = EXCLUDED.close_price,
+        volume = EXCLUDED.volume,
+        quote_volume = EXCLUDED.quote_volume,
+        trade_count = EXCLUDED.trade_count,
+        taker_buy_volume = EXCLUDED.taker_buy_volume,
+        taker_buy_quote_volume = EXCLUDED.taker_buy_quote_volume
+    """
+
+    SERIES_ID_SQL = """
+    WITH inserted AS (
+        INSERT INTO kline_series (symbol, interval) VALUES ($1, $2)
+        ON CONFLICT (symbol, interval) DO NOTHING
+        RETURNING series_id
+    )
+    SELECT series_id FROM inserted
+    UNION ALL
+    SELECT series_id FROM kline_series WHERE symbol = $1 AND interval = $2
+    LIMIT 1
+    """
+
+    # 與 TimescaleDBManager.COVERAGE_MERGE_SQL 相同的區間合併（參數: symbol, interval, start_ms, end_ms, step_ms）
+    COVERAGE_MERGE_SQL = """
+    WITH removed AS (
+        DELETE FROM kline_coverage
+        WHERE symbol = $1 AND interval = $2
+          AND start_time <= to_timestamp($4::float8 / 1000.0) + $5::float8 * INTERVAL '1 millisecond'
+          AND end_time >= to_timestamp($3::float8 / 1000.0) - $5::float8 * INTERVAL '1 millisecond'
+        RETURNING start_time, end_time
+    )
+    INSERT INTO kline_coverage (symbol, interval, start_time, end_time)
+    SELECT $1, $2,
+           LEAST(to_timestamp($3::float8 / 1000.0), MIN(start_time)),
+           GREATEST(to_timestamp($4::float8 / 1000.0), MAX(end_time))
+    FROM removed
+    """
+
+    def __init__(self, db_config: Dict[str, Any], error_handler: ErrorHandler,
+                 min_size: int = 2, max_size: int = 10):
+        self.db_config = db_config
+        self.error_handler = error_handler
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool: Optional[asyncpg.Pool] = None
+        self.decompress_before_upsert = False
+        self.compress_after_ms: Optional[int] = None
+        self.compact = False
+        self._series_ids: Dict[Tuple[str, str], int] = {}
+
+    DECOMPRESS_RANGE_SQL = """
+    SELECT decompress_chunk(format('%I.%I', chunk_schema, chunk_name)::regclass, if_compressed => TRUE)
+    FROM timescaledb_information.chunks
+    WHERE hypertable_name = '{table}' AND is_compressed
+      AND range_start <= to_timestamp($2::float8 / 1000.0)
+      AND range_end > to_timestamp($1::float8 / 1000.0)
+    """
+
+    async def initialize(self) -> None:
+        """創建連接池並確保數據表存在"""
+        try:
+            self.pool = await asyncpg.create_pool(
+                host=self.db_config['host'],
+                port=self.db_config['port'],
+                database=self.db_config['database'],
+                user=self.db_config['user'],
+                password=self.db_config['password'],
+                min_size=self.min_size,
+                max_size=self.max_size,
+                command_timeout=60
+            )
+            self.error_handler.logger.info("數據庫連接池已初始化")
+        except (asyncpg.PostgresError, OSError) as e:
+            self.error_handler.handle_db_error(e, "數據庫連接")
+            raise
+
+        try:
+            async with self.pool.acquire() as conn:
+                relkind = await conn.fetchval(TimescaleDBManager.KLINE_RELKIND_SQL)
+                self.compact = TimescaleDBManager.use_compact_schema(
+                    self.db_config, relkind.decode() if isinstance(relkind, bytes) else relkind,
+                    self.error_handler.logger)
+                await conn.execute(TimescaleDBManager.schema_sql(self.compact))
+            schema = '緊湊' if self.compact else '原'
+            self.error_handler.logger.info(f"數據表創建/檢查完成（{schema}表結構）")
+        except asyncpg.PostgresError as e:
+            self.error_handler.handle_db_error(e, "創建數據表")
+
+        await self._detect_compression()
+
+    @property
+    def kline_table(self) -> str:
+        """K線超表名"""
+        return 'kline_bars' if self.compact else 'kline_data'
+
+    async def _series_id(self, conn: asyncpg.Connection, symbol: str, interval: str) -> int:
+        """緊湊結構下 (symbol, interval) 對應的 series_id，不存在時創建"""
+        key = (symbol, interval)
+        series_id = self._series_ids.get(key)
+        if series_id is None:
+            series_id = self._series_ids[key] = await conn.fetchval(self.SERIES_ID_SQL, symbol, interval)
+        return series_id
+
+    async def _detect_compression(self) -> None:
+        """檢測 kline_data 是否啟用壓縮（TimescaleDB < 2.11 寫入壓縮分塊前需要解壓）"""
+        try:
+            async with self.pool.acquire() as conn:
+                version, enabled, compress_after = await conn.fetchrow(
+                    TimescaleDBManager.COMPRESSION_STATE_SQL.format(table=self.kline_table))
+        except asyncpg.PostgresError as e:
+            self.error_handler.logger.warning(f"無法檢測 kline_data 壓縮狀態: {e}")
+            return
+        self.compress_after_ms = int(float(compress_after) * 1000) if compress_after is not None else None
+        self.decompress_before_upsert = (
+            bool(enabled) and TimescaleDBManager._parse_version(version) < (2, 11))
+
+    async def _prepare_upsert(self, conn: asyncpg.Connection, df: pd.DataFrame) -> None:
+        """回補範圍可能落在已壓縮分塊時先解壓"""
+        if not self.decompress_before_upsert:
+            return
+        timestamps_ms = pd.to_datetime(df['datetime']).values.astype('datetime64[ms]').astype('int64')
+        start_ms, end_ms = int(timestamps_ms.min()), int(timestamps_ms.max())
+        if self.compress_after_ms is not None and start_ms > time.time() * 1000 - self.compress_after_ms:
+            return
+        await conn.fetch(self.DECOMPRESS_RANGE_SQL.format(table=self.kline_table), start_ms, end_ms)
+
+    async def insert_kline_data(self, df: pd.DataFrame) -> bool:
+        """插入K線數據"""
+        if df.empty:
+            return True
+
+        # 按列轉換為 Python 原生類型，避免逐行訪問 DataFrame
+        def column(name, default=0):
+            if name in df.columns:
+                return df[name].fillna(default).tolist()
+            return [default] * len(df)
+
+        columns = [
+            column('open'), column('high'), column('low'), column('close'), column('volume'),
+            column('quote_volume'),
+            [int(v) for v in column('trade_count')],
+            column('taker_buy_volume'),
+            column('taker_buy_quote_volume')
+        ]
+        # 解析得到的 datetime 為不帶時區的 UTC；asyncpg 會把 naive 值當作本機時間轉換，須顯式標記為 UTC
+        datetimes = pd.to_datetime(df['datetime'])
+        if datetimes.dt.tz is None:
+            datetimes = datetimes.dt.tz_localize('UTC')
+        times = datetimes.dt.to_pydatetime().tolist()
+
+        try:
+            async with self.pool.acquire() as conn:
+                await self._prepare_upsert(conn, df)
+                if self.compact:
+                    series_ids = [await self._series_id(conn, symbol, interval)
+                                  for symbol, interval in zip(df['symbol'], df['interval'])]
+                    await conn.executemany(self.INSERT_COMPACT_SQL, list(zip(times, series_ids, *columns)))
+                else:
+                    records = list(zip(times, df['symbol'].tolist(), df['interval'].tolist(), *columns))
+                    await conn.executemany(self.INSERT_SQL, records)
+                await self._record_coverage(conn, df)
+            self.error_handler.logger.info(f"成功插入 {len(df)} 條K線數據")
+            return True
+        except asyncpg.PostgresError as e:
+            self.error_handler.handle_db_error(e, "插入K線數據")
+            return False
+
+    async def _record_coverage(self, conn: asyncpg.Connection, df: pd.DataFrame) -> None:
+        """按寫入的K線時間戳更新覆蓋索引，並在同一事務中發送寫入通知"""
+        for (symbol, interval), group in df.groupby(['symbol', 'interval'], sort=False):
+            step_ms = INTERVAL_MS.get(interval)
+            if step_ms is None:
+                continue
+            timestamps_ms = pd.to_datetime(group['datetime']).values.astype('datetime64[ms]').astype('int64')
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1::text || '|' || $2::text))", symbol, interval)
+                runs = contiguous_runs(timestamps_ms, step_ms)
+                for start_ms, end_ms in runs:
+                    await conn.execute(self.COVERAGE_MERGE_SQL, symbol, interval, start_ms, end_ms, step_ms)
+                if runs:
+                    await conn.execute("SELECT pg_notify($1, $2)", KLINE_CHANGED_CHANNEL,
+                                       kline_change_payload(symbol, interval, runs[0][0], runs[-1][1]))
+
+    async def get_latest_timestamp(self, symbol: str, interval: str) -> Optional[datetime]:
+        """獲取最新數據時間戳"""
+        try:
+            async with self.pool.acquire() as conn:
+                if self.compact:
+                    return await conn.fetchval(
+                        "SELECT MAX(time) FROM kline_bars WHERE series_id = "
+                        "(SELECT series_id FROM kline_series WHERE symbol = $1 AND interval = $2)",
+                        symbol, interval
+                    )
+                return await conn.fetchval(
+                    "SELECT MAX(time) FROM kline_data WHERE symbol = $1 AND interval = $2",
+                    symbol, interval
+                )
+        except asyncpg.PostgresError as e:
+            self.error_handler.handle_db_error(e, "查詢最新時間戳")
+            return None
+
+    async def close(self) -> None:
+        """關閉連接池"""
+        if self.pool:
+            await self.pool.close()
+            self.error_handler.logger.info("數據庫連接池已關閉")
+
+
+class AsyncKlineDataPipeline:
+    """異步K線數據管道"""
+
+    # 解析與驗證邏輯與同步管道共用
+    _parse_kline_data = KlineDataPipeline._parse_kline_data
+    _validate_kline_data = KlineDataPipeline._validate_kline_data
+    _parse_kline_batch = KlineDataPipeline._parse_kline_batch
+    _validate_kline_batch = KlineDataPipeline._validate_kline_batch
+    _select_exchange_config = KlineDataPipeline._select_exchange_config
+
+    def __init__(self, config_path: str, max_concurrency: int = 50, exchange_name: Optional[str] = None,
+                 **pool_options):
+        self.error_handler = ErrorHandler()
+        self.config_manager = ConfigManager(config_path)
+        self.exchange_name = exchange_name
+        self.max_concurrency = max_concurrency
+        self.pool_options = pool_options
+        self.api_client = None
+        self.db_manager = AsyncTimescaleDBManager(
+            self.config_manager.get_database_config(), self.error_handler
+        )
+
+    async def initialize(self) -> None:
+        """初始化API客戶端與數據庫連接池"""
+        self.api_client = self._create_api_client()
+        await self.db_manager.initialize()
+        self.error_handler.logger.info("異步K線數據管道初始化完成")
+
+    async def __aenter__(self) -> 'AsyncKlineDataPipeline':
+        await self.initialize()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    def _create_api_client(self) -> Union[AsyncApiClient, AsyncExecutorApiClient]:
+        """根據交易所配置創建異步API客戶端（未指定交易所時使用配置中的第一個）"""
+        exchange_config = self._select_exchange_config(self.exchange_name)
+        exchange_name = exchange_config.get('exchange_name', '').lower()
+
+        client_class = ASYNC_API_CLIENTS.get(exchange_name)
+        if client_class is not None:
+            self.error_handler.logger.info(f"使用 {exchange_name} 交易所異步API")
+            rate_limiter = RateLimiter.from_exchange_config(exchange_config)
+            return client_class(exchange_config.get('api_info', {}), self.error_handler, rate_limiter,
+                                **self.pool_options)
+        if exchange_name in API_CLIENTS:
+            self.error_handler.logger.info(f"{exchange_name} 沒有異步API實現，在線程池中運行同步客戶端")
+            return AsyncExecutorApiClient(create_api_client(exchange_config, self.error_handler))
+        raise ValueError(f"異步管道不支持的交易所: {exchange_name}")
+
+    async def fetch_kline_data(self, symbol: str, interval: str = '1h',
+                               limit: int = 500, start_time: Optional[Any] = None,
+                               end_time: Optional[Any] = None) -> pd.DataFrame:
+        """獲取K線數據"""
+        if start_time is not None and isinstance(start_time, datetime):
+            start_time = int(start_time.timestamp() * 1000)
+
+        if end_time is not None and isinstance(end_time, datetime):
+            end_time = int(end_time.timestamp() * 1000)
+
+        raw_data = await self.api_client.get_kline_data(
+            symbol=symbol,
+            interval=interval,
+            limit=limit,
+            start_time=start_time,
+            end_time=end_time
+        )
+
+        if raw_data is None:
+            self.error_handler.logger.error(f"獲取K線數據失敗: {symbol}")
+            return pd.DataFrame()
+
+        return self._parse_kline_data(raw_data, symbol, interval)
+
+    async def sync_kline_data(self, symbol: str, interval: str = '1h',
+                              limit: int = 500, incremental: bool = True) -> bool:
+        """同步K線數據到數據庫"""
+        try:
+            start_time = None
+
+            if incremental:
+                latest_time = await self.db_manager.get_latest_timestamp(symbol, interval)
+                if latest_time:
+                    # 從最新一根K線開始獲取：它寫入時可能尚未收盤，需要用收盤後的數據覆蓋（與同步管道一致）
+                    start_time = int(latest_time.timestamp() * 1000)
+
+            df = await self.fetch_kline_data(
+                symbol=symbol,
+                interval=interval,
+                limit=limit,
+                start_time=start_time
+            )
+
+            if df.empty:
+                self.error_handler.logger.info(f"沒有新數據需要同步: {symbol}")
+                return True
+
+            success = await self.db_manager.insert_kline_data(df)
+            if success:
+                self.error_handler.logger.info(
+                    f"成功同步K線數據: {symbol} {interval} ({len(df)} 條)"
+                )
+            return success
+
+        except Exception as e:
+            self.error_handler.handle_general_error(e, f"同步K線數據: {symbol}")
+            return False
+
+    async def sync_multiple_symbols(self, symbols: List[str], interval: str = '1h',
+                                    limit: int = 500) -> Dict[str, bool]:
+        """並發同步多個交易對，並發數受 max_concurrency 與限流器共同約束"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _sync(symbol: str) -> bool:
+            async with semaphore:
+                return await self.sync_kline_data(symbol, interval, limit)
+
+        self.error_handler.logger.info(f"開始並發同步 {len(symbols)} 個交易對")
+        outcomes = await asyncio.gather(*(_sync(symbol) for symbol in symbols))
+        results = dict(zip(symbols, outcomes))
+
+        success_count = sum(1 for success in results.values() if success)
+        self.error_handler.logger.info(f"批量同步完成: 成功 {success_count}/{len(symbols)}")
+        return results
+
+    async def close(self) -> None:
+        """關閉所有連接"""
+        if self.api_client:
+            await self.api_client.aclose()
+        await self.db_manager.close()
+        self.error_handler.logger.info("異步K線數據管道已關閉")
+
+
+async def main():
+    """主函數 - 示例用法"""
+    async with AsyncKlineDataPipeline('config.json') as pipeline:
+        symbols = pipeline.config_manager.config.get('trading_pairs', ['BTC-USDT', 'ETH-USDT'])
+        results = await pipeline.sync_multiple_symbols(symbols, interval='1h', limit=1000)
+        for symbol, success in results.items():
+            print(f"  {symbol}: {'成功' if success else '失敗'}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
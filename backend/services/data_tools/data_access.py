@@ -2,6 +2,8 @@
 虛擬貨幣交易數據庫訪問層
 """
 import asyncio
+import json
+import time
 import asyncpg
 import pandas as pd
 from datetime import datetime, timedelta
@@ -9,15 +11,29 @@ from typing import List, Dict, Optional, Tuple
 import logging
 from contextlib import asynccontextmanager
 
+try:
+    from backend.services.data_tools.orderbook_store import OrderBookFrameEncoder, frames_to_columns, reconstruct
+except ImportError:  # 直接在 data_tools 目錄下運行時
+    from orderbook_store import OrderBookFrameEncoder, frames_to_columns, reconstruct
+
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class DataAccess:
-    """虛擬貨幣數據庫訪問類"""
+    """虛擬貨幣數據庫訪問類
+
+    bulk_threshold: 批量插入的行數達到該值時改用 COPY 寫入臨時暫存表，再以一條集合式語句合併
+    orderbook_storage: 'jsonb' 寫入 orderbook_snapshots；'compact' 寫入 orderbook_frames
+                       （打包的 float8 價位，每 snapshot_every 次更新一個快照，其間為增量，需先執行 05_compact_orderbook.sql）
+    """
 
-    def __init__(self, connection_string: str):
+    def __init__(self, connection_string: str, bulk_threshold: int = 1000,
+                 orderbook_storage: str = 'jsonb', snapshot_every: int = 100):
         self.connection_string = connection_string
+        self.bulk_threshold = bulk_threshold
+        self.orderbook_storage = orderbook_storage
+        self.orderbook_encoder = OrderBookFrameEncoder(snapshot_every)
         self.pool: Optional[asyncpg.Pool] = None
 
     async def initialize(self):
@@ -42,37 +58,87 @@ class DataAccess:
         async with self.pool.acquire() as connection:
             yield connection
 
-    async def insert_market_data(self, data: pd.DataFrame, pair_id: int):
+    # 暫存表只在當前事務內存在（ON COMMIT DROP），價格列用 FLOAT8 以走 COPY 的定長二進制編碼，
+    # 合併時再轉換為目標表的 DECIMAL
+    MARKET_DATA_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume', 'quote_volume', 'trade_count']
+
+    MARKET_DATA_STAGING_SQL = """
+        CREATE TEMP TABLE market_data_staging (
+            time TIMESTAMPTZ NOT NULL,
+            open FLOAT8,
+            high FLOAT8,
+            low FLOAT8,
+            close FLOAT8,
+            volume FLOAT8,
+            quote_volume FLOAT8,
+            trade_count INTEGER
+        ) ON COMMIT DROP
+        """
+
+    MARKET_DATA_UPSERT = """
+        ON CONFLICT (time, pair_id) DO UPDATE SET
+            open = EXCLUDED.open,
+            high = EXCLUDED.high,
+            low = EXCLUDED.low,
+            close = EXCLUDED.close,
+            volume = EXCLUDED.volume,
+            quote_volume = EXCLUDED.quote_volume,
+            trade_count = EXCLUDED.trade_count
+        """
+
+    # 同一批次內重複的時間只保留一行（ON CONFLICT DO UPDATE 不能在一條語句內兩次更新同一行）
+    MERGE_MARKET_DATA_SQL = """
+        INSERT INTO market_data
+        (time, pair_id, open, high, low, close, volume, quote_volume, trade_count)
+        SELECT DISTINCT ON (time)
+            time, $1, open, high, low, close, volume, quote_volume, trade_count
+        FROM market_data_staging
+        ORDER BY time
+        """ + MARKET_DATA_UPSERT
+
+    @classmethod
+    def market_data_records(cls, data: pd.DataFrame) -> List[Tuple]:
+        """按列取出 DataFrame 的值並組合為元組（缺失的可選列寫 0）"""
+        columns = [
+            data[name].tolist() if name in data.columns else [0] * len(data)
+            for name in cls.MARKET_DATA_COLUMNS
+        ]
+        return list(zip(*columns))
+
+    def _use_bulk(self, rows: int, method: str) -> bool:
+        """method: 'values' 逐行 executemany；'copy' 走暫存表；'auto' 按 bulk_threshold 選擇"""
+        return method == 'copy' or (method == 'auto' and rows >= self.bulk_threshold)
+
+    async def insert_market_data(self, data: pd.DataFrame, pair_id: int, method: str = 'auto'):
         """批量插入市場數據"""
+        if data.empty:
+            return
+        await self.insert_market_records(self.market_data_records(data), pair_id, method)
+
+    async def insert_market_records(self, records: List[Tuple], pair_id: int, method: str = 'auto'):
+        """批量插入市場數據元組，列順序同 MARKET_DATA_COLUMNS"""
+        if not records:
+            return
+        started = time.perf_counter()
         async with self.acquire() as conn:
-            # 準備數據
-            records = [
-                (
-                    row['time'], pair_id, row['open'], row['high'],
-                    row['low'], row['close'], row['volume'],
-                    row.get('quote_volume', 0), row.get('trade_count', 0)
+            if self._use_bulk(len(records), method):
+                async with conn.transaction():
+                    await conn.execute(self.MARKET_DATA_STAGING_SQL)
+                    await conn.copy_records_to_table(
+                        'market_data_staging', records=records, columns=self.MARKET_DATA_COLUMNS
+                    )
+                    await conn.execute(self.MERGE_MARKET_DATA_SQL, pair_id)
+            else:
+                await conn.executemany(
+                    """
+                    INSERT INTO market_data
+                    (time, pair_id, open, high, low, close, volume, quote_volume, trade_count)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                    """ + self.MARKET_DATA_UPSERT,
+                    [(record[0], pair_id) + record[1:] for record in records]
                 )
-                for _, row in data.iterrows()
-            ]
-
-            # 批量插入
-            await conn.executemany(
-                """
-                INSERT INTO market_data
-                (time, pair_id, open, high, low, close, volume, quote_volume, trade_count)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                ON CONFLICT (time, pair_id) DO UPDATE SET
-                    open = EXCLUDED.open,
-                    high = EXCLUDED.high,
-                    low = EXCLUDED.low,
-                    close = EXCLUDED.close,
-                    volume = EXCLUDED.volume,
-                    quote_volume = EXCLUDED.quote_volume,
-                    trade_count = EXCLUDED.trade_count
-                """,
-                records
-            )
-            logger.info(f"成功插入 {len(records)} 條市場數據")
+        elapsed = time.perf_counter() - started
+        logger.info(f"成功插入 {len(records)} 條市場數據 ({len(records) / elapsed:.0f} 條/秒)")
 
     async def get_latest_price(self, pair_id: int) -> Dict:
         """獲取最新價格"""
@@ -181,28 +247,66 @@ class DataAccess:
             rows = await conn.fetch(query, *params)
             return [dict(row) for row in rows]
 
-    async def insert_trades(self, trades: List[Dict], pair_id: int):
+    TRADE_COLUMNS = ['time', 'trade_id', 'price', 'quantity', 'side', 'maker_order_id', 'taker_order_id']
+
+    TRADES_STAGING_SQL = """
+        CREATE TEMP TABLE trades_staging (
+            time TIMESTAMPTZ NOT NULL,
+            trade_id BIGINT NOT NULL,
+            price FLOAT8 NOT NULL,
+            quantity FLOAT8 NOT NULL,
+            side VARCHAR(4) NOT NULL,
+            maker_order_id BIGINT,
+            taker_order_id BIGINT
+        ) ON COMMIT DROP
+        """
+
+    MERGE_TRADES_SQL = """
+        INSERT INTO trades
+        (time, trade_id, pair_id, price, quantity, side, maker_order_id, taker_order_id)
+        SELECT time, trade_id, $1, price, quantity, side, maker_order_id, taker_order_id
+        FROM trades_staging
+        ON CONFLICT (time, trade_id, pair_id) DO NOTHING
+        """
+
+    @staticmethod
+    def trade_record(trade: Dict) -> Tuple:
+        """交易記錄字典轉為元組，列順序同 TRADE_COLUMNS"""
+        return (
+            trade['time'], trade['trade_id'],
+            trade['price'], trade['quantity'], trade['side'],
+            trade.get('maker_order_id'), trade.get('taker_order_id')
+        )
+
+    async def insert_trades(self, trades: List[Dict], pair_id: int, method: str = 'auto'):
         """批量插入交易記錄"""
+        await self.insert_trade_records([self.trade_record(trade) for trade in trades], pair_id, method)
+
+    async def insert_trade_records(self, records: List[Tuple], pair_id: int, method: str = 'auto'):
+        """批量插入交易記錄元組，列順序同 TRADE_COLUMNS"""
+        if not records:
+            return
+        started = time.perf_counter()
         async with self.acquire() as conn:
-            records = [
-                (
-                    trade['time'], trade['trade_id'], pair_id,
-                    trade['price'], trade['quantity'], trade['side'],
-                    trade.get('maker_order_id'), trade.get('taker_order_id')
+            if self._use_bulk(len(records), method):
+                async with conn.transaction():
+                    await conn.execute(self.TRADES_STAGING_SQL)
+                    await conn.copy_records_to_table(
+                        'trades_staging', records=records, columns=self.TRADE_COLUMNS
+                    )
+                    await conn.execute(self.MERGE_TRADES_SQL, pair_id)
+            else:
+                await conn.executemany(
+                    """
+                    INSERT INTO trades
+                    (time, trade_id, pair_id, price, quantity, side, maker_order_id, taker_order_id)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                    ON CONFLICT (time, trade_id, pair_id) DO NOTHING
+                    """,
+                    [record[:2] + (pair_id,) + record[2:] for record in records]
                 )
-                for trade in trades
-            ]
-
-            await conn.executemany(
-                """
-                INSERT INTO trades
-                (time, trade_id, pair_id, price, quantity, side, maker_order_id, taker_order_id)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-                ON CONFLICT (time, trade_id, pair_id) DO NOTHING
-                """,
-                records
-            )
-            logger.info(f"成功插入 {len(records)} 條交易記錄")
+        elapsed = time.perf_counter() - started
+        logger.info(f"成功插入 {len(records)} 條交易記錄 ({len(records) / elapsed:.0f} 條/秒)")
 
     async def get_volume_profile(
         self,
@@ -211,46 +315,70 @@ class DataAccess:
         end_time: datetime,
         price_bins: int = 50
     ) -> pd.DataFrame:
-        """獲取成交量分布"""
+        """獲取成交量分布
+
+        一次 width_bucket 聚合把區間內成交按價格分成 price_bins 等寬桶（最高價歸入最後一桶），
+        再與 generate_series 的桶號左連接補齊空桶；price_level 為桶的下沿
+        """
         async with self.acquire() as conn:
             rows = await conn.fetch(
                 """
-                WITH price_range AS (
-                    SELECT MIN(price) AS min_price, MAX(price) AS max_price
+                WITH bounds AS (
+                    SELECT MIN(price) AS lo, MAX(price) AS hi
                     FROM trades
                     WHERE pair_id = $1 AND time >= $2 AND time <= $3
                 ),
-                price_bins AS (
+                binned AS (
                     SELECT
-                        generate_series(
-                            min_price,
-                            max_price,
-                            (max_price - min_price) / $4
-                        ) AS price_level
-                    FROM price_range
+                        CASE WHEN b.hi = b.lo THEN 1
+                             ELSE LEAST(width_bucket(t.price, b.lo, b.hi, $4::int), $4::int)
+                        END AS bin,
+                        SUM(t.quantity) AS volume,
+                        COUNT(*) AS trade_count
+                    FROM trades t CROSS JOIN bounds b
+                    WHERE t.pair_id = $1 AND t.time >= $2 AND t.time <= $3
+                    GROUP BY 1
                 )
                 SELECT
-                    pb.price_level,
-                    COALESCE(SUM(t.quantity), 0) AS volume,
-                    COUNT(t.trade_id) AS trade_count
-                FROM price_bins pb
-                LEFT JOIN trades t ON
-                    t.pair_id = $1
-                    AND t.time >= $2
-                    AND t.time <= $3
-                    AND t.price >= pb.price_level
-                    AND t.price < pb.price_level + (
-                        SELECT (max_price - min_price) / $4 FROM price_range
-                    )
-                GROUP BY pb.price_level
-                ORDER BY pb.price_level
+                    b.lo + (s.bin - 1) * (b.hi - b.lo) / $4::int AS price_level,
+                    COALESCE(binned.volume, 0) AS volume,
+                    COALESCE(binned.trade_count, 0) AS trade_count
+                FROM bounds b
+                CROSS JOIN generate_series(1, $4::int) AS s(bin)
+                LEFT JOIN binned ON binned.bin = s.bin
+                WHERE b.lo IS NOT NULL
+                ORDER BY s.bin
                 """,
                 pair_id, start_time, end_time, price_bins
             )
 
-            df = pd.DataFrame(rows)
+            df = pd.DataFrame(rows, columns=['price_level', 'volume', 'trade_count'])
             return df
 
+    async def get_volume_histogram(
+        self,
+        pair_id: int,
+        start_time: datetime,
+        end_time: datetime,
+        bin_size: float
+    ) -> List[Tuple[int, float, int]]:
+        """按固定價格寬度聚合成交量，返回 (桶號 floor(price / bin_size), 成交量, 成交筆數)，用於初始化 VolumeProfile"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT
+                    floor(price / $4::numeric)::bigint AS bin,
+                    SUM(quantity)::float8 AS volume,
+                    COUNT(*) AS trade_count
+                FROM trades
+                WHERE pair_id = $1 AND time >= $2 AND time <= $3
+                GROUP BY 1
+                ORDER BY 1
+                """,
+                pair_id, start_time, end_time, bin_size
+            )
+            return [(row['bin'], row['volume'], row['trade_count']) for row in rows]
+
     async def insert_orderbook_snapshot(
         self, 
         pair_id: int, 
@@ -259,10 +387,15 @@ class DataAccess:
         asks: List[Tuple[float, float]]
     ):
         """插入訂單簿快照"""
+        if self.orderbook_storage == 'compact':
+            await self.insert_orderbook_frames([self.orderbook_encoder.snapshot(pair_id, sequence_id, bids, asks)],
+                                               pair_id)
+            return
+
         async with self.acquire() as conn:
             # 轉換成 JSONB 格式
-            bids_json = [{"price": bid[0], "quantity": bid[1]} for bid in bids]
-            asks_json = [{"price": ask[0], "quantity": ask[1]} for ask in asks]
+            bids_json = json.dumps([{"price": bid[0], "quantity": bid[1]} for bid in bids])
+            asks_json = json.dumps([{"price": ask[0], "quantity": ask[1]} for ask in asks])
             
             await conn.execute(
                 """
@@ -274,6 +407,95 @@ class DataAccess:
             )
             logger.info(f"成功插入訂單簿快照，交易對ID: {pair_id}, 序列號: {sequence_id}")
 
+    async def insert_orderbook_update(
+        self,
+        pair_id: int,
+        sequence_id: int,
+        bid_changes: List[Tuple[float, float]],
+        ask_changes: List[Tuple[float, float]]
+    ):
+        """插入訂單簿增量（quantity 為 0 表示刪除價位），只用於 compact 存儲"""
+        frame = self.orderbook_encoder.update(pair_id, sequence_id, bid_changes, ask_changes)
+        await self.insert_orderbook_frames([frame], pair_id)
+
+    async def insert_orderbook_frames(self, records: List[Tuple], pair_id: int):
+        """用一條語句插入多個訂單簿幀，records 為 OrderBookFrameEncoder 的輸出"""
+        if not records:
+            return
+        times, sequence_ids, is_snapshot, bids, asks = frames_to_columns(records)
+        async with self.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO orderbook_frames (time, pair_id, sequence_id, is_snapshot, bids, asks)
+                SELECT time, $1, sequence_id, is_snapshot, bids, asks
+                FROM unnest($2::timestamptz[], $3::bigint[], $4::boolean[], $5::bytea[], $6::bytea[])
+                    AS f(time, sequence_id, is_snapshot, bids, asks)
+                ON CONFLICT (pair_id, sequence_id, time) DO NOTHING
+                """,
+                pair_id, times, sequence_ids, is_snapshot, bids, asks
+            )
+
+    async def get_orderbook_at(
+        self,
+        pair_id: int,
+        at_time: datetime,
+        depth: Optional[int] = None
+    ) -> Optional[Dict]:
+        """重建 at_time 時的訂單簿（compact 存儲）：讀取最近的快照及其後的增量，一次查詢"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                WITH snapshot AS (
+                    SELECT time, sequence_id
+                    FROM orderbook_frames
+                    WHERE pair_id = $1 AND is_snapshot AND time <= $2
+                    ORDER BY time DESC
+                    LIMIT 1
+                )
+                SELECT f.sequence_id, f.is_snapshot, f.bids, f.asks
+                FROM orderbook_frames f, snapshot s
+                WHERE f.pair_id = $1
+                  AND f.time >= s.time AND f.time <= $2
+                  AND f.sequence_id >= s.sequence_id
+                ORDER BY f.sequence_id
+                """,
+                pair_id, at_time
+            )
+        book = reconstruct(((row['sequence_id'], row['is_snapshot'], row['bids'], row['asks']) for row in rows),
+                           depth)
+        if book is None:
+            return None
+        sequence_id, bids, asks = book
+        return {"pair_id": pair_id, "sequence_id": sequence_id, "bids": bids, "asks": asks}
+
+    async def insert_orderbook_snapshots(self, records: List[Tuple], pair_id: int):
+        """用一條語句插入多個訂單簿快照，records 為 (time, sequence_id, bids, asks)"""
+        if not records:
+            return
+        if self.orderbook_storage == 'compact':
+            await self.insert_orderbook_frames([
+                self.orderbook_encoder.snapshot(pair_id, sequence_id, record_bids, record_asks, record_time)
+                for record_time, sequence_id, record_bids, record_asks in records
+            ], pair_id)
+            return
+        times, sequence_ids, bids, asks = zip(*records)
+        async with self.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO orderbook_snapshots (time, pair_id, sequence_id, bids, asks)
+                SELECT time, $1, sequence_id, bids::jsonb, asks::jsonb
+                FROM unnest($2::timestamptz[], $3::bigint[], $4::text[], $5::text[])
+                    AS s(time, sequence_id, bids, asks)
+                ON CONFLICT (time, pair_id, sequence_id) DO NOTHING
+                """,
+                pair_id, list(times), list(sequence_ids),
+                [json.dumps([{"price": price, "quantity": quantity} for price, quantity in levels])
+                 for levels in bids],
+                [json.dumps([{"price": price, "quantity": quantity} for price, quantity in levels])
+                 for levels in asks]
+            )
+        logger.info(f"成功插入 {len(records)} 個訂單簿快照，交易對ID: {pair_id}")
+
     async def insert_technical_indicator(
         self,
         pair_id: int,
@@ -293,6 +515,26 @@ class DataAccess:
             )
             logger.info(f"成功插入技術指標: {indicator_name}, 交易對ID: {pair_id}, 時間框架: {timeframe}")
 
+    async def insert_technical_indicators(self, records: List[Tuple], pair_id: int):
+        """用一條語句插入多個技術指標，records 為 (time, timeframe, indicator_name, indicator_value)"""
+        if not records:
+            return
+        times, timeframes, names, values = zip(*records)
+        async with self.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO technical_indicators
+                (time, pair_id, timeframe, indicator_name, indicator_value)
+                SELECT time, $1, timeframe, indicator_name, indicator_value::jsonb
+                FROM unnest($2::timestamptz[], $3::text[], $4::text[], $5::text[])
+                    AS s(time, timeframe, indicator_name, indicator_value)
+                ON CONFLICT (time, pair_id, timeframe, indicator_name)
+                DO UPDATE SET indicator_value = EXCLUDED.indicator_value
+                """,
+                pair_id, list(times), list(timeframes), list(names), [json.dumps(value) for value in values]
+            )
+        logger.info(f"成功插入 {len(records)} 條技術指標，交易對ID: {pair_id}")
+
     async def get_technical_indicator(
         self,
         pair_id: int,
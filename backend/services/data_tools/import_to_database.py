@@ -5,17 +5,83 @@ K線數據到TimescaleDB同步程式
 描述: 從BingX交易所獲取K線數據並存儲到TimescaleDB中
 """
 
+import io
 import json
 import logging
 import requests
+import numpy as np
 import pandas as pd
 import psycopg2
+import threading
 import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple, Any, Union
 import hashlib
 import hmac
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlparse
+
+try:
+    from backend.services.data_tools.rate_limiter import RateLimiter
+    from backend.services.data_tools.kline_batch import KlineBatch, json_loads
+except ImportError:  # 直接在 data_tools 目錄下運行時
+    from rate_limiter import RateLimiter
+    from kline_batch import KlineBatch, json_loads
+
+# PostgreSQL 二進制 COPY 格式的文件頭與結束標記
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + b'\x00\x00\x00\x00' + b'\x00\x00\x00\x00'
+PGCOPY_TRAILER = b'\xff\xff'
+# PostgreSQL 時間紀元 (2000-01-01 UTC) 與 Unix 紀元之間的微秒差
+PG_EPOCH_OFFSET_US = 946684800000000
+
+# K線間隔對應的毫秒數
+INTERVAL_MS = {
+    '1m': 60 * 1000,
+    '5m': 5 * 60 * 1000,
+    '15m': 15 * 60 * 1000,
+    '30m': 30 * 60 * 1000,
+    '1h': 60 * 60 * 1000,
+    '4h': 4 * 60 * 60 * 1000,
+    '1d': 24 * 60 * 60 * 1000
+}
+
+
+# 派生模式下只採集 BASE_INTERVAL，更高週期由連續聚合生成
+# 週期 -> (來源週期, time_bucket 寬度, 刷新策略 start_offset, end_offset, schedule_interval)
+BASE_INTERVAL = '1m'
+DERIVED_INTERVALS = {
+    '5m': ('1m', '5 minutes', '1 day', '5 minutes', '5 minutes'),
+    '15m': ('1m', '15 minutes', '2 days', '15 minutes', '15 minutes'),
+    '30m': ('1m', '30 minutes', '2 days', '30 minutes', '30 minutes'),
+    '1h': ('1m', '1 hour', '3 days', '1 hour', '30 minutes'),
+    '4h': ('1h', '4 hours', '7 days', '4 hours', '1 hour'),
+    '1d': ('1h', '1 day', '30 days', '1 day', '1 hour')
+}
+
+
+def continuous_aggregate_name(interval: str) -> str:
+    """派生週期對應的連續聚合視圖名"""
+    return f"kline_data_{interval}"
+
+
+# K線寫入通知頻道：負載為 {"symbol", "interval", "start_ms", "end_ms"}，API 據此使緩存失效
+KLINE_CHANGED_CHANNEL = 'kline_data_changed'
+
+
+def kline_change_payload(symbol: str, interval: str, start_ms: int, end_ms: int) -> str:
+    """構造K線寫入通知的負載"""
+    return json.dumps({'symbol': symbol, 'interval': interval,
+                       'start_ms': int(start_ms), 'end_ms': int(end_ms)})
+
+
+def contiguous_runs(timestamps_ms: np.ndarray, step_ms: int) -> List[Tuple[int, int]]:
+    """將K線開盤時間拆分為連續區間 [(start, end), ...]（相鄰K線間隔不超過 step_ms）"""
+    if len(timestamps_ms) == 0:
+        return []
+    ts = np.unique(np.asarray(timestamps_ms, dtype=np.int64))
+    breaks = np.flatnonzero(np.diff(ts) > step_ms)
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [len(ts) - 1]))
+    return [(int(ts[a]), int(ts[b])) for a, b in zip(starts, ends)]
 
 
 class ConfigManager:
@@ -101,9 +167,21 @@ class ErrorHandler:
 class ApiClient:
     """API客戶端基類"""
     
-    def __init__(self, api_config: Dict[str, Any], error_handler: ErrorHandler):
+    exchange_name = 'unknown'
+    # 單次請求可返回的最大K線數量
+    max_kline_limit = 1000
+    # True 表示交易所在 [start, end] 超出一頁時返回最新的一頁（需要從 end 向前翻頁）
+    pages_backward = False
+    # 原始K線到 KlineBatch 列的映射（None 使用默認格式）
+    kline_row_layout: Optional[Dict[str, int]] = None
+    kline_dict_keys: Optional[Dict[str, str]] = None
+    
+    def __init__(self, api_config: Dict[str, Any], error_handler: ErrorHandler,
+                 rate_limiter: Optional[RateLimiter] = None):
         self.api_config = api_config
         self.error_handler = error_handler
+        # 所有請求都經過按端點分桶、跨進程共享的限流器
+        self.rate_limiter = rate_limiter or RateLimiter(self.exchange_name, api_config.get('rate_limits'))
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'KlineSync/1.0.0',
@@ -113,13 +191,16 @@ class ApiClient:
     def make_request(self, endpoint: str, params: Dict[str, Any] = None, 
                     max_retries: int = 3) -> Optional[Dict[str, Any]]:
         """發送API請求"""
+        path = urlparse(endpoint).path
         for attempt in range(max_retries):
             try:
+                self.rate_limiter.acquire(path)
                 response = self.session.get(endpoint, params=params, timeout=30)
+                self.rate_limiter.observe_response(path, response.status_code, response.headers)
                 response.raise_for_status()
                 
                 try:
-                    json_data = response.json()
+                    json_data = json_loads(response.content)
                     return json_data
                 except ValueError as e:
                     self.error_handler.logger.error(f"JSON解析錯誤: {str(e)}")
@@ -132,13 +213,56 @@ class ApiClient:
                 else:
                     return None
         return None
+    
+    def get_kline_data(self, symbol: str, interval: str, limit: int = 500,
+                      start_time: Optional[int] = None, end_time: Optional[int] = None) -> Optional[List[Union[List, Dict]]]:
+        """獲取一頁原始K線數據，由各交易所客戶端實現"""
+        raise NotImplementedError
+    
+    def to_kline_batch(self, raw_data: List[Union[List, Dict]], symbol: str, interval: str) -> KlineBatch:
+        """將交易所原始K線轉換為統一的列式批次（未驗證）"""
+        return KlineBatch.from_raw(raw_data, symbol, interval, self.kline_row_layout, self.kline_dict_keys)
+    
+    def get_kline_batch(self, symbol: str, interval: str, start_time: int,
+                        end_time: Optional[int] = None) -> Optional[KlineBatch]:
+        """按交易所最大頁長分頁獲取 [start_time, end_time] 內的全部K線，任一頁失敗時返回 None"""
+        end_time = end_time or int(time.time() * 1000)
+        batches = []
+        lower, upper = start_time, end_time
+        
+        while lower <= upper:
+            raw_data = self.get_kline_data(symbol, interval, limit=self.max_kline_limit,
+                                           start_time=lower, end_time=upper)
+            if raw_data is None:
+                return None
+            
+            batch = self.to_kline_batch(raw_data, symbol, interval)
+            timestamps = batch.timestamp[batch.timestamp >= 0]
+            if len(timestamps) == 0:
+                break
+            batches.append(batch)
+            
+            # 不足一頁說明區間已取完
+            if len(raw_data) < self.max_kline_limit:
+                break
+            if self.pages_backward:
+                upper = int(timestamps.min()) - 1
+            else:
+                lower = int(timestamps.max()) + 1
+        
+        if not batches:
+            return KlineBatch.empty_batch(symbol, interval)
+        return KlineBatch.concat(batches)
 
 
 class BingXApiClient(ApiClient):
     """BingX API客戶端"""
     
-    def __init__(self, api_config: Dict[str, Any], error_handler: ErrorHandler):
-        super().__init__(api_config, error_handler) # 初始化父類
+    exchange_name = 'bingx'
+    
+    def __init__(self, api_config: Dict[str, Any], error_handler: ErrorHandler,
+                 rate_limiter: Optional[RateLimiter] = None):
+        super().__init__(api_config, error_handler, rate_limiter) # 初始化父類
         self.base_url = api_config.get('api_url', 'https://open-api.bingx.com')
         self.api_key = api_config.get('api_key', '')
         self.secret_key = api_config.get('secret_key', '')
@@ -200,15 +324,277 @@ class BingXApiClient(ApiClient):
         return None
 
 
+class BinanceApiClient(ApiClient):
+    """Binance API客戶端（現貨）"""
+    
+    exchange_name = 'binance'
+    max_kline_limit = 1000
+    # [開盤時間, 開, 高, 低, 收, 成交量, 收盤時間, 成交額, 成交筆數, 主動買入量, 主動買入額, 忽略]
+    kline_row_layout = {
+        'timestamp': 0, 'open': 1, 'high': 2, 'low': 3, 'close': 4, 'volume': 5,
+        'quote_volume': 7, 'trade_count': 8, 'taker_buy_volume': 9, 'taker_buy_quote_volume': 10
+    }
+    
+    def __init__(self, api_config: Dict[str, Any], error_handler: ErrorHandler,
+                 rate_limiter: Optional[RateLimiter] = None):
+        super().__init__(api_config, error_handler, rate_limiter)
+        self.base_url = api_config.get('api_url', 'https://api.binance.com')
+        self.api_key = api_config.get('api_key', '')
+    
+    @staticmethod
+    def _to_exchange_symbol(symbol: str) -> str:
+        """BTC-USDT -> BTCUSDT"""
+        return symbol.replace('-', '').upper()
+    
+    def get_kline_data(self, symbol: str, interval: str, limit: int = 500,
+                      start_time: Optional[int] = None, end_time: Optional[int] = None) -> Optional[List[Union[List, Dict]]]:
+        """獲取K線數據（startTime/endTime 均為閉區間，從 startTime 開始按時間升序返回）"""
+        endpoint = f"{self.base_url}/api/v3/klines"
+        
+        params = {
+            'symbol': self._to_exchange_symbol(symbol),
+            'interval': interval,
+            'limit': min(limit, self.max_kline_limit)
+        }
+        if start_time:
+            params['startTime'] = start_time
+        if end_time:
+            params['endTime'] = end_time
+        
+        response = self.make_request(endpoint, params)
+        if isinstance(response, list):
+            return response
+        error_msg = response.get('msg', '未知錯誤') if response else 'API請求失敗'
+        self.error_handler.handle_api_error(Exception(error_msg), f"獲取K線數據: {symbol}")
+        return None
+
+
+class OKXApiClient(ApiClient):
+    """OKX API客戶端"""
+    
+    exchange_name = 'okx'
+    # history-candles 單次最多 100 條，按時間倒序返回
+    max_kline_limit = 100
+    pages_backward = True
+    # [開盤時間, 開, 高, 低, 收, 成交量, 成交量(幣), 成交額(計價幣), 是否已收盤]
+    kline_row_layout = {
+        'timestamp': 0, 'open': 1, 'high': 2, 'low': 3, 'close': 4, 'volume': 5, 'quote_volume': 7
+    }
+    # OKX 的日線默認按 UTC+8 對齊，使用 UTC 對齊的 1Dutc 與其他交易所保持一致
+    INTERVAL_CODES = {
+        '1m': '1m', '5m': '5m', '15m': '15m', '30m': '30m',
+        '1h': '1H', '4h': '4H', '1d': '1Dutc'
+    }
+    
+    def __init__(self, api_config: Dict[str, Any], error_handler: ErrorHandler,
+                 rate_limiter: Optional[RateLimiter] = None):
+        super().__init__(api_config, error_handler, rate_limiter)
+        self.base_url = api_config.get('api_url', 'https://www.okx.com')
+    
+    def get_kline_data(self, symbol: str, interval: str, limit: int = 100,
+                      start_time: Optional[int] = None, end_time: Optional[int] = None) -> Optional[List[Union[List, Dict]]]:
+        """獲取K線數據（after/before 均為開區間，返回 end_time 之前最新的一頁）"""
+        endpoint = f"{self.base_url}/api/v5/market/history-candles"
+        
+        params = {
+            'instId': symbol.upper(),
+            'bar': self.INTERVAL_CODES.get(interval, interval),
+            'limit': min(limit, self.max_kline_limit)
+        }
+        if end_time:
+            params['after'] = end_time + 1
+        if start_time:
+            params['before'] = start_time - 1
+        
+        response = self.make_request(endpoint, params)
+        if response and str(response.get('code')) == '0':
+            return response.get('data', [])
+        error_msg = response.get('msg', '未知錯誤') if response else 'API請求失敗'
+        self.error_handler.handle_api_error(Exception(error_msg), f"獲取K線數據: {symbol}")
+        return None
+
+
+class ByBitApiClient(ApiClient):
+    """ByBit API客戶端（v5）"""
+    
+    exchange_name = 'bybit'
+    # 單次最多 1000 條，按時間倒序返回 [start, end] 內最新的一頁
+    max_kline_limit = 1000
+    pages_backward = True
+    # [開盤時間, 開, 高, 低, 收, 成交量, 成交額]
+    kline_row_layout = {
+        'timestamp': 0, 'open': 1, 'high': 2, 'low': 3, 'close': 4, 'volume': 5, 'quote_volume': 6
+    }
+    INTERVAL_CODES = {
+        '1m': '1', '5m': '5', '15m': '15', '30m': '30',
+        '1h': '60', '4h': '240', '1d': 'D'
+    }
+    
+    def __init__(self, api_config: Dict[str, Any], error_handler: ErrorHandler,
+                 rate_limiter: Optional[RateLimiter] = None):
+        super().__init__(api_config, error_handler, rate_limiter)
+        self.base_url = api_config.get('api_url', 'https://api.bybit.com')
+        self.category = api_config.get('category', 'spot')
+    
+    def get_kline_data(self, symbol: str, interval: str, limit: int = 500,
+                      start_time: Optional[int] = None, end_time: Optional[int] = None) -> Optional[List[Union[List, Dict]]]:
+        """獲取K線數據"""
+        endpoint = f"{self.base_url}/v5/market/kline"
+        
+        params = {
+            'category': self.category,
+            'symbol': symbol.replace('-', '').upper(),
+            'interval': self.INTERVAL_CODES.get(interval, interval),
+            'limit': min(limit, self.max_kline_limit)
+        }
+        if start_time:
+            params['start'] = start_time
+        if end_time:
+            params['end'] = end_time
+        
+        response = self.make_request(endpoint, params)
+        if response and response.get('retCode') == 0:
+            return response.get('result', {}).get('list', [])
+        error_msg = response.get('retMsg', '未知錯誤') if response else 'API請求失敗'
+        self.error_handler.handle_api_error(Exception(error_msg), f"獲取K線數據: {symbol}")
+        return None
+
+
+# 交易所名稱（小寫）到API客戶端類的映射
+API_CLIENTS = {
+    'bingx': BingXApiClient,
+    'binance': BinanceApiClient,
+    'okx': OKXApiClient,
+    'bybit': ByBitApiClient
+}
+
+
+def create_api_client(exchange_config: Dict[str, Any], error_handler: ErrorHandler) -> ApiClient:
+    """根據單個 exchange_configs 項創建API客戶端"""
+    exchange_name = exchange_config.get('exchange_name', '').lower()
+    client_class = API_CLIENTS.get(exchange_name)
+    if client_class is None:
+        raise ValueError(f"不支持的交易所: {exchange_name}")
+    rate_limiter = RateLimiter.from_exchange_config(exchange_config)
+    return client_class(exchange_config.get('api_info', {}), error_handler, rate_limiter)
+
+
 class TimescaleDBManager:
     """TimescaleDB數據庫管理器"""
     
+    # K線數據表結構（同步與異步管理器共用）
+    KLINE_TABLE_SQL = """
+        CREATE TABLE IF NOT EXISTS kline_data (
+            time TIMESTAMPTZ NOT NULL,
+            symbol VARCHAR(50) NOT NULL,
+            interval VARCHAR(10) NOT NULL,
+            open_price DECIMAL(20, 8) NOT NULL,
+            high_price DECIMAL(20, 8) NOT NULL,
+            low_price DECIMAL(20, 8) NOT NULL,
+            close_price DECIMAL(20, 8) NOT NULL,
+            volume DECIMAL(20, 8) NOT NULL,
+            quote_volume DECIMAL(20, 8),
+            trade_count INTEGER,
+            taker_buy_volume DECIMAL(20, 8),
+            taker_buy_quote_volume DECIMAL(20, 8),
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            UNIQUE(time, symbol, interval)
+        );
+        
+        -- 創建超表（如果TimescaleDB可用）
+        SELECT create_hypertable('kline_data', 'time', if_not_exists => TRUE);
+        
+        -- 所有查詢都按 (symbol, interval) 過濾；唯一約束以 time 開頭，按序列讀取需要單獨的索引
+        CREATE INDEX IF NOT EXISTS idx_kline_symbol_interval_time ON kline_data (symbol, interval, time DESC);
+        """
+    
+    # 緊湊表結構: (symbol, interval) 存入維度表，K線按 (series_id, time) 唯一索引，價格使用 float8。
+    # kline_data 視圖保持原有列名，讀取方無需修改；已有 kline_data 表時見 migrations/04_compact_kline_schema.sql
+    COMPACT_TABLE_SQL = """
+        CREATE TABLE IF NOT EXISTS kline_series (
+            series_id SERIAL PRIMARY KEY,
+            symbol VARCHAR(50) NOT NULL,
+            interval VARCHAR(10) NOT NULL,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            UNIQUE(symbol, interval)
+        );
+        
+        -- 列順序按對齊排列，避免填充字節
+        CREATE TABLE IF NOT EXISTS kline_bars (
+            time TIMESTAMPTZ NOT NULL,
+            series_id INTEGER NOT NULL REFERENCES kline_series(series_id),
+            trade_count INTEGER,
+            open_price FLOAT8 NOT NULL,
+            high_price FLOAT8 NOT NULL,
+            low_price FLOAT8 NOT NULL,
+            close_price FLOAT8 NOT NULL,
+            volume FLOAT8 NOT NULL,
+            quote_volume FLOAT8,
+            taker_buy_volume FLOAT8,
+            taker_buy_quote_volume FLOAT8,
+            PRIMARY KEY (series_id, time)
+        );
+        
+        SELECT create_hypertable('kline_bars', 'time', if_not_exists => TRUE);
+        
+        CREATE OR REPLACE VIEW kline_data AS
+        SELECT b.time, s.symbol, s.interval, b.open_price, b.high_price, b.low_price,
+               b.close_price, b.volume, b.quote_volume, b.trade_count,
+               b.taker_buy_volume, b.taker_buy_quote_volume
+        FROM kline_bars b
+        JOIN kline_series s ON s.series_id = b.series_id;
+        """
+    
+    COVERAGE_TABLE_SQL = """
+        -- 覆蓋索引: 每個 (symbol, interval) 已存在數據的K線開盤時間區間（閉區間，互不重疊且不相鄰）
+        CREATE TABLE IF NOT EXISTS kline_coverage (
+            symbol VARCHAR(50) NOT NULL,
+            interval VARCHAR(10) NOT NULL,
+            start_time TIMESTAMPTZ NOT NULL,
+            end_time TIMESTAMPTZ NOT NULL,
+            updated_at TIMESTAMPTZ DEFAULT NOW(),
+            PRIMARY KEY (symbol, interval, start_time)
+        );
+        """
+    
+    CREATE_TABLE_SQL = KLINE_TABLE_SQL + COVERAGE_TABLE_SQL
+    
+    # kline_data 在數據庫中的類型: 'r' 表（超表）/ 'v' 緊湊結構的兼容視圖 / NULL 尚未創建
+    KLINE_RELKIND_SQL = "SELECT relkind FROM pg_class WHERE oid = to_regclass('kline_data')"
+    
+    @classmethod
+    def schema_sql(cls, compact: bool) -> str:
+        """建表語句（compact 為 True 時使用緊湊結構）"""
+        return (cls.COMPACT_TABLE_SQL if compact else cls.KLINE_TABLE_SQL) + cls.COVERAGE_TABLE_SQL
+    
+    @staticmethod
+    def use_compact_schema(db_config: Dict[str, Any], relkind: Optional[str], logger: logging.Logger) -> bool:
+        """根據配置與現有 kline_data 的類型決定是否使用緊湊結構"""
+        if db_config.get('kline_schema', 'legacy') != 'compact':
+            if relkind == 'v':
+                logger.warning("數據庫已遷移到緊湊結構，忽略 kline_schema 配置")
+                return True
+            return False
+        if relkind == 'r':
+            logger.error("kline_data 仍是原表結構，請先執行 migrations/04_compact_kline_schema.sql；暫時使用原表結構")
+            return False
+        return True
+    
     def __init__(self, db_config: Dict[str, Any], error_handler: ErrorHandler):
         self.db_config = db_config
         self.error_handler = error_handler
         self.connection = None
+        # 單批行數達到該值時改用 COPY 批量寫入
+        self.bulk_insert_threshold = int(db_config.get('bulk_insert_threshold', 1000))
+        # TimescaleDB < 2.11 不支持對壓縮分塊執行 ON CONFLICT，寫入前需要先解壓
+        self.decompress_before_upsert = False
+        self.compress_after_ms: Optional[int] = None
+        # 緊湊結構: K線寫入 kline_bars，(symbol, interval) 映射為 kline_series.series_id
+        self.compact = False
+        self._series_ids: Dict[Tuple[str, str], int] = {}
         self._connect()
         self._create_tables()
+        self._detect_compression()
     
     def _connect(self) -> None:
         """連接數據庫"""
@@ -226,47 +612,58 @@ class TimescaleDBManager:
             self.error_handler.handle_db_error(e, "數據庫連接")
             raise
     
+    @property
+    def kline_table(self) -> str:
+        """K線超表名"""
+        return 'kline_bars' if self.compact else 'kline_data'
+    
     def _create_tables(self) -> None:
         """創建數據表"""
-        create_table_sql = """
-        CREATE TABLE IF NOT EXISTS kline_data (
-            time TIMESTAMPTZ NOT NULL,
-            symbol VARCHAR(50) NOT NULL,
-            interval VARCHAR(10) NOT NULL,
-            open_price DECIMAL(20, 8) NOT NULL,
-            high_price DECIMAL(20, 8) NOT NULL,
-            low_price DECIMAL(20, 8) NOT NULL,
-            close_price DECIMAL(20, 8) NOT NULL,
-            volume DECIMAL(20, 8) NOT NULL,
-            quote_volume DECIMAL(20, 8),
-            trade_count INTEGER,
-            taker_buy_volume DECIMAL(20, 8),
-            taker_buy_quote_volume DECIMAL(20, 8),
-            created_at TIMESTAMPTZ DEFAULT NOW(),
-            UNIQUE(time, symbol, interval)
-        );
-        
-        -- 創建超表（如果TimescaleDB可用）
-        SELECT create_hypertable('kline_data', 'time', if_not_exists => TRUE);
-        
-        -- 創建索引
-        CREATE INDEX IF NOT EXISTS idx_kline_symbol_time ON kline_data (symbol, time DESC);
-        CREATE INDEX IF NOT EXISTS idx_kline_interval ON kline_data (interval, time DESC);
-        CREATE INDEX IF NOT EXISTS idx_kline_symbol_interval_time ON kline_data (symbol, interval, time DESC);
-        """
-        
         try:
             with self.connection.cursor() as cursor:
-                cursor.execute(create_table_sql)
-            self.error_handler.logger.info("數據表創建/檢查完成")
+                cursor.execute(self.KLINE_RELKIND_SQL)
+                row = cursor.fetchone()
+                self.compact = self.use_compact_schema(self.db_config, row[0] if row else None,
+                                                       self.error_handler.logger)
+                cursor.execute(self.schema_sql(self.compact))
+            schema = '緊湊' if self.compact else '原'
+            self.error_handler.logger.info(f"數據表創建/檢查完成（{schema}表結構）")
         except psycopg2.Error as e:
             self.error_handler.handle_db_error(e, "創建數據表")
     
-    def insert_kline_data(self, df: pd.DataFrame) -> bool:
-        """插入K線數據"""
+    SERIES_ID_SQL = """
+        WITH inserted AS (
+            INSERT INTO kline_series (symbol, interval) VALUES (%(symbol)s, %(interval)s)
+            ON CONFLICT (symbol, interval) DO NOTHING
+            RETURNING series_id
+        )
+        SELECT series_id FROM inserted
+        UNION ALL
+        SELECT series_id FROM kline_series WHERE symbol = %(symbol)s AND interval = %(interval)s
+        LIMIT 1
+        """
+    
+    def get_series_id(self, cursor, symbol: str, interval: str) -> int:
+        """緊湊結構下 (symbol, interval) 對應的 series_id，不存在時創建"""
+        key = (symbol, interval)
+        series_id = self._series_ids.get(key)
+        if series_id is None:
+            cursor.execute(self.SERIES_ID_SQL, {'symbol': symbol, 'interval': interval})
+            series_id = self._series_ids[key] = cursor.fetchone()[0]
+        return series_id
+    
+    def insert_kline_data(self, df: pd.DataFrame, method: str = 'auto') -> bool:
+        """插入K線數據
+        
+        method: 'values' 使用 execute_values；'copy' 使用二進制 COPY 批量寫入；
+                'auto' 在行數達到 bulk_insert_threshold 時自動選擇 COPY
+        """
         if df.empty:
             return True
         
+        if method == 'copy' or (method == 'auto' and len(df) >= self.bulk_insert_threshold):
+            return self.bulk_insert_kline_data(df)
+        
         insert_sql = """
         INSERT INTO kline_data (
             time, symbol, interval, open_price, high_price, low_price, 
@@ -286,16 +683,43 @@ class TimescaleDBManager:
             taker_buy_quote_volume = EXCLUDED.taker_buy_quote_volume
         """
         
+        if self.compact:
+            insert_sql = """
+            INSERT INTO kline_bars (
+                time, series_id, open_price, high_price, low_price,
+                close_price, volume, quote_volume, trade_count,
+                taker_buy_volume, taker_buy_quote_volume
+            ) VALUES %s
+            ON CONFLICT (series_id, time)
+            DO UPDATE SET
+                open_price = EXCLUDED.open_price,
+                high_price = EXCLUDED.high_price,
+                low_price = EXCLUDED.low_price,
+                close_price = EXCLUDED.close_price,
+                volume = EXCLUDED.volume,
+                quote_volume = EXCLUDED.quote_volume,
+                trade_count = EXCLUDED.trade_count,
+                taker_buy_volume = EXCLUDED.taker_buy_volume,
+                taker_buy_quote_volume = EXCLUDED.taker_buy_quote_volume
+            """
+        
         try:
             from psycopg2.extras import execute_values
             
+            series_ids = {}
+            if self.compact:
+                with self.connection.cursor() as cursor:
+                    for key in df[['symbol', 'interval']].drop_duplicates().itertuples(index=False, name=None):
+                        series_ids[key] = self.get_series_id(cursor, *key)
+            
             # 準備數據
             values = []
             for _, row in df.iterrows():
+                key = (row['symbol'], row['interval'])
+                series = (series_ids[key],) if self.compact else key
                 values.append((
                     row['datetime'],
-                    row['symbol'],
-                    row['interval'],
+                    *series,
                     float(row['open']),
                     float(row['high']),
                     float(row['low']),
@@ -308,8 +732,10 @@ class TimescaleDBManager:
                 ))
             
             with self.connection.cursor() as cursor:
+                self._prepare_upsert(cursor, *self._frame_time_range(df))
                 execute_values(cursor, insert_sql, values, template=None, page_size=1000)
             
+            self._record_frame_coverage(df)
             self.error_handler.logger.info(f"成功插入 {len(df)} 條K線數據")
             return True
             
@@ -317,6 +743,593 @@ class TimescaleDBManager:
             self.error_handler.handle_db_error(e, "插入K線數據")
             return False
     
+    # 二進制 COPY 的列布局（全部為定長列，可一次性構造整個緩衝區）
+    # 順序與 kline_data_staging 的列一致: time, 6 個浮點列, trade_count, 2 個浮點列
+    COPY_FLOAT_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'quote_volume']
+    COPY_TAKER_COLUMNS = ['taker_buy_volume', 'taker_buy_quote_volume']
+    
+    STAGING_TABLE_SQL = """
+        CREATE TEMP TABLE IF NOT EXISTS kline_data_staging (
+            time TIMESTAMPTZ NOT NULL,
+            open_price FLOAT8,
+            high_price FLOAT8,
+            low_price FLOAT8,
+            close_price FLOAT8,
+            volume FLOAT8,
+            quote_volume FLOAT8,
+            trade_count INTEGER,
+            taker_buy_volume FLOAT8,
+            taker_buy_quote_volume FLOAT8
+        )
+        """
+    
+    MERGE_STAGING_SQL = """
+        INSERT INTO kline_data (
+            time, symbol, interval, open_price, high_price, low_price,
+            close_price, volume, quote_volume, trade_count,
+            taker_buy_volume, taker_buy_quote_volume
+        )
+        SELECT DISTINCT ON (time)
+            time, %s, %s, open_price, high_price, low_price,
+            close_price, volume, quote_volume, trade_count,
+            taker_buy_volume, taker_buy_quote_volume
+        FROM kline_data_staging
+        ORDER BY time
+        ON CONFLICT (time, symbol, interval)
+        DO UPDATE SET
+            open_price = EXCLUDED.open_price,
+            high_price = EXCLUDED.high_price,
+            low_price = EXCLUDED.low_price,
+            close_price = EXCLUDED.close_price,
+            volume = EXCLUDED.volume,
+            quote_volume = EXCLUDED.quote_volume,
+            trade_count = EXCLUDED.trade_count,
+            taker_buy_volume = EXCLUDED.taker_buy_volume,
+            taker_buy_quote_volume = EXCLUDED.taker_buy_quote_volume
+        """
+    
+    MERGE_COMPACT_SQL = """
+        INSERT INTO kline_bars (
+            time, series_id, open_price, high_price, low_price,
+            close_price, volume, quote_volume, trade_count,
+            taker_buy_volume, taker_buy_quote_volume
+        )
+        SELECT DISTINCT ON (time)
+            time, %s, open_price, high_price, low_price,
+            close_price, volume, quote_volume, trade_count,
+            taker_buy_volume, taker_buy_quote_volume
+        FROM kline_data_staging
+        ORDER BY time
+        ON CONFLICT (series_id, time)
+        DO UPDATE SET
+            open_price = EXCLUDED.open_price,
+            high_price = EXCLUDED.high_price,
+            low_price = EXCLUDED.low_price,
+            close_price = EXCLUDED.close_price,
+            volume = EXCLUDED.volume,
+            quote_volume = EXCLUDED.quote_volume,
+            trade_count = EXCLUDED.trade_count,
+            taker_buy_volume = EXCLUDED.taker_buy_volume,
+            taker_buy_quote_volume = EXCLUDED.taker_buy_quote_volume
+        """
+    
+    @classmethod
+    def _encode_copy_rows(cls, times_us: np.ndarray, columns: Dict[str, np.ndarray],
+                          trade_count: np.ndarray) -> bytes:
+        """將列數組向量化編碼為 PostgreSQL 二進制 COPY 數據（缺失值寫 0）"""
+        n = len(times_us)
+        fields = [('field_count', '>i2'), ('time_len', '>i4'), ('time', '>i8')]
+        for name in cls.COPY_FLOAT_COLUMNS:
+            fields += [(f'{name}_len', '>i4'), (name, '>f8')]
+        fields += [('trade_count_len', '>i4'), ('trade_count', '>i4')]
+        for name in cls.COPY_TAKER_COLUMNS:
+            fields += [(f'{name}_len', '>i4'), (name, '>f8')]
+        
+        rows = np.empty(n, dtype=np.dtype(fields))
+        rows['field_count'] = 10
+        rows['time_len'] = 8
+        rows['time'] = times_us - PG_EPOCH_OFFSET_US
+        
+        for name in cls.COPY_FLOAT_COLUMNS + cls.COPY_TAKER_COLUMNS:
+            rows[f'{name}_len'] = 8
+            values = columns.get(name)
+            rows[name] = np.nan_to_num(values, nan=0.0) if values is not None else 0.0
+        
+        rows['trade_count_len'] = 4
+        rows['trade_count'] = trade_count
+        
+        return PGCOPY_HEADER + rows.tobytes() + PGCOPY_TRAILER
+    
+    @classmethod
+    def _to_copy_binary(cls, df: pd.DataFrame) -> bytes:
+        """將K線 DataFrame 編碼為 PostgreSQL 二進制 COPY 數據"""
+        times_us = pd.to_datetime(df['datetime']).values.astype('datetime64[us]').astype(np.int64)
+        columns = {
+            name: pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+            for name in cls.COPY_FLOAT_COLUMNS + cls.COPY_TAKER_COLUMNS if name in df.columns
+        }
+        if 'trade_count' in df.columns:
+            trade_count = pd.to_numeric(df['trade_count'], errors='coerce').fillna(0).to_numpy(dtype=np.int32)
+        else:
+            trade_count = np.zeros(len(df), dtype=np.int32)
+        return cls._encode_copy_rows(times_us, columns, trade_count)
+    
+    @classmethod
+    def _batch_to_copy_binary(cls, batch: KlineBatch) -> bytes:
+        """將列式K線批次直接編碼為 COPY 數據，不經過 DataFrame"""
+        columns = {name: getattr(batch, name) for name in cls.COPY_FLOAT_COLUMNS + cls.COPY_TAKER_COLUMNS}
+        return cls._encode_copy_rows(batch.timestamp * 1000, columns, batch.trade_count)
+    
+    COPY_STAGING_SQL = (
+        "COPY kline_data_staging (time, open_price, high_price, low_price, close_price, "
+        "volume, quote_volume, trade_count, taker_buy_volume, taker_buy_quote_volume) "
+        "FROM STDIN WITH (FORMAT binary)"
+    )
+    
+    def _copy_and_merge(self, cursor, payload: bytes, symbol: str, interval: str) -> None:
+        """把一組 COPY 數據寫入暫存表並合併到 kline_data（緊湊結構下合併到 kline_bars）"""
+        cursor.execute("TRUNCATE kline_data_staging")
+        cursor.copy_expert(self.COPY_STAGING_SQL, io.BytesIO(payload))
+        if self.compact:
+            cursor.execute(self.MERGE_COMPACT_SQL, (self.get_series_id(cursor, symbol, interval),))
+        else:
+            cursor.execute(self.MERGE_STAGING_SQL, (symbol, interval))
+    
+    def bulk_insert_kline_data(self, df: pd.DataFrame) -> bool:
+        """通過二進制 COPY 寫入臨時暫存表，再用一條集合式 upsert 合併到 kline_data
+        
+        臨時表不寫 WAL（與 UNLOGGED 表相同），且按連接隔離，多個寫入進程互不干擾。
+        """
+        if df.empty:
+            return True
+        
+        started = time.perf_counter()
+        try:
+            with self.connection.cursor() as cursor:
+                self._prepare_upsert(cursor, *self._frame_time_range(df))
+                cursor.execute(self.STAGING_TABLE_SQL)
+                for (symbol, interval), group in df.groupby(['symbol', 'interval'], sort=False):
+                    self._copy_and_merge(cursor, self._to_copy_binary(group), symbol, interval)
+            self._record_frame_coverage(df)
+            
+            elapsed = time.perf_counter() - started
+            rate = len(df) / elapsed if elapsed > 0 else float('inf')
+            self.error_handler.logger.info(f"成功插入 {len(df)} 條K線數據 (COPY, {rate:.0f} 條/秒)")
+            return True
+            
+        except psycopg2.Error as e:
+            self.error_handler.handle_db_error(e, "批量插入K線數據")
+            return False
+    
+    def insert_kline_batch(self, batch: KlineBatch) -> bool:
+        """直接寫入列式K線批次（二進制 COPY）"""
+        if batch.empty:
+            return True
+        
+        try:
+            with self.connection.cursor() as cursor:
+                self._prepare_upsert(cursor, int(batch.timestamp.min()), int(batch.timestamp.max()))
+                cursor.execute(self.STAGING_TABLE_SQL)
+                self._copy_and_merge(cursor, self._batch_to_copy_binary(batch), batch.symbol, batch.interval)
+            self.record_coverage(batch.symbol, batch.interval, batch.timestamp)
+            
+            self.error_handler.logger.info(f"成功插入 {len(batch)} 條K線數據")
+            return True
+            
+        except psycopg2.Error as e:
+            self.error_handler.handle_db_error(e, "批量插入K線數據")
+            return False
+    
+    # 將 [start, end] 與所有重疊或相鄰的區間合併為一條記錄（同一 series 由咨詢鎖串行化）
+    COVERAGE_MERGE_SQL = """
+        SELECT pg_advisory_xact_lock(hashtext(%(symbol)s || '|' || %(interval)s));
+        WITH removed AS (
+            DELETE FROM kline_coverage
+            WHERE symbol = %(symbol)s AND interval = %(interval)s
+              AND start_time <= to_timestamp(%(end_ms)s / 1000.0) + %(step_ms)s * INTERVAL '1 millisecond'
+              AND end_time >= to_timestamp(%(start_ms)s / 1000.0) - %(step_ms)s * INTERVAL '1 millisecond'
+            RETURNING start_time, end_time
+        )
+        INSERT INTO kline_coverage (symbol, interval, start_time, end_time)
+        SELECT %(symbol)s, %(interval)s,
+               LEAST(to_timestamp(%(start_ms)s / 1000.0), MIN(start_time)),
+               GREATEST(to_timestamp(%(end_ms)s / 1000.0), MAX(end_time))
+        FROM removed;
+        """
+    
+    # 從 kline_data 重建覆蓋索引（gaps-and-islands）
+    COVERAGE_REBUILD_SQL = """
+        SELECT pg_advisory_xact_lock(hashtext(%(symbol)s || '|' || %(interval)s));
+        DELETE FROM kline_coverage WHERE symbol = %(symbol)s AND interval = %(interval)s;
+        INSERT INTO kline_coverage (symbol, interval, start_time, end_time)
+        SELECT %(symbol)s, %(interval)s, MIN(time), MAX(time)
+        FROM (
+            SELECT time, SUM(is_start) OVER (ORDER BY time) AS island
+            FROM (
+                SELECT time,
+                       CASE WHEN time - LAG(time) OVER (ORDER BY time)
+                                 <= %(step_ms)s * INTERVAL '1 millisecond'
+                            THEN 0 ELSE 1 END AS is_start
+                FROM kline_data
+                WHERE symbol = %(symbol)s AND interval = %(interval)s
+            ) marked
+        ) islands
+        GROUP BY island;
+        """
+    
+    def mark_coverage(self, symbol: str, interval: str, start_ms: int, end_ms: int) -> bool:
+        """將 [start_ms, end_ms] 記錄為已覆蓋（已存在數據或交易所確認該區間無數據）"""
+        step_ms = INTERVAL_MS.get(interval)
+        if step_ms is None or end_ms < start_ms:
+            return False
+        
+        params = {'symbol': symbol, 'interval': interval,
+                  'start_ms': int(start_ms), 'end_ms': int(end_ms), 'step_ms': step_ms}
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(self.COVERAGE_MERGE_SQL, params)
+            return True
+        except psycopg2.Error as e:
+            self.error_handler.handle_db_error(e, "更新覆蓋索引")
+            return False
+    
+    def record_coverage(self, symbol: str, interval: str, timestamps_ms: np.ndarray) -> bool:
+        """按寫入的K線時間戳更新覆蓋索引，並通知讀取端寫入的時間範圍"""
+        step_ms = INTERVAL_MS.get(interval)
+        if step_ms is None:
+            return False
+        runs = contiguous_runs(timestamps_ms, step_ms)
+        recorded = all(self.mark_coverage(symbol, interval, start, end) for start, end in runs)
+        if runs:
+            self.notify_kline_changed(symbol, interval, runs[0][0], runs[-1][1])
+        return recorded
+    
+    def notify_kline_changed(self, symbol: str, interval: str, start_ms: int, end_ms: int) -> None:
+        """發送K線寫入通知（NOTIFY），通知失敗不影響寫入結果"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)",
+                               (KLINE_CHANGED_CHANNEL, kline_change_payload(symbol, interval, start_ms, end_ms)))
+        except psycopg2.Error as e:
+            self.error_handler.handle_db_error(e, "發送K線寫入通知")
+    
+    def _record_frame_coverage(self, df: pd.DataFrame) -> None:
+        """按 DataFrame 中的 (symbol, interval) 分組更新覆蓋索引"""
+        for (symbol, interval), group in df.groupby(['symbol', 'interval'], sort=False):
+            timestamps_ms = pd.to_datetime(group['datetime']).values.astype('datetime64[ms]').astype(np.int64)
+            self.record_coverage(symbol, interval, timestamps_ms)
+    
+    COMPRESSION_STATE_SQL = """
+        SELECT
+            (SELECT extversion FROM pg_extension WHERE extname = 'timescaledb'),
+            (SELECT compression_enabled FROM timescaledb_information.hypertables
+             WHERE hypertable_name = '{table}'),
+            (SELECT EXTRACT(EPOCH FROM (config->>'compress_after')::interval)
+             FROM timescaledb_information.jobs
+             WHERE proc_name = 'policy_compression' AND hypertable_name = '{table}'
+             LIMIT 1)
+        """
+    
+    # 解壓與 [start, end] 重疊的已壓縮分塊（壓縮策略稍後會重新壓縮）
+    DECOMPRESS_RANGE_SQL = """
+        SELECT decompress_chunk(format('%%I.%%I', chunk_schema, chunk_name)::regclass, if_compressed => TRUE)
+        FROM timescaledb_information.chunks
+        WHERE hypertable_name = '{table}' AND is_compressed
+          AND range_start <= to_timestamp(%(end_ms)s / 1000.0)
+          AND range_end > to_timestamp(%(start_ms)s / 1000.0)
+        """
+    
+    @staticmethod
+    def _parse_version(version: Optional[str]) -> Tuple[int, ...]:
+        parts = []
+        for part in (version or '0').split('.'):
+            digits = ''.join(ch for ch in part if ch.isdigit())
+            parts.append(int(digits) if digits else 0)
+        return tuple(parts)
+    
+    def _detect_compression(self) -> None:
+        """檢測 kline_data 是否啟用壓縮，以及寫入壓縮分塊前是否需要解壓"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(self.COMPRESSION_STATE_SQL.format(table=self.kline_table))
+                version, enabled, compress_after = cursor.fetchone()
+        except psycopg2.Error as e:
+            # 未安裝 TimescaleDB 時沒有 timescaledb_information
+            self.error_handler.logger.warning(f"無法檢測 kline_data 壓縮狀態: {e}")
+            return
+        
+        self.compress_after_ms = int(float(compress_after) * 1000) if compress_after is not None else None
+        self.decompress_before_upsert = bool(enabled) and self._parse_version(version) < (2, 11)
+        if self.decompress_before_upsert:
+            self.error_handler.logger.info(f"TimescaleDB {version} 不支持寫入壓縮分塊，回補前將先解壓")
+    
+    def _prepare_upsert(self, cursor, start_ms: int, end_ms: int) -> None:
+        """回補範圍可能落在已壓縮分塊時先解壓（僅 TimescaleDB < 2.11）"""
+        if not self.decompress_before_upsert:
+            return
+        # 壓縮策略只處理早於 compress_after 的分塊，較新的數據無需檢查
+        if self.compress_after_ms is not None and start_ms > time.time() * 1000 - self.compress_after_ms:
+            return
+        cursor.execute(self.DECOMPRESS_RANGE_SQL.format(table=self.kline_table), {'start_ms': int(start_ms), 'end_ms': int(end_ms)})
+        decompressed = len(cursor.fetchall())
+        if decompressed:
+            self.error_handler.logger.info(f"已解壓 {decompressed} 個分塊以寫入回補數據")
+    
+    def _frame_time_range(self, df: pd.DataFrame) -> Tuple[int, int]:
+        timestamps_ms = pd.to_datetime(df['datetime']).values.astype('datetime64[ms]').astype(np.int64)
+        return int(timestamps_ms.min()), int(timestamps_ms.max())
+    
+    def estimate_rows_per_day(self, fallback: float = 0.0) -> float:
+        """按最近一天實際寫入的行數估算數據速率，沒有數據時使用 fallback"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM {self.kline_table} WHERE time >= NOW() - INTERVAL '1 day'")
+                rows = cursor.fetchone()[0]
+        except psycopg2.Error as e:
+            self.error_handler.handle_db_error(e, "估算寫入速率")
+            return fallback
+        return float(rows) if rows else fallback
+    
+    # 當前的分塊間隔（秒）與是否已啟用壓縮
+    STORAGE_STATE_SQL = """
+        SELECT
+            (SELECT EXTRACT(EPOCH FROM time_interval) FROM timescaledb_information.dimensions
+             WHERE hypertable_name = '{table}' AND dimension_type = 'Time' LIMIT 1),
+            (SELECT compression_enabled FROM timescaledb_information.hypertables
+             WHERE hypertable_name = '{table}')
+        """
+    
+    # 當前的壓縮分段列與排序列（TimescaleDB 2.x 的 compression_settings 視圖）
+    COMPRESSION_SETTINGS_SQL = """
+        SELECT
+            array_agg(attname::text ORDER BY segmentby_column_index)
+                FILTER (WHERE segmentby_column_index IS NOT NULL),
+            array_agg(attname::text || CASE WHEN orderby_asc THEN ' ASC' ELSE ' DESC' END
+                      ORDER BY orderby_column_index)
+                FILTER (WHERE orderby_column_index IS NOT NULL)
+        FROM timescaledb_information.compression_settings
+        WHERE hypertable_name = '{table}'
+        """
+    
+    # 本進程中已完成存儲配置的 (數據庫, 超表)，同一進程的多個管道只配置一次
+    _configured_storage = set()
+    _configure_storage_lock = threading.Lock()
+    
+    def configure_storage(self, storage_settings: Dict[str, Any], expected_rows_per_day: float = 0.0) -> bool:
+        """託管存儲模式: 按數據速率設置分塊間隔，按序列（(symbol, interval) 或 series_id）分段壓縮並添加壓縮策略
+        
+        分塊間隔 = target_chunk_rows / 每天行數，限制在 [min_chunk_days, max_chunk_days]；只影響之後新建的分塊，
+        與當前間隔相差不到一倍時不修改。ALTER TABLE 會對超表加排他鎖（且部分版本在已有壓縮分塊後拒絕修改），
+        壓縮設置已一致時跳過；每個進程只檢查一次。
+        """
+        key = (self.db_config.get('host'), self.db_config.get('port'), self.db_config.get('database'), self.kline_table)
+        with self._configure_storage_lock:
+            if key in self._configured_storage:
+                return True
+            configured = self._configure_storage(storage_settings, expected_rows_per_day)
+            if configured:
+                self._configured_storage.add(key)
+        return configured
+    
+    def _configure_storage(self, storage_settings: Dict[str, Any], expected_rows_per_day: float) -> bool:
+        rows_per_day = self.estimate_rows_per_day(expected_rows_per_day)
+        target_rows = float(storage_settings.get('target_chunk_rows', 10_000_000))
+        min_days = float(storage_settings.get('min_chunk_days', 1))
+        max_days = float(storage_settings.get('max_chunk_days', 90))
+        chunk_days = max_days if rows_per_day <= 0 else min(max(target_rows / rows_per_day, min_days), max_days)
+        compress_after = storage_settings.get('compress_after', '7 days')
+        segmentby = ['series_id'] if self.compact else ['symbol', 'interval']
+        
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(self.STORAGE_STATE_SQL.format(table=self.kline_table))
+                chunk_seconds, compression_enabled = cursor.fetchone()
+                
+                current_days = float(chunk_seconds) / 86400 if chunk_seconds else None
+                if current_days is None or not 0.5 <= chunk_days / current_days <= 2:
+                    cursor.execute("SELECT set_chunk_time_interval(%s, %s * INTERVAL '1 day')",
+                                   (self.kline_table, chunk_days))
+                else:
+                    chunk_days = current_days
+                
+                if self._compression_settings_differ(segmentby, ['time DESC'], compression_enabled):
+                    cursor.execute(f"""
+                        ALTER TABLE {self.kline_table} SET (
+                            timescaledb.compress,
+                            timescaledb.compress_segmentby = '{', '.join(segmentby)}',
+                            timescaledb.compress_orderby = 'time DESC'
+                        )
+                    """)
+                cursor.execute(
+                    "SELECT add_compression_policy(%s, %s::interval, if_not_exists => TRUE)",
+                    (self.kline_table, compress_after))
+            self.error_handler.logger.info(
+                f"kline_data 存儲配置完成: 約 {rows_per_day:.0f} 行/天, 分塊間隔 {chunk_days:.2f} 天, "
+                f"{compress_after} 後壓縮"
+            )
+        except psycopg2.Error as e:
+            self.error_handler.handle_db_error(e, "配置 kline_data 存儲")
+            return False
+        
+        self._detect_compression()
+        return True
+    
+    def _compression_settings_differ(self, segmentby: List[str], orderby: List[str], enabled: bool) -> bool:
+        """當前壓縮設置是否與期望不同；無法讀取設置時（視圖在新版本中已更改）只在未啟用壓縮時視為不同"""
+        if not enabled:
+            return True
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(self.COMPRESSION_SETTINGS_SQL.format(table=self.kline_table))
+                current_segmentby, current_orderby = cursor.fetchone()
+        except psycopg2.Error as e:
+            self.error_handler.logger.warning(f"無法讀取 {self.kline_table} 壓縮設置，保留現有設置: {e}")
+            return False
+        return list(current_segmentby or []) != segmentby or list(current_orderby or []) != orderby
+    
+    # 直接聚合 kline_data 中的基礎週期。緊湊結構下連續聚合只能建在超表上: 按 series_id 分組，
+    # 且不能用子查詢篩選基礎週期，其他週期的序列也會被聚合，讀取方按基礎週期的 series_id 選擇
+    BASE_AGGREGATE_SQL = """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT
+            time_bucket(INTERVAL '{bucket}', time) AS bucket,
+            {series},
+            FIRST(open_price, time) AS open_price,
+            MAX(high_price) AS high_price,
+            MIN(low_price) AS low_price,
+            LAST(close_price, time) AS close_price,
+            SUM(volume) AS volume,
+            SUM(quote_volume) AS quote_volume,
+            SUM(trade_count) AS trade_count,
+            SUM(taker_buy_volume) AS taker_buy_volume,
+            SUM(taker_buy_quote_volume) AS taker_buy_quote_volume
+        FROM {table}
+        {where}
+        GROUP BY bucket, {series}
+        WITH NO DATA;
+        """
+    
+    # 在其他連續聚合之上再聚合（分層連續聚合，TimescaleDB 2.9+）
+    HIERARCHICAL_AGGREGATE_SQL = """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT
+            time_bucket(INTERVAL '{bucket}', bucket) AS bucket,
+            {series},
+            FIRST(open_price, bucket) AS open_price,
+            MAX(high_price) AS high_price,
+            MIN(low_price) AS low_price,
+            LAST(close_price, bucket) AS close_price,
+            SUM(volume) AS volume,
+            SUM(quote_volume) AS quote_volume,
+            SUM(trade_count) AS trade_count,
+            SUM(taker_buy_volume) AS taker_buy_volume,
+            SUM(taker_buy_quote_volume) AS taker_buy_quote_volume
+        FROM {source_view}
+        GROUP BY 1, {series}
+        WITH NO DATA;
+        """
+    
+    def create_continuous_aggregates(self) -> bool:
+        """創建派生週期的連續聚合與刷新策略（已存在時跳過）"""
+        try:
+            series = 'series_id' if self.compact else 'symbol'
+            where = '' if self.compact else f"WHERE interval = '{BASE_INTERVAL}'"
+            with self.connection.cursor() as cursor:
+                for interval, (source, bucket, start_offset, end_offset, schedule) in DERIVED_INTERVALS.items():
+                    view = continuous_aggregate_name(interval)
+                    if source == BASE_INTERVAL:
+                        sql = self.BASE_AGGREGATE_SQL.format(
+                            view=view, bucket=bucket, series=series, table=self.kline_table, where=where)
+                    else:
+                        sql = self.HIERARCHICAL_AGGREGATE_SQL.format(
+                            view=view, bucket=bucket, series=series, source_view=continuous_aggregate_name(source))
+                    cursor.execute(sql)
+                    cursor.execute(
+                        f"CREATE INDEX IF NOT EXISTS idx_{view}_{series}_bucket ON {view} ({series}, bucket DESC)")
+                    cursor.execute(
+                        "SELECT add_continuous_aggregate_policy(%s, start_offset => %s::interval, "
+                        "end_offset => %s::interval, schedule_interval => %s::interval, if_not_exists => TRUE)",
+                        (view, start_offset, end_offset, schedule))
+            self.error_handler.logger.info(f"連續聚合創建/檢查完成: {', '.join(DERIVED_INTERVALS)}")
+            return True
+        except psycopg2.Error as e:
+            self.error_handler.handle_db_error(e, "創建連續聚合")
+            return False
+    
+    def refresh_continuous_aggregates(self, start_ms: int, end_ms: int, symbol: Optional[str] = None) -> bool:
+        """刷新 [start_ms, end_ms] 內的派生週期（用於超出刷新策略窗口的歷史回補）
+        
+        refresh_continuous_aggregate 只刷新完全落在窗口內的桶，因此先把窗口擴展到桶邊界；
+        按依賴順序刷新，上層聚合讀取的是已刷新的下層結果。
+        基礎週期的寫入通知先於刷新發出，讀取端可能在刷新前重新緩存了舊的聚合結果，
+        因此指定 symbol 時在刷新完成後再為各派生週期發送一次通知。
+        """
+        windows = []
+        try:
+            with self.connection.cursor() as cursor:
+                for interval in DERIVED_INTERVALS:
+                    step_ms = INTERVAL_MS[interval]
+                    window_start = start_ms // step_ms * step_ms
+                    window_end = (end_ms // step_ms + 1) * step_ms
+                    cursor.execute(
+                        "CALL refresh_continuous_aggregate(%s, to_timestamp(%s / 1000.0), to_timestamp(%s / 1000.0))",
+                        (continuous_aggregate_name(interval), window_start, window_end))
+                    windows.append((interval, window_start, window_end - step_ms))
+        except psycopg2.Error as e:
+            self.error_handler.handle_db_error(e, "刷新連續聚合")
+            return False
+        if symbol is not None:
+            for interval, window_start, window_end in windows:
+                self.notify_kline_changed(symbol, interval, window_start, window_end)
+        return True
+    
+    def rebuild_coverage(self, symbol: str, interval: str) -> bool:
+        """根據 kline_data 中的現有數據重建覆蓋索引"""
+        step_ms = INTERVAL_MS.get(interval)
+        if step_ms is None:
+            return False
+        
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(self.COVERAGE_REBUILD_SQL,
+                               {'symbol': symbol, 'interval': interval, 'step_ms': step_ms})
+            self.error_handler.logger.info(f"覆蓋索引已重建: {symbol} {interval}")
+            return True
+        except psycopg2.Error as e:
+            self.error_handler.handle_db_error(e, "重建覆蓋索引")
+            return False
+    
+    def has_coverage(self, symbol: str, interval: str) -> bool:
+        """檢查是否已有覆蓋索引記錄"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT EXISTS (SELECT 1 FROM kline_coverage WHERE symbol = %s AND interval = %s)",
+                    (symbol, interval)
+                )
+                return bool(cursor.fetchone()[0])
+        except psycopg2.Error as e:
+            self.error_handler.handle_db_error(e, "查詢覆蓋索引")
+            return False
+    
+    def get_coverage_gaps(self, symbol: str, interval: str,
+                          start_ms: int, end_ms: int) -> Optional[List[Tuple[int, int]]]:
+        """返回 [start_ms, end_ms] 內缺失的K線開盤時間區間 [(gap_start, gap_end), ...]"""
+        step_ms = INTERVAL_MS.get(interval)
+        if step_ms is None:
+            self.error_handler.logger.error(f"不支持的K線間隔: {interval}")
+            return None
+        
+        query_sql = """
+        SELECT (EXTRACT(EPOCH FROM start_time) * 1000)::BIGINT,
+               (EXTRACT(EPOCH FROM end_time) * 1000)::BIGINT
+        FROM kline_coverage
+        WHERE symbol = %s AND interval = %s
+          AND end_time >= to_timestamp(%s / 1000.0) AND start_time <= to_timestamp(%s / 1000.0)
+        ORDER BY start_time
+        """
+        
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(query_sql, (symbol, interval, int(start_ms), int(end_ms)))
+                ranges = cursor.fetchall()
+        except psycopg2.Error as e:
+            self.error_handler.handle_db_error(e, "查詢覆蓋索引")
+            return None
+        
+        # K線開盤時間對齊到間隔邊界
+        cursor_ms = -(-int(start_ms) // step_ms) * step_ms
+        gaps = []
+        for range_start, range_end in ranges:
+            if range_start > cursor_ms:
+                gaps.append((cursor_ms, max(cursor_ms, range_start - step_ms)))
+            cursor_ms = max(cursor_ms, range_end + step_ms)
+        if cursor_ms <= end_ms:
+            gaps.append((cursor_ms, int(end_ms)))
+        return gaps
+    
     def get_latest_timestamp(self, symbol: str, interval: str) -> Optional[datetime]:
         """獲取最新數據時間戳"""
         query_sql = """
@@ -324,6 +1337,13 @@ class TimescaleDBManager:
         FROM kline_data 
         WHERE symbol = %s AND interval = %s
         """
+        if self.compact:
+            # 直接查詢超表，MAX(time) 可由 (series_id, time) 索引的一端得到
+            query_sql = """
+            SELECT MAX(time) as latest_time
+            FROM kline_bars
+            WHERE series_id = (SELECT series_id FROM kline_series WHERE symbol = %s AND interval = %s)
+            """
         
         try:
             with self.connection.cursor() as cursor:
@@ -344,10 +1364,14 @@ class TimescaleDBManager:
 class KlineDataPipeline:
     """K線數據管道"""
     
-    def __init__(self, config_path: str):
-        """Initialize the K-line data pipeline"""
+    def __init__(self, config_path: str, exchange_name: Optional[str] = None):
+        """Initialize the K-line data pipeline
+        
+        exchange_name 指定使用配置文件中的哪個交易所，默認使用第一個
+        """
         self.error_handler = ErrorHandler()
         self.config_manager = ConfigManager(config_path)
+        self.exchange_config = self._select_exchange_config(exchange_name)
         
         # 初始化API客戶端
         self.api_client = self._create_api_client()
@@ -356,146 +1380,100 @@ class KlineDataPipeline:
         db_config = self.config_manager.get_database_config()
         self.db_manager = TimescaleDBManager(db_config, self.error_handler)
         
+        # 託管存儲模式: 分塊間隔、壓縮與壓縮策略
+        storage_settings = self.config_manager.config.get('storage_settings', {})
+        if storage_settings.get('managed', False):
+            self.db_manager.configure_storage(storage_settings, self._expected_rows_per_day())
+        
+        # 派生模式: 只採集基礎週期，更高週期由連續聚合生成
+        sync_settings = self.config_manager.config.get('sync_settings', {})
+        self.derive_intervals = bool(sync_settings.get('derive_intervals', False))
+        if self.derive_intervals:
+            self.db_manager.create_continuous_aggregates()
+        
         self.error_handler.logger.info("K線數據管道初始化完成")
     
-    def _create_api_client(self):
-        """Create the appropriate API client based on the exchange configuration"""
-        # 獲取第一個交易所配置
+    def _expected_rows_per_day(self) -> float:
+        """按配置的交易對與週期估算每天寫入的行數（數據庫中尚無數據時使用）"""
+        config = self.config_manager.config
+        intervals = config.get('intervals', [])
+        return len(config.get('trading_pairs', [])) * sum(
+            86400000 / INTERVAL_MS[interval] for interval in intervals if interval in INTERVAL_MS)
+    
+    def source_interval(self, interval: str) -> str:
+        """實際需要從交易所採集的週期（派生模式下派生週期改為採集基礎週期）"""
+        if self.derive_intervals and interval in DERIVED_INTERVALS:
+            return BASE_INTERVAL
+        return interval
+    
+    def _select_exchange_config(self, exchange_name: Optional[str] = None) -> Dict[str, Any]:
+        """選擇交易所配置"""
         exchange_configs = self.config_manager.config.get('exchange_configs', [])
         if not exchange_configs:
             raise ValueError("配置文件中沒有交易所配置")
         
-        exchange_config = exchange_configs[0]
-        exchange_name = exchange_config.get('exchange_name', '').lower()
-        api_info = exchange_config.get('api_info', {})
-        
+        if exchange_name is None:
+            return exchange_configs[0]
+        exchange_config = self.config_manager.get_exchange_config(exchange_name)
+        if exchange_config is None:
+            raise ValueError(f"配置文件中沒有交易所: {exchange_name}")
+        return exchange_config
+    
+    def _create_api_client(self):
+        """Create the appropriate API client based on the exchange configuration"""
+        exchange_name = self.exchange_config.get('exchange_name', '').lower()
         self.error_handler.logger.info(f"使用 {exchange_name} 交易所API")
-        
-        # 根據交易所名稱創建相應的API客戶端
-        if exchange_name == 'bingx':
-            return BingXApiClient(api_info, self.error_handler)
-        elif exchange_name == 'binance':
-            return BinanceApiClient(api_info, self.error_handler)
-        elif exchange_name == 'okx':
-            return OKXApiClient(api_info, self.error_handler)
-        elif exchange_name == 'bybit':
-            return ByBitApiClient(api_info, self.error_handler)
-        else:
-            raise ValueError(f"不支持的交易所: {exchange_name}")
+        return create_api_client(self.exchange_config, self.error_handler)
     
     def get_exchange_name(self) -> str:
         """Get the name of the exchange being used"""
-        exchange_configs = self.config_manager.config.get('exchange_configs', [])
-        if exchange_configs:
-            return exchange_configs[0].get('exchange_name', 'Unknown')
-        return 'Unknown'
+        return self.exchange_config.get('exchange_name', 'Unknown')
     
 
-    def _parse_kline_data(self, raw_data: List[Union[List, Dict]], symbol: str, interval: str) -> pd.DataFrame:
-        """解析K線數據"""
-        if not raw_data:
-            return pd.DataFrame()
-        
+    def _validate_kline_batch(self, batch: KlineBatch) -> KlineBatch:
+        """驗證列式K線批次"""
+        validated = batch.validated()
+        if len(validated) < len(batch):
+            self.error_handler.logger.warning(f"數據驗證: 原始 {len(batch)} 條，過濾後 {len(validated)} 條")
+        return validated
+    
+    def _parse_kline_batch(self, raw_data: List[Union[List, Dict]], symbol: str, interval: str) -> KlineBatch:
+        """將原始K線直接解析為列式批次並完成驗證（不構造 DataFrame）"""
         try:
-            # 檢查數據格式 - 處理字典格式的數據
-            if isinstance(raw_data[0], dict):
-                # 創建DataFrame
-                df = pd.DataFrame(raw_data)
-                
-                # 重命名列以匹配預期格式
-                rename_map = {
-                    'time': 'timestamp',
-                    'open': 'open',
-                    'high': 'high',
-                    'low': 'low',
-                    'close': 'close',
-                    'volume': 'volume'
-                }
-                
-                # 僅重命名存在的列
-                existing_columns = {col: rename_map[col] for col in rename_map if col in df.columns}
-                df = df.rename(columns=existing_columns)
-                
-                # 確保所有必要的列都存在
-                required_columns = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
-                missing_columns = [col for col in required_columns if col not in df.columns]
-                
-                if missing_columns:
-                    self.error_handler.logger.warning(f"缺少必要列: {missing_columns}")
-                    for col in missing_columns:
-                        df[col] = None
-                
-                # 添加可能缺少的其他列
-                optional_columns = ['quote_volume', 'trade_count', 'taker_buy_volume', 'taker_buy_quote_volume']
-                for col in optional_columns:
-                    if col not in df.columns:
-                        df[col] = None
-            else:
-                # 原始格式: 列表格式 [timestamp, open, high, low, close, volume, ...]
-                df = pd.DataFrame(raw_data, columns=[
-                    'timestamp', 'open', 'high', 'low', 'close', 'volume',
-                    'quote_volume', 'trade_count', 'taker_buy_volume', 'taker_buy_quote_volume'
-                ])
-            
-            # 數據類型轉換
-            df['timestamp'] = pd.to_numeric(df['timestamp'], errors='coerce')
-            df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
-            
-            # 添加元數據
-            df['symbol'] = symbol
-            df['interval'] = interval
-            
-            # 數值列轉換
-            numeric_columns = ['open', 'high', 'low', 'close', 'volume', 
-                             'quote_volume', 'taker_buy_volume', 'taker_buy_quote_volume']
-            for col in numeric_columns:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            # 確保trade_count列存在並轉換為整數
-            if 'trade_count' in df.columns:
-                df['trade_count'] = pd.to_numeric(df['trade_count'], errors='coerce').fillna(0).astype(int)
-            
-            # 數據驗證
-            df = self._validate_kline_data(df)
-            
-            return df.sort_values('datetime')
-            
+            batch = KlineBatch.from_raw(raw_data, symbol, interval,
+                                        self.api_client.kline_row_layout, self.api_client.kline_dict_keys)
+            return self._validate_kline_batch(batch)
         except Exception as e:
             self.error_handler.handle_general_error(e, f"解析K線數據: {symbol}")
+            return KlineBatch.empty_batch(symbol, interval)
+    
+    def _parse_kline_data(self, raw_data: List[Union[List, Dict]], symbol: str, interval: str) -> pd.DataFrame:
+        """解析K線數據"""
+        if not raw_data:
             return pd.DataFrame()
+        return self._parse_kline_batch(raw_data, symbol, interval).to_dataframe()
     
     def _validate_kline_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        """驗證K線數據"""
+        """驗證K線數據（所有條件合併為一個掩碼，只做一次篩選）"""
         if df.empty:
             return df
         
-        # 移除無效數據
         original_count = len(df)
+        open_ = df['open'].to_numpy(dtype=np.float64, na_value=np.nan)
+        high = df['high'].to_numpy(dtype=np.float64, na_value=np.nan)
+        low = df['low'].to_numpy(dtype=np.float64, na_value=np.nan)
+        close = df['close'].to_numpy(dtype=np.float64, na_value=np.nan)
+        volume = df['volume'].to_numpy(dtype=np.float64, na_value=np.nan)
         
-        # 移除無效時間戳
-        valid_time_df = df[~pd.isna(df['datetime'])]
-        df = valid_time_df
-        
-        # 檢查價格數據
-        if not df.empty:
-            # 價格必須大於0
-            df = df[df['open'] > 0]
-            df = df[df['high'] > 0]
-            df = df[df['low'] > 0]
-            df = df[df['close'] > 0]
-            
-            # 成交量必須大於等於0
-            df = df[df['volume'] >= 0]
-            
-            # 去除重複時間戳
-            df = df.drop_duplicates(subset=['datetime'], keep='last')
-            
-            # OHLC邏輯驗證
-            df = df[(df['high'] >= df['open']) & 
-                   (df['high'] >= df['close']) & 
-                   (df['low'] <= df['open']) & 
-                   (df['low'] <= df['close'])]
+        with np.errstate(invalid='ignore'):
+            mask = (
+                df['datetime'].notna().to_numpy()
+                & (low > 0)
+                & (volume >= 0)
+                & (high >= np.maximum(open_, close))
+                & (low <= np.minimum(open_, close))
+            )
+        df = df[mask].drop_duplicates(subset=['datetime'], keep='last')
         
         # 記錄過濾後數據數量
         if len(df) < original_count:
@@ -503,10 +1481,10 @@ class KlineDataPipeline:
         
         return df
     
-    def fetch_kline_data(self, symbol: str, interval: str = '1h', 
-                        limit: int = 500, start_time: Optional[Any] = None,
-                        end_time: Optional[Any] = None) -> pd.DataFrame:
-        """獲取K線數據"""
+    def fetch_kline_batch(self, symbol: str, interval: str = '1h', 
+                          limit: int = 500, start_time: Optional[Any] = None,
+                          end_time: Optional[Any] = None) -> KlineBatch:
+        """獲取K線數據（列式批次）"""
         self.error_handler.logger.info(f"開始獲取K線數據: {symbol} {interval}")
         
         # 轉換datetime對象為毫秒時間戳
@@ -525,35 +1503,63 @@ class KlineDataPipeline:
         )
         
         if raw_data is None:
+            self.error_handler.logger.error(f"獲取K線數據失敗: {symbol}")
+            return KlineBatch.empty_batch(symbol, interval)
+        
+        batch = self._parse_kline_batch(raw_data, symbol, interval)
+        self.error_handler.logger.info(f"成功獲取 {len(batch)} 條K線數據: {symbol}")
+        
+        return batch
+    
+    def fetch_kline_data(self, symbol: str, interval: str = '1h', 
+                        limit: int = 500, start_time: Optional[Any] = None,
+                        end_time: Optional[Any] = None) -> pd.DataFrame:
+        """獲取K線數據"""
+        return self.fetch_kline_batch(symbol, interval, limit, start_time, end_time).to_dataframe()
+    
+    def fetch_kline_range(self, symbol: str, interval: str, start_time: Any,
+                          end_time: Optional[Any] = None) -> pd.DataFrame:
+        """按交易所的最大頁長與翻頁方向獲取整個時間區間的K線數據"""
+        if isinstance(start_time, datetime):
+            start_time = int(start_time.timestamp() * 1000)
+        if isinstance(end_time, datetime):
+            end_time = int(end_time.timestamp() * 1000)
+        
+        batch = self.api_client.get_kline_batch(symbol, interval, start_time, end_time)
+        if batch is None:
             self.error_handler.logger.error(f"獲取K線數據失敗: {symbol}")
             return pd.DataFrame()
         
-        df = self._parse_kline_data(raw_data, symbol, interval)
+        df = self._validate_kline_batch(batch).to_dataframe()
         self.error_handler.logger.info(f"成功獲取 {len(df)} 條K線數據: {symbol}")
-        
         return df
     
     def sync_kline_data(self, symbol: str, interval: str = '1h', 
                        limit: int = 500, incremental: bool = True) -> bool:
-        """同步K線數據到數據庫"""
+        """同步K線數據到數據庫（派生模式下派生週期改為同步基礎週期）"""
         try:
+            interval = self.source_interval(interval)
             start_time = None
             
             # 增量同步：獲取最新時間戳
             if incremental:
                 latest_time = self.db_manager.get_latest_timestamp(symbol, interval)
                 if latest_time:
-                    # 從最新時間戳之後開始獲取
-                    start_time = int(latest_time.timestamp() * 1000) + 1
+                    # 從最新一根K線開始獲取：它寫入時可能尚未收盤，需要用收盤後的數據覆蓋
+                    start_time = int(latest_time.timestamp() * 1000)
                     self.error_handler.logger.info(f"增量同步從 {latest_time} 開始")
             
-            # 獲取數據
-            df = self.fetch_kline_data(
-                symbol=symbol,
-                interval=interval,
-                limit=limit,
-                start_time=start_time
-            )
+            # 獲取數據: 增量同步時每次最多追趕 limit 根K線，按交易所的頁長與方向分頁
+            if start_time is not None and interval in INTERVAL_MS:
+                end_time = min(int(time.time() * 1000), start_time + (limit - 1) * INTERVAL_MS[interval])
+                df = self.fetch_kline_range(symbol, interval, start_time, end_time)
+            else:
+                df = self.fetch_kline_data(
+                    symbol=symbol,
+                    interval=interval,
+                    limit=limit,
+                    start_time=start_time
+                )
             
             if df.empty:
                 self.error_handler.logger.info(f"沒有新數據需要同步: {symbol}")
@@ -573,8 +1579,74 @@ class KlineDataPipeline:
             self.error_handler.handle_general_error(e, f"同步K線數據: {symbol}")
             return False
     
+    def repair_kline_data(self, symbol: str, interval: str = '1h',
+                          start_time: Optional[Any] = None,
+                          end_time: Optional[Any] = None) -> Optional[Dict[str, int]]:
+        """修復模式: 只請求覆蓋索引中缺失的時間區間
+        
+        交易所對某個已收盤區間返回空數據（例如停機）時，該區間同樣記為已覆蓋，避免重複請求。
+        派生模式下修復基礎週期，並刷新補入範圍內的連續聚合。
+        """
+        interval = self.source_interval(interval)
+        step_ms = INTERVAL_MS.get(interval)
+        if step_ms is None:
+            self.error_handler.logger.error(f"不支持的K線間隔: {interval}")
+            return None
+        
+        if isinstance(start_time, datetime):
+            start_time = int(start_time.timestamp() * 1000)
+        if isinstance(end_time, datetime):
+            end_time = int(end_time.timestamp() * 1000)
+        
+        # 只修復已收盤的K線
+        now_ms = int(time.time() * 1000)
+        end_ms = min(end_time or now_ms, now_ms - step_ms)
+        start_ms = start_time or 0
+        
+        if not self.db_manager.has_coverage(symbol, interval):
+            self.db_manager.rebuild_coverage(symbol, interval)
+        
+        gaps = self.db_manager.get_coverage_gaps(symbol, interval, start_ms, end_ms)
+        if gaps is None:
+            return None
+        
+        stats = {'gaps': len(gaps), 'chunks': 0, 'inserted': 0, 'failed': 0}
+        # 刷新策略只覆蓋最近的數據，歷史回補需要顯式刷新派生週期
+        refresh_derived = self.derive_intervals and interval == BASE_INTERVAL
+        self.error_handler.logger.info(f"修復模式: {symbol} {interval} 發現 {len(gaps)} 個缺失區間")
+        
+        # 大缺口按固定頁數切塊，每塊取完即寫入並記為已覆蓋
+        chunk_ms = self.api_client.max_kline_limit * step_ms * 10
+        for gap_start, gap_end in gaps:
+            for chunk_start in range(gap_start, gap_end + 1, chunk_ms):
+                chunk_end = min(chunk_start + chunk_ms - step_ms, gap_end)
+                stats['chunks'] += 1
+                
+                batch = self.api_client.get_kline_batch(symbol, interval, chunk_start, chunk_end)
+                if batch is None:
+                    self.error_handler.logger.error(f"修復區間獲取失敗: {symbol} {chunk_start} - {chunk_end}")
+                    stats['failed'] += 1
+                    continue
+                
+                batch = self._validate_kline_batch(batch)
+                if not self.db_manager.insert_kline_batch(batch):
+                    stats['failed'] += 1
+                    continue
+                stats['inserted'] += len(batch)
+                if refresh_derived and not batch.empty:
+                    self.db_manager.refresh_continuous_aggregates(chunk_start, chunk_end, symbol)
+                
+                # 交易所已完整應答該區間（包括停機等確實沒有數據的時段）
+                self.db_manager.mark_coverage(symbol, interval, chunk_start, chunk_end)
+        
+        self.error_handler.logger.info(
+            f"修復完成: {symbol} {interval} 缺失區間 {stats['gaps']} 個, "
+            f"分塊 {stats['chunks']} 個, 補入 {stats['inserted']} 條, 失敗 {stats['failed']} 次"
+        )
+        return stats
+    
     def sync_multiple_symbols(self, symbols: List[str], interval: str = '1h',
-                            limit: int = 500, delay: float = 1.0) -> Dict[str, bool]:
+                            limit: int = 500, delay: float = 0.0) -> Dict[str, bool]:
         """批量同步多個交易對"""
         results = {}
         
@@ -586,8 +1658,8 @@ class KlineDataPipeline:
             success = self.sync_kline_data(symbol, interval, limit)
             results[symbol] = success
             
-            # 添加延遲避免API限制
-            if i < len(symbols) - 1:
+            # 請求頻率由 api_client 的限流器控制，delay 僅作為額外間隔
+            if delay > 0 and i < len(symbols) - 1:
                 time.sleep(delay)
         
         # 統計結果
@@ -624,6 +1696,8 @@ class KlineDataPipeline:
             self.db_manager.close()
         if hasattr(self, 'api_client') and hasattr(self.api_client, 'session'):
             self.api_client.session.close()
+        if hasattr(self, 'api_client') and hasattr(self.api_client, 'rate_limiter'):
+            self.api_client.rate_limiter.close()
         self.error_handler.logger.info("K線數據管道已關閉")
 
 
@@ -0,0 +1,209 @@
+"""
+列式K線批次
+描述: 將交易所返回的 JSON 直接解碼為定型 NumPy 數組，所有有效性檢查合併為一個掩碼，
+      只在調用方需要時才構造 DataFrame
+"""
+
+import json
+from typing import Dict, List, Optional, Sequence, Any, Union
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        json_loads = ujson.loads
+    except ImportError:
+        json_loads = json.loads
+
+
+# 浮點列（缺失值為 NaN）
+FLOAT_FIELDS = (
+    'open', 'high', 'low', 'close', 'volume',
+    'quote_volume', 'taker_buy_volume', 'taker_buy_quote_volume'
+)
+
+# 默認的列表格式: [timestamp, open, high, low, close, volume,
+#                  quote_volume, trade_count, taker_buy_volume, taker_buy_quote_volume]
+DEFAULT_ROW_LAYOUT = {
+    'timestamp': 0, 'open': 1, 'high': 2, 'low': 3, 'close': 4, 'volume': 5,
+    'quote_volume': 6, 'trade_count': 7, 'taker_buy_volume': 8, 'taker_buy_quote_volume': 9
+}
+
+# 默認的字典格式鍵名（BingX v3）
+DEFAULT_DICT_KEYS = {
+    'timestamp': 'time', 'open': 'open', 'high': 'high', 'low': 'low', 'close': 'close',
+    'volume': 'volume', 'quote_volume': 'quote_volume', 'trade_count': 'trade_count',
+    'taker_buy_volume': 'taker_buy_volume', 'taker_buy_quote_volume': 'taker_buy_quote_volume'
+}
+
+
+def _to_float_array(values: Sequence[Any]) -> np.ndarray:
+    """轉換為 float64 數組，無法解析的值為 NaN"""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _to_int_array(values: Sequence[Any], fill: int = 0) -> np.ndarray:
+    """轉換為 int64 數組，無法解析的值為 fill"""
+    try:
+        return np.asarray(values, dtype=np.int64)
+    except (TypeError, ValueError, OverflowError):
+        floats = _to_float_array(values)
+        return np.where(np.isnan(floats), fill, floats).astype(np.int64)
+
+
+class KlineBatch:
+    """一批同交易對、同週期的K線，以列式 NumPy 數組保存"""
+
+    __slots__ = ('symbol', 'interval', 'timestamp', 'trade_count') + FLOAT_FIELDS
+
+    def __init__(self, symbol: str, interval: str, timestamp: np.ndarray,
+                 trade_count: Optional[np.ndarray] = None, **columns: np.ndarray):
+        n = len(timestamp)
+        self.symbol = symbol
+        self.interval = interval
+        self.timestamp = timestamp
+        self.trade_count = trade_count if trade_count is not None else np.zeros(n, dtype=np.int64)
+        for name in FLOAT_FIELDS:
+            column = columns.get(name)
+            setattr(self, name, column if column is not None else np.full(n, np.nan))
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.timestamp) == 0
+
+    @classmethod
+    def empty_batch(cls, symbol: str, interval: str) -> 'KlineBatch':
+        """創建空批次"""
+        return cls(symbol, interval, np.empty(0, dtype=np.int64))
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Sequence[Any]], symbol: str, interval: str,
+                  layout: Optional[Dict[str, int]] = None) -> 'KlineBatch':
+        """從列表格式的K線解析，layout 指定各字段所在的列號"""
+        if not rows:
+            return cls.empty_batch(symbol, interval)
+        layout = layout or DEFAULT_ROW_LAYOUT
+        width = min(len(row) for row in rows)
+        columns = list(zip(*rows))
+
+        def column(name):
+            index = layout.get(name)
+            return columns[index] if index is not None and index < width else None
+
+        floats = {}
+        for name in FLOAT_FIELDS:
+            values = column(name)
+            if values is not None:
+                floats[name] = _to_float_array(values)
+        trade_count = column('trade_count')
+        return cls(
+            symbol, interval,
+            _to_int_array(column('timestamp'), fill=-1),
+            _to_int_array(trade_count) if trade_count is not None else None,
+            **floats
+        )
+
+    @classmethod
+    def from_dicts(cls, records: Sequence[Dict[str, Any]], symbol: str, interval: str,
+                   keys: Optional[Dict[str, str]] = None) -> 'KlineBatch':
+        """從字典格式的K線解析，keys 指定各字段對應的鍵名"""
+        if not records:
+            return cls.empty_batch(symbol, interval)
+        keys = keys or DEFAULT_DICT_KEYS
+        sample = records[0]
+
+        def column(name):
+            key = keys.get(name)
+            if key is None or key not in sample:
+                return None
+            return [record.get(key) for record in records]
+
+        floats = {}
+        for name in FLOAT_FIELDS:
+            values = column(name)
+            if values is not None:
+                floats[name] = _to_float_array(values)
+        timestamp = column('timestamp')
+        trade_count = column('trade_count')
+        return cls(
+            symbol, interval,
+            _to_int_array(timestamp, fill=-1) if timestamp is not None else np.full(len(records), -1, dtype=np.int64),
+            _to_int_array(trade_count) if trade_count is not None else None,
+            **floats
+        )
+
+    @classmethod
+    def from_raw(cls, raw_data: List[Union[List, Dict]], symbol: str, interval: str,
+                 layout: Optional[Dict[str, int]] = None,
+                 keys: Optional[Dict[str, str]] = None) -> 'KlineBatch':
+        """自動判斷列表/字典格式並解析"""
+        if not raw_data:
+            return cls.empty_batch(symbol, interval)
+        if isinstance(raw_data[0], dict):
+            return cls.from_dicts(raw_data, symbol, interval, keys)
+        return cls.from_rows(raw_data, symbol, interval, layout)
+
+    @classmethod
+    def concat(cls, batches: Sequence['KlineBatch']) -> 'KlineBatch':
+        """合併同交易對、同週期的多個批次"""
+        batches = [batch for batch in batches if not batch.empty]
+        if not batches:
+            return cls.empty_batch('', '')
+        first = batches[0]
+        return cls(
+            first.symbol, first.interval,
+            np.concatenate([batch.timestamp for batch in batches]),
+            np.concatenate([batch.trade_count for batch in batches]),
+            **{name: np.concatenate([getattr(batch, name) for batch in batches]) for name in FLOAT_FIELDS}
+        )
+
+    def take(self, index: np.ndarray) -> 'KlineBatch':
+        """按索引或布爾掩碼取子集"""
+        return KlineBatch(
+            self.symbol, self.interval, self.timestamp[index], self.trade_count[index],
+            **{name: getattr(self, name)[index] for name in FLOAT_FIELDS}
+        )
+
+    def valid_mask(self) -> np.ndarray:
+        """一次計算所有有效性條件: 時間戳有效、價格為正、成交量非負、OHLC 邏輯一致"""
+        with np.errstate(invalid='ignore'):
+            return (
+                (self.timestamp >= 0)
+                & (self.low > 0)
+                & (self.volume >= 0)
+                & (self.high >= np.maximum(self.open, self.close))
+                & (self.low <= np.minimum(self.open, self.close))
+            )
+
+    def validated(self) -> 'KlineBatch':
+        """過濾無效K線，按時間排序，重複時間戳保留最後一條"""
+        index = np.flatnonzero(self.valid_mask())
+        if len(index) == 0:
+            return self.take(index)
+        order = index[np.argsort(self.timestamp[index], kind='stable')]
+        timestamps = self.timestamp[order]
+        keep = np.append(timestamps[1:] != timestamps[:-1], True)
+        return self.take(order[keep])
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """構造與舊解析路徑列名一致的 DataFrame"""
+        if self.empty:
+            return pd.DataFrame()
+        data = {'timestamp': self.timestamp}
+        data.update({name: getattr(self, name) for name in FLOAT_FIELDS})
+        data['trade_count'] = self.trade_count
+        data['datetime'] = self.timestamp.astype('datetime64[ms]')
+        data['symbol'] = self.symbol
+        data['interval'] = self.interval
+        return pd.DataFrame(data)
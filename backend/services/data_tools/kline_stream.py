@@ -0,0 +1,388 @@
+"""
+WebSocket 實時K線寫入
+描述: 通過少量多路復用的 WebSocket 連接訂閱大量交易對的K線頻道，已收盤K線按微批次寫入數據庫；
+      每次(重新)連接後通過 REST 補齊斷線期間遺漏的K線
+
+使用方法:
+python backend/services/data_tools/kline_stream.py --config_path backend/api_config/BingX_api_config2_local.json --intervals 1m 5m
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import signal
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional, Any, Tuple, Union
+
+import pandas as pd
+import websockets
+
+try:
+    from backend.services.data_tools.import_to_database import (
+        ConfigManager, ErrorHandler, INTERVAL_MS, create_api_client
+    )
+    from backend.services.data_tools.async_import_to_database import AsyncTimescaleDBManager
+    from backend.services.data_tools.kline_batch import json_loads
+except ImportError:  # 直接在 data_tools 目錄下運行時
+    from import_to_database import ConfigManager, ErrorHandler, INTERVAL_MS, create_api_client
+    from async_import_to_database import AsyncTimescaleDBManager
+    from kline_batch import json_loads
+
+
+# (symbol, interval)
+StreamKey = Tuple[str, str]
+
+
+class StreamAdapter:
+    """交易所 WebSocket 協議適配器基類"""
+
+    exchange_name = 'unknown'
+    max_streams_per_connection = 100
+
+    def url(self, streams: List[StreamKey]) -> str:
+        raise NotImplementedError
+
+    def subscribe_messages(self, streams: List[StreamKey]) -> List[str]:
+        """連接建立後需要發送的訂閱消息"""
+        return []
+
+    def decode(self, message: Union[str, bytes]) -> Any:
+        return json_loads(message)
+
+    def handle(self, payload: Any) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """處理一條消息，返回 (需要回覆的消息, 已收盤K線列表)"""
+        raise NotImplementedError
+
+
+class BingXStreamAdapter(StreamAdapter):
+    """BingX 永續合約行情流
+
+    消息為 gzip 壓縮；服務端發送 Ping 需回覆 Pong。推送不帶收盤標記，
+    同一數據流出現新的開盤時間即表示上一根K線已收盤。
+    """
+
+    exchange_name = 'bingx'
+    max_streams_per_connection = 100
+
+    def __init__(self, base_url: str = 'wss://open-api-swap.bingx.com/swap-market'):
+        self.base_url = base_url
+        self._pending: Dict[StreamKey, Dict[str, Any]] = {}
+
+    def url(self, streams: List[StreamKey]) -> str:
+        return self.base_url
+
+    def subscribe_messages(self, streams: List[StreamKey]) -> List[str]:
+        return [
+            json.dumps({'id': uuid.uuid4().hex, 'reqType': 'sub', 'dataType': f"{symbol}@kline_{interval}"})
+            for symbol, interval in streams
+        ]
+
+    def decode(self, message: Union[str, bytes]) -> Any:
+        if isinstance(message, bytes):
+            message = gzip.decompress(message)
+        if message in (b'Ping', 'Ping'):
+            return 'Ping'
+        return json_loads(message)
+
+    def handle(self, payload: Any) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        if payload == 'Ping':
+            return 'Pong', []
+        data_type = payload.get('dataType', '') if isinstance(payload, dict) else ''
+        if '@kline_' not in data_type:
+            return None, []
+
+        symbol, interval = data_type.split('@kline_', 1)
+        closed = []
+        for item in payload.get('data') or []:
+            candle = {
+                'timestamp': int(item['T']),
+                'open': float(item['o']), 'high': float(item['h']),
+                'low': float(item['l']), 'close': float(item['c']),
+                'volume': float(item['v']),
+                'symbol': symbol, 'interval': interval
+            }
+            key = (symbol, interval)
+            previous = self._pending.get(key)
+            if previous is not None and candle['timestamp'] > previous['timestamp']:
+                closed.append(previous)
+            if previous is None or candle['timestamp'] >= previous['timestamp']:
+                self._pending[key] = candle
+        return None, closed
+
+
+class BinanceStreamAdapter(StreamAdapter):
+    """Binance 組合流（一個連接最多 1024 個數據流），k.x 為收盤標記"""
+
+    exchange_name = 'binance'
+    max_streams_per_connection = 1024
+
+    def __init__(self, base_url: str = 'wss://stream.binance.com:9443/stream'):
+        self.base_url = base_url
+        self._symbols: Dict[str, str] = {}
+
+    def url(self, streams: List[StreamKey]) -> str:
+        names = []
+        for symbol, interval in streams:
+            exchange_symbol = symbol.replace('-', '').lower()
+            self._symbols[exchange_symbol.upper()] = symbol
+            names.append(f"{exchange_symbol}@kline_{interval}")
+        return f"{self.base_url}?streams={'/'.join(names)}"
+
+    def handle(self, payload: Any) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        data = payload.get('data', {}) if isinstance(payload, dict) else {}
+        kline = data.get('k')
+        if data.get('e') != 'kline' or not kline or not kline.get('x'):
+            return None, []
+
+        return None, [{
+            'timestamp': int(kline['t']),
+            'open': float(kline['o']), 'high': float(kline['h']),
+            'low': float(kline['l']), 'close': float(kline['c']),
+            'volume': float(kline['v']), 'quote_volume': float(kline['q']),
+            'trade_count': int(kline['n']),
+            'taker_buy_volume': float(kline['V']), 'taker_buy_quote_volume': float(kline['Q']),
+            'symbol': self._symbols.get(data.get('s', ''), data.get('s', '')),
+            'interval': kline['i']
+        }]
+
+
+STREAM_ADAPTERS = {
+    'bingx': BingXStreamAdapter,
+    'binance': BinanceStreamAdapter
+}
+
+
+class KlineStreamIngestor:
+    """WebSocket 實時K線寫入服務"""
+
+    def __init__(self, config_path: str, exchange_name: Optional[str] = None,
+                 symbols: Optional[List[str]] = None, intervals: Optional[List[str]] = None,
+                 flush_interval: float = 0.2, max_batch_size: int = 1000,
+                 resync_concurrency: int = 4):
+        self.error_handler = ErrorHandler()
+        self.logger = self.error_handler.logger
+        self.config_manager = ConfigManager(config_path)
+        config = self.config_manager.config
+
+        if exchange_name:
+            self.exchange_config = self.config_manager.get_exchange_config(exchange_name)
+            if self.exchange_config is None:
+                raise ValueError(f"配置文件中沒有交易所: {exchange_name}")
+        else:
+            self.exchange_config = config['exchange_configs'][0]
+        self.exchange_name = self.exchange_config.get('exchange_name', '').lower()
+
+        adapter_class = STREAM_ADAPTERS.get(self.exchange_name)
+        if adapter_class is None:
+            raise ValueError(f"實時寫入不支持的交易所: {self.exchange_name}")
+        self.adapter_class = adapter_class
+
+        symbols = symbols or config.get('trading_pairs', [])
+        intervals = intervals or config.get('intervals', ['1m'])
+        self.streams: List[StreamKey] = [
+            (symbol, interval) for symbol in symbols for interval in intervals if interval in INTERVAL_MS
+        ]
+
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.api_client = create_api_client(self.exchange_config, self.error_handler)
+        self.db_manager = AsyncTimescaleDBManager(self.config_manager.get_database_config(), self.error_handler)
+
+        # 待寫入的已收盤K線，同一根K線只保留最後一次推送
+        self._buffer: Dict[Tuple[str, str, int], Dict[str, Any]] = {}
+        self._buffer_full = asyncio.Event()
+        self._last_closed: Dict[StreamKey, int] = {}
+        # REST 補齊失敗的數據流 -> 需要重新補齊的起點
+        self._resync_from: Dict[StreamKey, int] = {}
+        self._resync_semaphore = asyncio.Semaphore(resync_concurrency)
+        self._stop = asyncio.Event()
+
+    def _enqueue(self, candle: Dict[str, Any]) -> None:
+        key = (candle['symbol'], candle['interval'])
+        self._buffer[(candle['symbol'], candle['interval'], candle['timestamp'])] = candle
+        self._last_closed[key] = max(self._last_closed.get(key, 0), candle['timestamp'])
+        if len(self._buffer) >= self.max_batch_size:
+            self._buffer_full.set()
+
+    async def _flush(self) -> bool:
+        """把緩衝區中的K線作為一個批次寫入；寫入失敗時放回緩衝區，返回是否成功"""
+        if not self._buffer:
+            return True
+        candles, self._buffer = list(self._buffer.values()), {}
+
+        try:
+            df = pd.DataFrame(candles)
+            df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
+            inserted = await self.db_manager.insert_kline_data(df)
+        except Exception as e:
+            self.error_handler.handle_general_error(e, "實時寫入K線")
+            inserted = False
+
+        if not inserted:
+            # 寫入期間收到的同一根K線的新推送優先
+            for candle in candles:
+                self._buffer.setdefault((candle['symbol'], candle['interval'], candle['timestamp']), candle)
+            self.logger.warning(f"實時寫入失敗，{len(candles)} 根K線已放回緩衝區等待重試")
+            return False
+
+        now_ms = time.time() * 1000
+        latency = max(now_ms - (c['timestamp'] + INTERVAL_MS[c['interval']]) for c in candles)
+        self.logger.info(f"實時寫入 {len(candles)} 根已收盤K線，收盤至入庫最大延遲 {latency:.0f} ms")
+        return True
+
+    async def _flush_loop(self) -> None:
+        """按時間或批次大小觸發微批次寫入；寫入失敗時指數退避重試，不中斷寫入任務"""
+        backoff = self.flush_interval
+        while not self._stop.is_set():
+            # 重試期間緩衝區可能一直是滿的，只等待退避時間（或停止）
+            waiter = self._buffer_full if backoff == self.flush_interval else self._stop
+            try:
+                await asyncio.wait_for(waiter.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._buffer_full.clear()
+            if await self._flush():
+                backoff = self.flush_interval
+            else:
+                backoff = min(backoff * 2, 30.0)
+
+    async def _resync(self, streams: List[StreamKey]) -> None:
+        """通過 REST 補齊斷線期間（或啟動前）遺漏的已收盤K線"""
+        loop = asyncio.get_running_loop()
+
+        async def _resync_one(symbol: str, interval: str) -> None:
+            step_ms = INTERVAL_MS[interval]
+            key = (symbol, interval)
+            # 上次補齊失敗的區間起點優先，期間收到的實時K線不能把它跳過
+            start_ms = self._resync_from.get(key, self._last_closed.get(key))
+            if start_ms is None:
+                latest_time = await self.db_manager.get_latest_timestamp(symbol, interval)
+                if latest_time is None:
+                    return
+                start_ms = int(latest_time.timestamp() * 1000)
+            end_ms = (int(time.time() * 1000) // step_ms - 1) * step_ms
+            if end_ms < start_ms:
+                return
+
+            async with self._resync_semaphore:
+                batch = await loop.run_in_executor(
+                    None, self.api_client.get_kline_batch, symbol, interval, start_ms, end_ms
+                )
+            if batch is None:
+                self.logger.error(f"REST 補齊失敗: {symbol} {interval}")
+                self._resync_from[key] = start_ms
+                return
+            batch = batch.validated()
+            if not batch.empty:
+                try:
+                    inserted = await self.db_manager.insert_kline_data(batch.to_dataframe())
+                except Exception as e:
+                    self.error_handler.handle_general_error(e, f"REST 補齊寫入: {symbol} {interval}")
+                    inserted = False
+                if not inserted:
+                    self.logger.error(f"REST 補齊寫入失敗: {symbol} {interval}，下次補齊時重試")
+                    self._resync_from[key] = start_ms
+                    return
+                self.logger.info(f"REST 補齊 {symbol} {interval}: {len(batch)} 條")
+            self._resync_from.pop(key, None)
+
+        await asyncio.gather(*(_resync_one(symbol, interval) for symbol, interval in streams))
+
+    async def _run_connection(self, streams: List[StreamKey]) -> None:
+        """維持一個多路復用連接，斷線後指數退避重連並補齊數據"""
+        adapter = self.adapter_class()
+        backoff = 1.0
+        while not self._stop.is_set():
+            resync_task = None
+            try:
+                async with websockets.connect(adapter.url(streams), ping_interval=20,
+                                              max_size=2 ** 22) as websocket:
+                    for message in adapter.subscribe_messages(streams):
+                        await websocket.send(message)
+                    self.logger.info(f"{self.exchange_name} 實時連接已建立，訂閱 {len(streams)} 個數據流")
+                    backoff = 1.0
+                    resync_task = asyncio.ensure_future(self._resync(streams))
+
+                    async for message in websocket:
+                        try:
+                            reply, candles = adapter.handle(adapter.decode(message))
+                        except (KeyError, TypeError, ValueError, AttributeError, OSError) as e:
+                            # 格式異常的單條消息（字段缺失、無法解壓或解析）跳過，不中斷連接
+                            self.logger.warning(f"{self.exchange_name} 實時消息格式異常，已跳過: {e!r} {str(message)[:200]}")
+                            continue
+                        if reply is not None:
+                            await websocket.send(reply)
+                        for candle in candles:
+                            self._enqueue(candle)
+
+            except (websockets.exceptions.WebSocketException, OSError, ValueError) as e:
+                self.error_handler.handle_api_error(e, f"{self.exchange_name} 實時連接中斷")
+            except Exception as e:
+                # 其他意外錯誤同樣退避後重連，連接任務不能退出（run 收集任務結果時不會記錄異常）
+                self.error_handler.handle_general_error(e, f"{self.exchange_name} 實時連接異常")
+            finally:
+                if resync_task is not None and not resync_task.done():
+                    resync_task.cancel()
+
+            if not self._stop.is_set():
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
+
+    async def run(self) -> None:
+        """啟動所有連接與寫入任務，直到 stop() 被調用"""
+        if not self.streams:
+            self.logger.error("沒有可訂閱的數據流")
+            return
+
+        await self.db_manager.initialize()
+        size = self.adapter_class.max_streams_per_connection
+        groups = [self.streams[i:i + size] for i in range(0, len(self.streams), size)]
+        self.logger.info(f"實時寫入啟動: {len(self.streams)} 個數據流，{len(groups)} 個連接")
+
+        tasks = [asyncio.ensure_future(self._run_connection(group)) for group in groups]
+        flusher = asyncio.ensure_future(self._flush_loop())
+        try:
+            await self._stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await flusher
+            await self._flush()
+            await self.db_manager.close()
+            self.api_client.rate_limiter.close()
+            self.logger.info("實時寫入已停止")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def parse_arguments():
+    """解析命令行參數"""
+    parser = argparse.ArgumentParser(description='WebSocket 實時K線寫入')
+    parser.add_argument('--config_path', type=str, required=True, help='配置文件路徑')
+    parser.add_argument('--exchange', type=str, help='交易所名稱，默認使用配置文件中的第一個')
+    parser.add_argument('--symbols', type=str, nargs='*', help='交易對，默認使用配置文件中的 trading_pairs')
+    parser.add_argument('--intervals', type=str, nargs='*', help='K線間隔，默認使用配置文件中的 intervals')
+    parser.add_argument('--flush_interval', type=float, default=0.2, help='微批次寫入間隔（秒）')
+    return parser.parse_args()
+
+
+async def main():
+    """主函數"""
+    args = parse_arguments()
+    ingestor = KlineStreamIngestor(args.config_path, args.exchange, args.symbols, args.intervals,
+                                   flush_interval=args.flush_interval)
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, ingestor.stop)
+    await ingestor.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,295 @@
+"""
+內存 L2 訂單簿引擎
+每個交易對的買賣盤各用一個價格階梯維護：升序價格數組（bisect 查找與插入）加價格到數量的字典，
+最優買賣價 O(1)，按價格的深度查詢 O(log n)。增量按 sequence_id 校驗連續性，
+發現缺口時暫存後續增量並重新獲取快照，快照之後的增量重放後恢復；
+按更新次數或時間間隔把前 N 檔持久化到 orderbook_snapshots（compact 存儲時寫入 orderbook_frames）
+
+使用方法:
+    engine = OrderBookEngine(fetch_snapshot, persist=buffer.add_orderbook_snapshot, snapshot_interval=1.0)
+    engine.add_symbol('BTC-USDT', pair_id=1)
+    await engine.on_diff('BTC-USDT', sequence_id, bids, asks)
+"""
+import asyncio
+import time
+import logging
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+Level = Tuple[float, float]
+# (sequence_id, bids, asks)
+Snapshot = Tuple[int, Sequence[Level], Sequence[Level]]
+
+
+class PriceLadder:
+    """單邊價位
+
+    prices 為升序價格數組：買盤最優價在末尾，賣盤最優價在開頭，均為 O(1) 訪問。
+    """
+
+    __slots__ = ('is_bid', 'prices', 'quantities')
+
+    def __init__(self, is_bid: bool):
+        self.is_bid = is_bid
+        self.prices: List[float] = []
+        self.quantities: Dict[float, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def clear(self) -> None:
+        self.prices = []
+        self.quantities = {}
+
+    def load(self, levels: Sequence[Level]) -> None:
+        """替換全部價位"""
+        self.quantities = {float(price): float(quantity) for price, quantity in levels if float(quantity) > 0}
+        self.prices = sorted(self.quantities)
+
+    def set(self, price: float, quantity: float) -> None:
+        """設置價位數量，數量為 0 時刪除"""
+        if quantity > 0:
+            if price not in self.quantities:
+                insort(self.prices, price)
+            self.quantities[price] = quantity
+        elif self.quantities.pop(price, None) is not None:
+            del self.prices[bisect_left(self.prices, price)]
+
+    def best(self) -> Optional[Level]:
+        if not self.prices:
+            return None
+        price = self.prices[-1] if self.is_bid else self.prices[0]
+        return price, self.quantities[price]
+
+    def top(self, depth: int) -> List[Level]:
+        """最優的 depth 檔，按從優到劣排序"""
+        prices = self.prices[:-depth - 1:-1] if self.is_bid else self.prices[:depth]
+        return [(price, self.quantities[price]) for price in prices]
+
+    def levels_through(self, price: float) -> int:
+        """價格不劣於 price 的檔數"""
+        if self.is_bid:
+            return len(self.prices) - bisect_left(self.prices, price)
+        return bisect_right(self.prices, price)
+
+    def volume_through(self, price: float) -> float:
+        """價格不劣於 price 的累計數量"""
+        count = self.levels_through(price)
+        prices = self.prices[len(self.prices) - count:] if self.is_bid else self.prices[:count]
+        return sum(self.quantities[level] for level in prices)
+
+
+class OrderBook:
+    """單個交易對的 L2 訂單簿
+
+    sequence_id 為已應用的最後一個更新；apply_diff 在序號不連續時設置 needs_resync 並拒絕更新。
+    """
+
+    def __init__(self, symbol: str, pair_id: Optional[int] = None):
+        self.symbol = symbol
+        self.pair_id = pair_id
+        self.bids = PriceLadder(is_bid=True)
+        self.asks = PriceLadder(is_bid=False)
+        self.sequence_id: Optional[int] = None
+        self.needs_resync = True
+        self.updated_at = 0.0
+
+    def apply_snapshot(self, sequence_id: int, bids: Sequence[Level], asks: Sequence[Level]) -> None:
+        self.bids.load(bids)
+        self.asks.load(asks)
+        self.sequence_id = sequence_id
+        self.needs_resync = False
+        self.updated_at = time.time()
+
+    def apply_diff(self, sequence_id: int, bids: Sequence[Level], asks: Sequence[Level],
+                   first_sequence_id: Optional[int] = None) -> bool:
+        """應用增量，返回是否已應用
+
+        first_sequence_id 為該增量覆蓋的第一個序號（例如 Binance 的 U），默認與 sequence_id 相同。
+        已包含在當前狀態中的舊增量直接忽略；與當前序號之間有缺口時標記需要重新同步。
+        """
+        if self.needs_resync or self.sequence_id is None:
+            return False
+        if sequence_id <= self.sequence_id:
+            return False
+        first = sequence_id if first_sequence_id is None else first_sequence_id
+        if first > self.sequence_id + 1:
+            logger.warning(f"{self.symbol} 訂單簿序號缺口: 期望 {self.sequence_id + 1}，收到 {first}")
+            self.needs_resync = True
+            return False
+
+        set_bid, set_ask = self.bids.set, self.asks.set
+        for price, quantity in bids:
+            set_bid(float(price), float(quantity))
+        for price, quantity in asks:
+            set_ask(float(price), float(quantity))
+        self.sequence_id = sequence_id
+        self.updated_at = time.time()
+        return True
+
+    def best_bid(self) -> Optional[Level]:
+        return self.bids.best()
+
+    def best_ask(self) -> Optional[Level]:
+        return self.asks.best()
+
+    def spread(self) -> Optional[float]:
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return ask[0] - bid[0]
+
+    def mid_price(self) -> Optional[float]:
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return (bid[0] + ask[0]) / 2
+
+    def depth(self, levels: int = 20) -> Tuple[List[Level], List[Level]]:
+        """前 levels 檔 (買盤降序, 賣盤升序)"""
+        return self.bids.top(levels), self.asks.top(levels)
+
+
+class OrderBookEngine:
+    """多交易對訂單簿引擎
+
+    fetch_snapshot(symbol) 返回 (sequence_id, bids, asks)，用於初始化與缺口後的重新同步；
+    persist(pair_id, sequence_id, bids, asks) 保存前 persist_depth 檔，
+    可傳入 DataAccess.insert_orderbook_snapshot 或 WriteBehindBuffer.add_orderbook_snapshot。
+    snapshot_every（更新次數）與 snapshot_interval（秒）任一達到即持久化，均為 None 時不持久化。
+    """
+
+    def __init__(self, fetch_snapshot: Callable[[str], Awaitable[Snapshot]],
+                 persist: Optional[Callable[[int, int, List[Level], List[Level]], Awaitable[None]]] = None,
+                 snapshot_every: Optional[int] = None, snapshot_interval: Optional[float] = 1.0,
+                 persist_depth: int = 100, max_pending_diffs: int = 10000, resync_delay: float = 1.0):
+        self.fetch_snapshot = fetch_snapshot
+        self.persist = persist
+        self.snapshot_every = snapshot_every
+        self.snapshot_interval = snapshot_interval
+        self.persist_depth = persist_depth
+        self.max_pending_diffs = max_pending_diffs
+        self.resync_delay = resync_delay
+
+        self.books: Dict[str, OrderBook] = {}
+        # 重新同步期間暫存的增量: symbol -> [(sequence_id, bids, asks, first_sequence_id)]
+        self._pending: Dict[str, List[Tuple]] = {}
+        self._resync_tasks: Dict[str, asyncio.Task] = {}
+        self._persist_state: Dict[str, Tuple[int, float]] = {}
+        self._metrics = {'diffs': 0, 'applied': 0, 'stale': 0, 'gaps': 0, 'resyncs': 0,
+                         'resync_failures': 0, 'persisted': 0}
+
+    def add_symbol(self, symbol: str, pair_id: Optional[int] = None) -> OrderBook:
+        """登記交易對；首個增量到達時獲取初始快照"""
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = OrderBook(symbol, pair_id)
+            self._persist_state[symbol] = (0, time.monotonic())
+        return book
+
+    def get_book(self, symbol: str) -> Optional[OrderBook]:
+        return self.books.get(symbol)
+
+    async def on_diff(self, symbol: str, sequence_id: int, bids: Sequence[Level], asks: Sequence[Level],
+                      first_sequence_id: Optional[int] = None) -> None:
+        """處理交易所推送的一條深度增量"""
+        book = self.books.get(symbol) or self.add_symbol(symbol)
+        self._metrics['diffs'] += 1
+
+        if book.needs_resync:
+            self._buffer_diff(symbol, (sequence_id, bids, asks, first_sequence_id))
+            self._start_resync(symbol)
+            return
+
+        if book.apply_diff(sequence_id, bids, asks, first_sequence_id):
+            self._metrics['applied'] += 1
+            await self._maybe_persist(book)
+        elif book.needs_resync:
+            self._metrics['gaps'] += 1
+            self._buffer_diff(symbol, (sequence_id, bids, asks, first_sequence_id))
+            self._start_resync(symbol)
+        else:
+            self._metrics['stale'] += 1
+
+    def _buffer_diff(self, symbol: str, diff: Tuple) -> None:
+        pending = self._pending.setdefault(symbol, [])
+        pending.append(diff)
+        if len(pending) > self.max_pending_diffs:
+            # 只需保留快照之後的增量，過舊的部分可以丟棄
+            del pending[:len(pending) - self.max_pending_diffs]
+
+    def _start_resync(self, symbol: str) -> None:
+        task = self._resync_tasks.get(symbol)
+        if task is None or task.done():
+            self._resync_tasks[symbol] = asyncio.ensure_future(self._resync(symbol))
+
+    async def _resync(self, symbol: str) -> None:
+        """獲取快照並重放快照之後暫存的增量；重放中再次出現缺口時延遲後重試"""
+        book = self.books[symbol]
+        while book.needs_resync:
+            self._metrics['resyncs'] += 1
+            try:
+                sequence_id, bids, asks = await self.fetch_snapshot(symbol)
+            except Exception as e:
+                self._metrics['resync_failures'] += 1
+                logger.error(f"獲取 {symbol} 訂單簿快照失敗: {e}")
+                await asyncio.sleep(self.resync_delay)
+                continue
+
+            book.apply_snapshot(sequence_id, bids, asks)
+            pending, self._pending[symbol] = self._pending.get(symbol, []), []
+            for diff_sequence_id, diff_bids, diff_asks, first_sequence_id in pending:
+                # 快照之前的增量已包含在快照中；覆蓋快照序號的增量（first <= 快照序號 + 1）可以直接應用
+                if diff_sequence_id <= sequence_id:
+                    continue
+                if not book.apply_diff(diff_sequence_id, diff_bids, diff_asks, first_sequence_id):
+                    if book.needs_resync:
+                        self._metrics['gaps'] += 1
+                        break
+                else:
+                    self._metrics['applied'] += 1
+
+            if book.needs_resync:
+                await asyncio.sleep(self.resync_delay)
+            else:
+                logger.info(f"{symbol} 訂單簿已同步到序號 {book.sequence_id}")
+                await self._persist(book)
+
+    async def _maybe_persist(self, book: OrderBook) -> None:
+        if self.persist is None or book.pair_id is None:
+            return
+        updates, persisted_at = self._persist_state[book.symbol]
+        updates += 1
+        self._persist_state[book.symbol] = (updates, persisted_at)
+        if (self.snapshot_every and updates >= self.snapshot_every) or \
+                (self.snapshot_interval and time.monotonic() - persisted_at >= self.snapshot_interval):
+            await self._persist(book)
+
+    async def _persist(self, book: OrderBook) -> None:
+        if self.persist is None or book.pair_id is None:
+            return
+        self._persist_state[book.symbol] = (0, time.monotonic())
+        bids, asks = book.depth(self.persist_depth)
+        try:
+            await self.persist(book.pair_id, book.sequence_id, bids, asks)
+            self._metrics['persisted'] += 1
+        except Exception as e:
+            logger.error(f"保存 {book.symbol} 訂單簿快照失敗: {e}")
+
+    async def close(self) -> None:
+        """取消進行中的重新同步並保存每個訂單簿的最終狀態"""
+        for task in self._resync_tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._resync_tasks.values(), return_exceptions=True)
+        self._resync_tasks.clear()
+        for book in self.books.values():
+            if not book.needs_resync:
+                await self._persist(book)
+
+    def stats(self) -> Dict[str, Any]:
+        """引擎指標"""
+        return dict(self._metrics,
+                    books=len(self.books),
+                    resyncing=[symbol for symbol, book in self.books.items() if book.needs_resync])
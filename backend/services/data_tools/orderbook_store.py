@@ -0,0 +1,136 @@
+"""
+訂單簿緊湊存儲
+價位以小端 float8 (price, quantity) 對緊密打包為 bytea，讀取時用 np.frombuffer 直接得到 (n, 2) 數組，無需解析 JSON。
+每個交易對每 snapshot_every 次更新寫一次完整快照，其間只寫增量（quantity 為 0 表示刪除該價位），
+按 sequence_id 排序後從最近的快照重放增量即可重建任意時刻的訂單簿
+"""
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+Levels = Union[Sequence[Tuple[float, float]], np.ndarray]
+
+# (time, sequence_id, is_snapshot, bids, asks)，列順序同 orderbook_frames
+FrameRecord = Tuple[datetime, int, bool, bytes, bytes]
+
+LEVEL_DTYPE = np.dtype('<f8')
+
+
+def pack_levels(levels: Levels) -> bytes:
+    """(price, quantity) 列表打包為 bytea"""
+    if len(levels) == 0:
+        return b''
+    return np.asarray(levels, dtype=LEVEL_DTYPE).reshape(-1, 2).tobytes()
+
+
+def unpack_levels(data: Optional[bytes]) -> np.ndarray:
+    """bytea 解包為 (n, 2) float64 數組（只讀視圖）"""
+    if not data:
+        return np.empty((0, 2), dtype=np.float64)
+    return np.frombuffer(data, dtype=LEVEL_DTYPE).reshape(-1, 2)
+
+
+def _sorted_levels(book: Dict[float, float], descending: bool) -> np.ndarray:
+    prices = sorted(book, reverse=descending)
+    result = np.empty((len(prices), 2), dtype=np.float64)
+    result[:, 0] = prices
+    result[:, 1] = [book[price] for price in prices]
+    return result
+
+
+def _apply(book: Dict[float, float], changes: np.ndarray) -> None:
+    for price, quantity in changes.tolist():
+        if quantity == 0:
+            book.pop(price, None)
+        else:
+            book[price] = quantity
+
+
+class OrderBookFrameEncoder:
+    """把快照與增量編碼為 orderbook_frames 記錄
+
+    維護每個交易對的當前價位，距上次快照的更新次數達到 snapshot_every 時
+    把這次更新寫成應用增量後的完整快照，重建時最多重放 snapshot_every - 1 個增量。
+    """
+
+    def __init__(self, snapshot_every: int = 100):
+        self.snapshot_every = snapshot_every
+        self._books: Dict[int, Tuple[Dict[float, float], Dict[float, float]]] = {}
+        self._updates: Dict[int, int] = {}
+
+    def snapshot(self, pair_id: int, sequence_id: int, bids: Levels, asks: Levels,
+                 time: Optional[datetime] = None) -> FrameRecord:
+        """完整快照（替換當前價位）"""
+        bid_levels = np.asarray(bids, dtype=np.float64).reshape(-1, 2)
+        ask_levels = np.asarray(asks, dtype=np.float64).reshape(-1, 2)
+        self._books[pair_id] = (dict(bid_levels.tolist()), dict(ask_levels.tolist()))
+        self._updates[pair_id] = 0
+        return (time or datetime.now(timezone.utc), sequence_id, True,
+                pack_levels(bid_levels), pack_levels(ask_levels))
+
+    def force_snapshot(self, pair_id: int) -> None:
+        """下一次 update 寫成完整快照（例如之前的增量幀寫入失敗，重建已不可靠）"""
+        if pair_id in self._updates:
+            self._updates[pair_id] = self.snapshot_every
+
+    def update(self, pair_id: int, sequence_id: int, bid_changes: Levels, ask_changes: Levels,
+               time: Optional[datetime] = None) -> FrameRecord:
+        """增量更新；該交易對還沒有快照或到達快照間隔時返回完整快照"""
+        bid_changes = np.asarray(bid_changes, dtype=np.float64).reshape(-1, 2)
+        ask_changes = np.asarray(ask_changes, dtype=np.float64).reshape(-1, 2)
+        book = self._books.get(pair_id)
+        if book is None:
+            book = self._books[pair_id] = ({}, {})
+            self._updates[pair_id] = self.snapshot_every
+        _apply(book[0], bid_changes)
+        _apply(book[1], ask_changes)
+
+        self._updates[pair_id] += 1
+        if self._updates[pair_id] >= self.snapshot_every:
+            return self.snapshot(pair_id, sequence_id, _sorted_levels(book[0], True),
+                                 _sorted_levels(book[1], False), time)
+        return (time or datetime.now(timezone.utc), sequence_id, False,
+                pack_levels(bid_changes), pack_levels(ask_changes))
+
+
+def _replay(chunks: List[bytes]) -> np.ndarray:
+    """把快照與其後的增量按順序拼接，每個價格取最後一次出現的數量，去掉數量為 0 的價位，按價格升序返回"""
+    levels = unpack_levels(b''.join(chunks))
+    if len(levels) == 0:
+        return levels
+    # 反轉後 np.unique 的 return_index 即每個價格最後一次出現的位置
+    _, last = np.unique(levels[::-1, 0], return_index=True)
+    latest = levels[len(levels) - 1 - last]
+    return latest[latest[:, 1] != 0]
+
+
+def reconstruct(frames: Iterable[Tuple[int, bool, bytes, bytes]],
+                depth: Optional[int] = None) -> Optional[Tuple[int, np.ndarray, np.ndarray]]:
+    """從 (sequence_id, is_snapshot, bids, asks) 幀重建訂單簿
+
+    frames 按 sequence_id 升序，第一幀應為快照；返回 (sequence_id, 買盤降序, 賣盤升序)，
+    沒有快照時返回 None。增量不逐個應用，而是拼接後一次向量化合併。
+    """
+    bid_chunks: Optional[List[bytes]] = None
+    ask_chunks: List[bytes] = []
+    sequence_id = None
+    for sequence_id, is_snapshot, bid_data, ask_data in frames:
+        if is_snapshot:
+            bid_chunks, ask_chunks = [bid_data], [ask_data]
+        elif bid_chunks is not None:
+            bid_chunks.append(bid_data)
+            ask_chunks.append(ask_data)
+    if bid_chunks is None:
+        return None
+
+    bid_levels = _replay(bid_chunks)[::-1]
+    ask_levels = _replay(ask_chunks)
+    if depth is not None:
+        bid_levels, ask_levels = bid_levels[:depth], ask_levels[:depth]
+    return sequence_id, bid_levels, ask_levels
+
+
+def frames_to_columns(records: List[FrameRecord]) -> Tuple[List, ...]:
+    """記錄列表轉為按列的列表（用於 unnest 批量插入）"""
+    return tuple(list(column) for column in zip(*records))
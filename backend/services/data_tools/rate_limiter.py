@@ -0,0 +1,218 @@
+"""
+交易所請求限流器
+描述: 按 (交易所, 端點) 劃分的令牌桶。桶狀態保存在本機共享文件中（優先使用 /dev/shm），
+      同一台主機上的所有線程與進程共用同一份請求預算。
+"""
+
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import logging
+from typing import Dict, Any, Optional, Mapping
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只做進程內共享
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+# 各交易所默認限額（可被配置文件中的 rate_limits 覆蓋）
+# capacity: 桶容量；refill_per_second: 每秒補充的令牌數；weight: 單次請求消耗；
+# bucket: 與其他端點共用的桶名稱
+DEFAULT_RATE_LIMITS: Dict[str, Dict[str, Dict[str, Any]]] = {
+    'bingx': {
+        'default': {'capacity': 100, 'refill_per_second': 10},
+        '/openApi/swap/v3/quote/klines': {'capacity': 100, 'refill_per_second': 10}
+    },
+    'binance': {
+        'default': {'capacity': 6000, 'refill_per_second': 100},
+        '/api/v3/klines': {'bucket': 'default', 'weight': 2}
+    },
+    'okx': {
+        'default': {'capacity': 20, 'refill_per_second': 10},
+        '/api/v5/market/candles': {'capacity': 40, 'refill_per_second': 20},
+        '/api/v5/market/history-candles': {'capacity': 20, 'refill_per_second': 10}
+    },
+    'bybit': {
+        'default': {'capacity': 600, 'refill_per_second': 120}
+    }
+}
+
+# 返回 "剩餘額度" 的響應頭
+REMAINING_HEADERS = ('X-Bapi-Limit-Status', 'X-RateLimit-Remaining', 'RateLimit-Remaining')
+# 返回 "已用權重" 的響應頭（剩餘 = 容量 - 已用）
+USED_WEIGHT_HEADERS = ('X-MBX-USED-WEIGHT-1M', 'X-MBX-USED-WEIGHT')
+
+# 桶狀態: tokens, updated_at, blocked_until
+_STATE = struct.Struct('<ddd')
+
+
+def _default_store_dir() -> str:
+    """獲取默認的共享狀態目錄"""
+    configured = os.getenv('KLINE_RATE_LIMIT_DIR')
+    if configured:
+        return configured
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'kline_rate_limits')
+
+
+class TokenBucket:
+    """文件共享的令牌桶"""
+
+    def __init__(self, path: str, capacity: float, refill_per_second: float):
+        self.path = path
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+
+    def _read(self, now: float):
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        data = os.read(self._fd, _STATE.size)
+        if len(data) < _STATE.size:
+            return self.capacity, now, 0.0
+        tokens, updated_at, blocked_until = _STATE.unpack(data)
+        # 補充令牌
+        elapsed = max(0.0, now - updated_at)
+        tokens = min(self.capacity, tokens + elapsed * self.refill_per_second)
+        return tokens, now, blocked_until
+
+    def _write(self, tokens: float, updated_at: float, blocked_until: float) -> None:
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, _STATE.pack(tokens, updated_at, blocked_until))
+
+    def _update(self, func):
+        """在線程鎖與文件鎖保護下讀取-修改-寫回桶狀態"""
+        with self._lock:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                state = self._read(now)
+                new_state, result = func(now, *state)
+                self._write(*new_state)
+                return result
+            finally:
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reserve(self, weight: float = 1.0) -> float:
+        """預扣令牌，返回需要等待的秒數（餘額不足時排隊到未來）"""
+        def _reserve(now, tokens, updated_at, blocked_until):
+            tokens -= weight
+            wait = 0.0
+            if tokens < 0 and self.refill_per_second > 0:
+                wait = -tokens / self.refill_per_second
+            wait = max(wait, blocked_until - now)
+            return (tokens, updated_at, blocked_until), wait
+        return self._update(_reserve)
+
+    def sync_remaining(self, remaining: float) -> None:
+        """按交易所返回的剩餘額度收緊本地令牌數"""
+        def _sync(now, tokens, updated_at, blocked_until):
+            return (min(tokens, remaining), updated_at, blocked_until), None
+        self._update(_sync)
+
+    def block_for(self, seconds: float) -> None:
+        """交易所要求退避時，在指定時間內暫停發放令牌"""
+        def _block(now, tokens, updated_at, blocked_until):
+            return (min(tokens, 0.0), updated_at, max(blocked_until, now + seconds)), None
+        self._update(_block)
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class RateLimiter:
+    """按端點分桶的交易所限流器"""
+
+    def __init__(self, exchange_name: str, rate_limits: Optional[Dict[str, Any]] = None,
+                 store_dir: Optional[str] = None):
+        self.exchange_name = exchange_name.lower()
+        self.rate_limits = dict(DEFAULT_RATE_LIMITS.get(self.exchange_name, {}))
+        if rate_limits:
+            self.rate_limits.update(rate_limits)
+        self.rate_limits.setdefault('default', {'capacity': 10, 'refill_per_second': 5})
+        self.store_dir = store_dir or _default_store_dir()
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_exchange_config(cls, exchange_config: Dict[str, Any]) -> 'RateLimiter':
+        """根據配置文件中的單個 exchange_configs 項創建限流器"""
+        rate_limits = exchange_config.get('rate_limits') or exchange_config.get('api_info', {}).get('rate_limits')
+        return cls(exchange_config.get('exchange_name', 'unknown'), rate_limits)
+
+    def _resolve(self, endpoint: str):
+        """返回 (桶名稱, 桶配置, 請求權重)"""
+        limit = self.rate_limits.get(endpoint, self.rate_limits['default'])
+        bucket_name = limit.get('bucket', endpoint if endpoint in self.rate_limits else 'default')
+        bucket_config = limit if 'capacity' in limit else self.rate_limits.get(bucket_name, self.rate_limits['default'])
+        return bucket_name, bucket_config, float(limit.get('weight', 1))
+
+    def _get_bucket(self, bucket_name: str, bucket_config: Dict[str, Any]) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(bucket_name)
+            if bucket is None:
+                safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', bucket_name.strip('/')) or 'default'
+                path = os.path.join(self.store_dir, f"{self.exchange_name}__{safe_name}.bucket")
+                bucket = TokenBucket(path, bucket_config['capacity'], bucket_config['refill_per_second'])
+                self._buckets[bucket_name] = bucket
+            return bucket
+
+    def reserve(self, endpoint: str) -> float:
+        """為一次請求預扣令牌，返回需要等待的秒數"""
+        bucket_name, bucket_config, weight = self._resolve(endpoint)
+        return self._get_bucket(bucket_name, bucket_config).reserve(weight)
+
+    def acquire(self, endpoint: str) -> None:
+        """阻塞直到可以發送請求"""
+        wait = self.reserve(endpoint)
+        if wait > 0:
+            time.sleep(wait)
+
+    def observe_response(self, endpoint: str, status_code: int, headers: Mapping[str, str]) -> None:
+        """根據響應狀態碼與限流響應頭調整本地令牌桶"""
+        bucket_name, bucket_config, _ = self._resolve(endpoint)
+        bucket = self._get_bucket(bucket_name, bucket_config)
+
+        if status_code in (418, 429):
+            retry_after = headers.get('Retry-After')
+            try:
+                seconds = float(retry_after) if retry_after else 1.0
+            except ValueError:
+                seconds = 1.0
+            logger.warning(f"{self.exchange_name} 觸發限流 ({status_code})，暫停 {seconds} 秒: {endpoint}")
+            bucket.block_for(seconds)
+            return
+
+        for header in USED_WEIGHT_HEADERS:
+            value = headers.get(header)
+            if value is not None:
+                try:
+                    bucket.sync_remaining(bucket.capacity - float(value))
+                except ValueError:
+                    pass
+                return
+
+        for header in REMAINING_HEADERS:
+            value = headers.get(header)
+            if value is not None:
+                try:
+                    bucket.sync_remaining(float(value))
+                except ValueError:
+                    pass
+                return
+
+    def close(self) -> None:
+        """關閉所有桶文件"""
+        with self._lock:
+            for bucket in self._buckets.values():
+                bucket.close()
+            self._buckets.clear()
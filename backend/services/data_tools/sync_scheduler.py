@@ -0,0 +1,277 @@
+"""
+K線同步調度服務
+描述: 常駐進程。載入所有配置文件中的每個交易所，以及每個 trading_pairs × intervals 組合（下稱數據流），
+      在每根K線收盤後立即安排同步，並通過工作線程池按交易所輪轉分發任務
+
+使用方法:
+python backend/services/data_tools/sync_scheduler.py --config_path backend/api_config/BingX_api_config2_local.json backend/api_config/Binance_api_config.json --workers 16
+"""
+
+import argparse
+import heapq
+import itertools
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Tuple
+
+try:
+    from backend.services.data_tools.import_to_database import (
+        ConfigManager, ErrorHandler, KlineDataPipeline, INTERVAL_MS, BASE_INTERVAL, DERIVED_INTERVALS
+    )
+except ImportError:  # 直接在 data_tools 目錄下運行時
+    from import_to_database import (
+        ConfigManager, ErrorHandler, KlineDataPipeline, INTERVAL_MS, BASE_INTERVAL, DERIVED_INTERVALS
+    )
+
+
+@dataclass(frozen=True)
+class SyncStream:
+    """一個需要持續同步的數據流"""
+    config_path: str
+    exchange_name: str
+    symbol: str
+    interval: str
+
+    @property
+    def exchange_key(self) -> Tuple[str, str]:
+        return self.config_path, self.exchange_name
+
+    def __str__(self) -> str:
+        return f"{self.exchange_name}:{self.symbol}:{self.interval}"
+
+
+class KlineSyncScheduler:
+    """按K線收盤時間調度的多交易所同步服務"""
+
+    def __init__(self, config_paths: List[str], workers: int = 8,
+                 per_exchange_concurrency: int = 4, settle_seconds: float = 2.0):
+        self.error_handler = ErrorHandler()
+        self.logger = self.error_handler.logger
+        self.workers = workers
+        self.per_exchange_concurrency = per_exchange_concurrency
+        self.settle_seconds = settle_seconds
+
+        self.streams: List[SyncStream] = []
+        # (配置文件, 交易所) -> sync_settings，同一交易所的多個配置文件各自獨立
+        self.sync_settings: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._load_streams(config_paths)
+
+        # 到期時間堆: (due_at, seq, stream)
+        self._schedule: List[Tuple[float, int, SyncStream]] = []
+        self._seq = itertools.count()
+        # 已到期、等待分發的數據流（每個交易所一個隊列）
+        self._ready: Dict[str, deque] = {}
+        self._exchange_order: List[str] = []
+        self._next_exchange = 0
+        self._in_flight: Dict[str, int] = {}
+        self._failures: Dict[SyncStream, int] = {}
+
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._local = threading.local()
+        self._pipelines: List[KlineDataPipeline] = []
+        self._pipelines_lock = threading.Lock()
+
+    def _load_streams(self, config_paths: List[str]) -> None:
+        """從配置文件展開全部數據流"""
+        for config_path in config_paths:
+            config = ConfigManager(config_path).config
+            sync_settings = config.get('sync_settings', {})
+            for exchange_config in config['exchange_configs']:
+                exchange_name = exchange_config.get('exchange_name', 'unknown')
+                symbols = exchange_config.get('trading_pairs', config.get('trading_pairs', []))
+                intervals = exchange_config.get('intervals', config.get('intervals', []))
+                if not symbols or not intervals:
+                    self.logger.warning(f"{config_path} 中的 {exchange_name} 未配置 trading_pairs/intervals，已跳過")
+                    continue
+
+                self.sync_settings[(config_path, exchange_name)] = sync_settings
+                if sync_settings.get('derive_intervals', False):
+                    # 派生模式: 派生週期由連續聚合生成，只調度基礎週期
+                    derived = [interval for interval in intervals if interval in DERIVED_INTERVALS]
+                    intervals = [interval for interval in intervals if interval not in DERIVED_INTERVALS]
+                    if derived and BASE_INTERVAL not in intervals:
+                        intervals.insert(0, BASE_INTERVAL)
+                    if derived:
+                        self.logger.info(f"{exchange_name} 的 {', '.join(derived)} 由 {BASE_INTERVAL} 連續聚合生成")
+                for symbol in symbols:
+                    for interval in intervals:
+                        if interval not in INTERVAL_MS:
+                            self.logger.warning(f"不支持的K線間隔 {interval}，已跳過")
+                            continue
+                        self.streams.append(SyncStream(config_path, exchange_name, symbol, interval))
+
+        exchanges = sorted({stream.exchange_name for stream in self.streams})
+        self.logger.info(f"調度器載入 {len(self.streams)} 個數據流，交易所: {', '.join(exchanges)}")
+
+    def _setting(self, stream: SyncStream, key: str, default: Any) -> Any:
+        return self.sync_settings.get(stream.exchange_key, {}).get(key, default)
+
+    def _next_due(self, stream: SyncStream, now: float) -> float:
+        """下一根K線收盤後 settle_seconds 秒；不晚於 sync_interval_seconds"""
+        step = INTERVAL_MS[stream.interval] / 1000.0
+        next_close = (now // step + 1) * step
+        max_wait = float(self._setting(stream, 'sync_interval_seconds', 300))
+        return min(next_close + self.settle_seconds, now + max_wait)
+
+    def _push(self, stream: SyncStream, due_at: float) -> None:
+        with self._condition:
+            heapq.heappush(self._schedule, (due_at, next(self._seq), stream))
+            self._condition.notify()
+
+    def _get_pipeline(self, stream: SyncStream) -> KlineDataPipeline:
+        """每個工作線程為每個交易所持有獨立的管道（HTTP 會話與數據庫連接不跨線程共享）"""
+        pipelines = getattr(self._local, 'pipelines', None)
+        if pipelines is None:
+            pipelines = self._local.pipelines = {}
+        pipeline = pipelines.get(stream.exchange_key)
+        if pipeline is None:
+            pipeline = KlineDataPipeline(stream.config_path, stream.exchange_name)
+            pipelines[stream.exchange_key] = pipeline
+            with self._pipelines_lock:
+                self._pipelines.append(pipeline)
+        return pipeline
+
+    def _run_stream(self, stream: SyncStream) -> bool:
+        """同步單個數據流，返回本次是否推進了最新K線且仍有未追上的已收盤K線
+
+        已下架、停牌或成交稀疏的交易對不會產生新K線，最新時間停滯時按正常節奏排程，避免反覆同步佔用配額。
+        """
+        pipeline = self._get_pipeline(stream)
+        limit = int(self._setting(stream, 'default_limit', 1000))
+        before = pipeline.db_manager.get_latest_timestamp(stream.symbol, stream.interval)
+        if not pipeline.sync_kline_data(stream.symbol, stream.interval, limit=limit, incremental=True):
+            raise RuntimeError(f"同步失敗: {stream}")
+
+        latest_time = pipeline.db_manager.get_latest_timestamp(stream.symbol, stream.interval)
+        if latest_time is None or (before is not None and latest_time <= before):
+            return False
+        step_ms = INTERVAL_MS[stream.interval]
+        last_closed_open = (int(time.time() * 1000) // step_ms - 1) * step_ms
+        return latest_time.timestamp() * 1000 < last_closed_open
+
+    def _on_done(self, stream: SyncStream, future) -> None:
+        """任務完成後釋放交易所配額並重新排程"""
+        now = time.time()
+        try:
+            catching_up = future.result()
+            self._failures.pop(stream, None)
+            # 本次有進展且尚在追趕歷史數據時立即重新排隊，與其他數據流輪流佔用配額
+            due_at = now if catching_up else self._next_due(stream, now)
+        except Exception as e:
+            failures = self._failures.get(stream, 0) + 1
+            self._failures[stream] = failures
+            max_wait = float(self._setting(stream, 'sync_interval_seconds', 300))
+            due_at = now + min(max_wait, 5 * 2 ** min(failures, 10))
+            self.error_handler.handle_general_error(e, f"調度同步 {stream} (第 {failures} 次失敗)")
+
+        with self._condition:
+            self._in_flight[stream.exchange_name] -= 1
+            heapq.heappush(self._schedule, (due_at, next(self._seq), stream))
+            self._condition.notify()
+
+    def _dispatch(self, executor: ThreadPoolExecutor) -> Optional[float]:
+        """把到期數據流移入就緒隊列，並按交易所輪轉提交；返回距下一個到期時間的秒數"""
+        now = time.time()
+        while self._schedule and self._schedule[0][0] <= now:
+            _, _, stream = heapq.heappop(self._schedule)
+            if stream.exchange_name not in self._ready:
+                self._ready[stream.exchange_name] = deque()
+                self._in_flight.setdefault(stream.exchange_name, 0)
+                self._exchange_order.append(stream.exchange_name)
+            self._ready[stream.exchange_name].append(stream)
+
+        total_in_flight = sum(self._in_flight.values())
+        idle_rounds = 0
+        while total_in_flight < self.workers and idle_rounds < len(self._exchange_order):
+            exchange_name = self._exchange_order[self._next_exchange % len(self._exchange_order)]
+            self._next_exchange += 1
+            queue = self._ready[exchange_name]
+            if not queue or self._in_flight[exchange_name] >= self.per_exchange_concurrency:
+                idle_rounds += 1
+                continue
+
+            idle_rounds = 0
+            stream = queue.popleft()
+            self._in_flight[exchange_name] += 1
+            total_in_flight += 1
+            future = executor.submit(self._run_stream, stream)
+            future.add_done_callback(lambda f, s=stream: self._on_done(s, f))
+
+        if self._schedule:
+            return max(0.0, self._schedule[0][0] - time.time())
+        return None
+
+    def run(self) -> None:
+        """主循環，直到 stop() 被調用"""
+        if not self.streams:
+            self.logger.error("沒有可調度的數據流")
+            return
+
+        # 啟動時立即同步一次以追上停機期間的數據
+        now = time.time()
+        for stream in self.streams:
+            self._push(stream, now)
+
+        self.logger.info(f"調度器啟動: {self.workers} 個工作線程，每個交易所最多 {self.per_exchange_concurrency} 個並發")
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='kline-sync') as executor:
+            with self._condition:
+                while not self._stop.is_set():
+                    timeout = self._dispatch(executor)
+                    self._condition.wait(timeout if timeout is not None else 1.0)
+            self.logger.info("調度器停止，等待進行中的同步完成...")
+        self.close()
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._condition:
+            self._condition.notify()
+
+    def close(self) -> None:
+        """關閉所有工作線程創建的管道"""
+        with self._pipelines_lock:
+            for pipeline in self._pipelines:
+                try:
+                    pipeline.close()
+                except Exception as e:
+                    self.error_handler.handle_general_error(e, "關閉管道")
+            self._pipelines.clear()
+
+
+def parse_arguments():
+    """解析命令行參數"""
+    parser = argparse.ArgumentParser(description='多交易所K線同步調度服務')
+    parser.add_argument('--config_path', type=str, nargs='+', required=True, help='一個或多個配置文件路徑')
+    parser.add_argument('--workers', type=int, default=8, help='工作線程數')
+    parser.add_argument('--per_exchange_concurrency', type=int, default=4, help='每個交易所的最大並發同步數')
+    parser.add_argument('--settle_seconds', type=float, default=2.0, help='K線收盤後等待多少秒再同步')
+    return parser.parse_args()
+
+
+def main():
+    """主函數"""
+    args = parse_arguments()
+    scheduler = KlineSyncScheduler(
+        [os.path.abspath(path) for path in args.config_path],
+        workers=args.workers,
+        per_exchange_concurrency=args.per_exchange_concurrency,
+        settle_seconds=args.settle_seconds
+    )
+
+    def _handle_signal(signum, frame):
+        scheduler.stop()
+
+    signal.signal(signal.SIGINT, _handle_signal)
+    signal.signal(signal.SIGTERM, _handle_signal)
+    scheduler.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+增量成交量分布
+按固定價格寬度 bin_size 分桶（桶 i 覆蓋 [i * bin_size, (i + 1) * bin_size)），每桶保存累計成交量與成交筆數。
+新成交只做一次向量化的 np.bincount 累加，查詢時直接讀取桶數組或合併為指定桶數，不需要重新掃描成交記錄
+
+使用方法:
+    profile = await VolumeProfile.load(db, pair_id, start_time, end_time, bin_size=1.0)
+    profile.add_trades(trades)          # 新到達的成交
+    df = profile.profile(price_bins=50)
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class VolumeProfile:
+    """固定價格寬度的增量成交量分布
+
+    桶數組只覆蓋出現過的價格範圍，超出時按倍增向兩側擴展，單次擴展的複製成本被攤銷。
+    """
+
+    def __init__(self, bin_size: float):
+        if bin_size <= 0:
+            raise ValueError("bin_size 必須大於 0")
+        self.bin_size = float(bin_size)
+        # _volume[0] 對應的桶號
+        self._origin = 0
+        self._volume = np.zeros(0, dtype=np.float64)
+        self._count = np.zeros(0, dtype=np.int64)
+        # 有成交的桶號範圍 [_low, _high]
+        self._low: Optional[int] = None
+        self._high: Optional[int] = None
+
+    @classmethod
+    async def load(cls, data_access, pair_id: int, start_time: datetime, end_time: datetime,
+                   bin_size: float) -> 'VolumeProfile':
+        """用數據庫中區間內的成交初始化（在數據庫中按桶聚合，只傳回每桶一行）"""
+        profile = cls(bin_size)
+        rows = await data_access.get_volume_histogram(pair_id, start_time, end_time, bin_size)
+        if rows:
+            bins, volumes, counts = zip(*rows)
+            profile.add_bins(bins, volumes, counts)
+        return profile
+
+    @property
+    def total_volume(self) -> float:
+        return float(self._volume.sum())
+
+    @property
+    def trade_count(self) -> int:
+        return int(self._count.sum())
+
+    def _ensure(self, low: int, high: int) -> None:
+        """擴展桶數組以覆蓋桶號 [low, high]"""
+        if self._low is None:
+            size = max(64, high - low + 1)
+            self._origin = low - (size - (high - low + 1)) // 2
+            self._volume = np.zeros(size, dtype=np.float64)
+            self._count = np.zeros(size, dtype=np.int64)
+            self._low, self._high = low, high
+            return
+
+        self._low, self._high = min(self._low, low), max(self._high, high)
+        end = self._origin + len(self._volume)
+        if low >= self._origin and high < end:
+            return
+        span = self._high - self._low + 1
+        size = max(len(self._volume) * 2, span * 2)
+        origin = self._low - (size - span) // 2
+        volume = np.zeros(size, dtype=np.float64)
+        count = np.zeros(size, dtype=np.int64)
+        offset = self._origin - origin
+        volume[offset:offset + len(self._volume)] = self._volume
+        count[offset:offset + len(self._count)] = self._count
+        self._origin, self._volume, self._count = origin, volume, count
+
+    def add_bins(self, bins: Sequence[int], volumes: Sequence[float], counts: Sequence[int]) -> None:
+        """按桶號累加成交量與筆數"""
+        bins = np.asarray(bins, dtype=np.int64)
+        if len(bins) == 0:
+            return
+        low, high = int(bins.min()), int(bins.max())
+        self._ensure(low, high)
+        index = bins - low
+        offset = low - self._origin
+        self._volume[offset:offset + high - low + 1] += np.bincount(
+            index, weights=np.asarray(volumes, dtype=np.float64), minlength=high - low + 1)
+        self._count[offset:offset + high - low + 1] += np.bincount(
+            index, weights=np.asarray(counts, dtype=np.float64), minlength=high - low + 1).astype(np.int64)
+
+    def add(self, prices: Sequence[float], quantities: Sequence[float]) -> None:
+        """累加一批成交的價格與數量"""
+        prices = np.asarray(prices, dtype=np.float64)
+        if len(prices) == 0:
+            return
+        bins = np.floor(prices / self.bin_size).astype(np.int64)
+        low, high = int(bins.min()), int(bins.max())
+        self._ensure(low, high)
+        index = bins - low
+        offset = low - self._origin
+        self._volume[offset:offset + high - low + 1] += np.bincount(
+            index, weights=np.asarray(quantities, dtype=np.float64), minlength=high - low + 1)
+        self._count[offset:offset + high - low + 1] += np.bincount(index, minlength=high - low + 1)
+
+    def add_trade(self, price: float, quantity: float) -> None:
+        """累加單筆成交"""
+        bin_id = int(np.floor(float(price) / self.bin_size))
+        self._ensure(bin_id, bin_id)
+        self._volume[bin_id - self._origin] += float(quantity)
+        self._count[bin_id - self._origin] += 1
+
+    def add_trades(self, trades: List[Dict]) -> None:
+        """累加交易記錄字典（格式同 DataAccess.insert_trades）"""
+        self.add([trade['price'] for trade in trades], [trade['quantity'] for trade in trades])
+
+    def _occupied(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """有成交的範圍內的 (桶下沿價格, 成交量, 筆數)"""
+        if self._low is None:
+            empty = np.zeros(0, dtype=np.float64)
+            return empty, empty, np.zeros(0, dtype=np.int64)
+        start, stop = self._low - self._origin, self._high - self._origin + 1
+        levels = np.arange(self._low, self._high + 1, dtype=np.float64) * self.bin_size
+        return levels, self._volume[start:stop], self._count[start:stop]
+
+    def profile(self, price_bins: Optional[int] = None) -> pd.DataFrame:
+        """成交量分布，列同 DataAccess.get_volume_profile (price_level, volume, trade_count)
+
+        price_bins 為空時按 bin_size 返回；否則把最低到最高價位之間合併為 price_bins 個等寬桶，
+        精度受 bin_size 限制
+        """
+        levels, volumes, counts = self._occupied()
+        if price_bins is None or len(levels) == 0:
+            return pd.DataFrame({'price_level': levels, 'volume': volumes, 'trade_count': counts})
+
+        lo, hi = levels[0], levels[-1]
+        if hi == lo:
+            index = np.zeros(len(levels), dtype=np.int64)
+        else:
+            index = np.minimum(((levels - lo) / (hi - lo) * price_bins).astype(np.int64), price_bins - 1)
+        return pd.DataFrame({
+            'price_level': lo + np.arange(price_bins) * (hi - lo) / price_bins,
+            'volume': np.bincount(index, weights=volumes, minlength=price_bins),
+            'trade_count': np.bincount(index, weights=counts, minlength=price_bins).astype(np.int64)
+        })
+
+    def point_of_control(self) -> Optional[float]:
+        """成交量最大的桶的下沿價格"""
+        levels, volumes, _ = self._occupied()
+        if len(levels) == 0:
+            return None
+        return float(levels[int(np.argmax(volumes))])
+
+    def value_area(self, fraction: float = 0.7) -> Optional[Tuple[float, float]]:
+        """從 POC 向兩側擴展、覆蓋 fraction 成交量的價格區間 (下沿, 上沿)"""
+        levels, volumes, _ = self._occupied()
+        total = volumes.sum()
+        if len(levels) == 0 or total <= 0:
+            return None
+        low = high = int(np.argmax(volumes))
+        covered, target = volumes[low], total * fraction
+        while covered < target and (low > 0 or high < len(volumes) - 1):
+            below = volumes[low - 1] if low > 0 else -1.0
+            above = volumes[high + 1] if high < len(volumes) - 1 else -1.0
+            if above >= below:
+                high += 1
+                covered += above
+            else:
+                low -= 1
+                covered += below
+        return float(levels[low]), float(levels[high] + self.bin_size)
+
+    def stats(self) -> Dict[str, Any]:
+        """分布指標"""
+        return {'bin_size': self.bin_size, 'bins': 0 if self._low is None else self._high - self._low + 1,
+                'total_volume': self.total_volume, 'trade_count': self.trade_count}
@@ -0,0 +1,234 @@
+"""
+DataAccess 異步寫緩衝
+按 (表, 交易對) 合併待寫入的行，批次達到 max_batch_size 或最早一行等待超過 max_age 時
+用一條批量語句寫入；待寫入行數達到 max_pending_rows 時 add_* 等待寫入完成（背壓），
+寫入併發受 max_concurrent_flushes 限制，不會佔滿連接池；寫入失敗的批次放回緩衝區，最多重試 max_retries 次
+
+使用方法:
+    async with WriteBehindBuffer(db) as buffer:
+        await buffer.add_trades(trades, pair_id)
+"""
+import asyncio
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+try:
+    from backend.services.data_tools.data_access import DataAccess
+except ImportError:  # 直接在 data_tools 目錄下運行時
+    from data_access import DataAccess
+
+logger = logging.getLogger(__name__)
+
+# (表名, pair_id)
+BufferKey = Tuple[str, int]
+
+
+class _PendingBatch:
+    """同一 (表, 交易對) 的待寫入行，按各表的唯一鍵合併，後寫入的覆蓋先寫入的"""
+
+    __slots__ = ('rows', 'created', 'attempts')
+
+    def __init__(self):
+        self.rows: Dict[Hashable, Tuple] = {}
+        self.created = time.monotonic()
+        # 已失敗的寫入次數
+        self.attempts = 0
+
+
+class WriteBehindBuffer:
+    """DataAccess 前的寫緩衝
+
+    max_batch_size: 單個批次達到該行數時立即寫入
+    max_age: 批次中最早一行的最長等待時間（秒）
+    max_pending_rows: 緩衝與寫入中的總行數上限，超過時 add_* 等待
+    max_concurrent_flushes: 同時進行的寫入數（每個寫入佔用一個連接）
+    max_retries: 寫入失敗的批次在下一輪寫入時重試的次數，超過後丟棄
+    """
+
+    def __init__(self, data_access: DataAccess, max_batch_size: int = 5000, max_age: float = 1.0,
+                 max_pending_rows: int = 500000, max_concurrent_flushes: int = 4, max_retries: int = 3):
+        self.data_access = data_access
+        self.max_batch_size = max_batch_size
+        self.max_age = max_age
+        self.max_pending_rows = max_pending_rows
+        self.max_retries = max_retries
+
+        self._writers: Dict[str, Callable[[List[Tuple], int], Awaitable[None]]] = {
+            'market_data': data_access.insert_market_records,
+            'trades': data_access.insert_trade_records,
+            'orderbook_snapshots': data_access.insert_orderbook_snapshots,
+            'orderbook_frames': data_access.insert_orderbook_frames,
+            'technical_indicators': data_access.insert_technical_indicators
+        }
+        self._batches: Dict[BufferKey, _PendingBatch] = {}
+        self._pending_rows = 0
+        self._space = asyncio.Condition()
+        self._batch_full = asyncio.Event()
+        # 同一時間只有一輪寫入，保證同一 (表, 交易對) 的批次按順序寫入
+        self._flush_lock = asyncio.Lock()
+        self._flush_semaphore = asyncio.Semaphore(max_concurrent_flushes)
+        self._stop = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._metrics = {'rows_added': 0, 'rows_written': 0, 'rows_failed': 0,
+                         'batches': 0, 'retries': 0, 'backpressure_waits': 0}
+
+    async def __aenter__(self) -> 'WriteBehindBuffer':
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        """啟動後台寫入任務"""
+        if self._flusher is None:
+            self._stop.clear()
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def close(self) -> None:
+        """停止後台任務並寫入全部剩餘數據（不關閉 DataAccess 的連接池）"""
+        self._stop.set()
+        self._batch_full.set()
+        if self._flusher is not None:
+            await self._flusher
+            self._flusher = None
+        await self.flush()
+        logger.info(f"寫緩衝已關閉: {self.stats()}")
+
+    # ---- 寫入接口 ----
+
+    async def add_market_data(self, data: pd.DataFrame, pair_id: int) -> None:
+        """緩衝市場數據，同一時間的K線只保留最後一次"""
+        records = DataAccess.market_data_records(data)
+        await self._add('market_data', pair_id, ((record[0], record) for record in records))
+
+    async def add_trades(self, trades: List[Dict], pair_id: int) -> None:
+        """緩衝交易記錄，按 (time, trade_id) 去重"""
+        records = [DataAccess.trade_record(trade) for trade in trades]
+        await self._add('trades', pair_id, (((record[0], record[1]), record) for record in records))
+
+    async def add_orderbook_snapshot(self, pair_id: int, sequence_id: int,
+                                     bids: List[Tuple[float, float]], asks: List[Tuple[float, float]]) -> None:
+        """緩衝訂單簿快照，時間取調用時刻"""
+        if self.data_access.orderbook_storage == 'compact':
+            frame = self.data_access.orderbook_encoder.snapshot(pair_id, sequence_id, bids, asks)
+            await self._add('orderbook_frames', pair_id, [(sequence_id, frame)])
+            return
+        record = (datetime.now(timezone.utc), sequence_id, bids, asks)
+        await self._add('orderbook_snapshots', pair_id, [(sequence_id, record)])
+
+    async def add_orderbook_update(self, pair_id: int, sequence_id: int,
+                                   bid_changes: List[Tuple[float, float]],
+                                   ask_changes: List[Tuple[float, float]]) -> None:
+        """緩衝訂單簿增量（compact 存儲），調用時即編碼，保證快照間隔按到達順序計算"""
+        frame = self.data_access.orderbook_encoder.update(pair_id, sequence_id, bid_changes, ask_changes)
+        await self._add('orderbook_frames', pair_id, [(sequence_id, frame)])
+
+    async def add_technical_indicator(self, pair_id: int, timeframe: str, indicator_name: str,
+                                      indicator_value: Dict) -> None:
+        """緩衝技術指標，時間取調用時刻"""
+        record = (datetime.now(timezone.utc), timeframe, indicator_name, indicator_value)
+        await self._add('technical_indicators', pair_id, [((record[0], timeframe, indicator_name), record)])
+
+    async def _add(self, table: str, pair_id: int, rows: Iterable[Tuple[Hashable, Tuple]]) -> None:
+        if self._stop.is_set():
+            raise RuntimeError("寫緩衝已關閉")
+        async with self._space:
+            if self._pending_rows >= self.max_pending_rows:
+                self._metrics['backpressure_waits'] += 1
+                self._batch_full.set()
+                await self._space.wait_for(lambda: self._pending_rows < self.max_pending_rows)
+
+            batch = self._batches.get((table, pair_id))
+            if batch is None:
+                batch = self._batches[(table, pair_id)] = _PendingBatch()
+            count = len(batch.rows)
+            for key, record in rows:
+                batch.rows[key] = record
+                self._metrics['rows_added'] += 1
+            added = len(batch.rows) - count
+            self._pending_rows += added
+            if len(batch.rows) >= self.max_batch_size:
+                self._batch_full.set()
+
+    # ---- 寫入 ----
+
+    async def flush(self) -> None:
+        """立即寫入全部緩衝的數據（失敗的批次立即重試，直到寫入或丟棄）"""
+        await self._flush_due(force=True)
+        while any(batch.attempts for batch in self._batches.values()):
+            await self._flush_due(force=True)
+
+    async def _flush_loop(self) -> None:
+        """按批次大小或等待時間觸發寫入"""
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), timeout=self.max_age / 2)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_full.clear()
+            await self._flush_due(force=self._pending_rows >= self.max_pending_rows)
+
+    async def _flush_due(self, force: bool) -> None:
+        async with self._flush_lock:
+            now = time.monotonic()
+            due = [
+                key for key, batch in self._batches.items()
+                if force or len(batch.rows) >= self.max_batch_size or now - batch.created >= self.max_age
+            ]
+            if not due:
+                return
+            batches = [(key, self._batches.pop(key)) for key in due]
+            await asyncio.gather(*(self._write(key, batch) for key, batch in batches))
+
+    async def _write(self, key: BufferKey, batch: _PendingBatch) -> None:
+        table, pair_id = key
+        records = list(batch.rows.values())
+        requeued = 0
+        try:
+            async with self._flush_semaphore:
+                await self._writers[table](records, pair_id)
+            self._metrics['rows_written'] += len(records)
+            self._metrics['batches'] += 1
+        except Exception as e:
+            if table == 'orderbook_frames':
+                # 缺少任何一個增量幀，重建結果在下一個快照前都不正確；讓下一幀成為完整快照
+                self.data_access.orderbook_encoder.force_snapshot(pair_id)
+            batch.attempts += 1
+            if batch.attempts <= self.max_retries:
+                requeued = self._requeue(key, batch)
+                self._metrics['retries'] += 1
+                logger.warning(f"寫入 {table} 失敗 (交易對ID: {pair_id}, {len(records)} 行)，"
+                               f"第 {batch.attempts} 次重試: {e}")
+            else:
+                self._metrics['rows_failed'] += len(records)
+                logger.error(f"寫入 {table} 失敗 (交易對ID: {pair_id}, {len(records)} 行)，"
+                             f"重試 {self.max_retries} 次後丟棄: {e}")
+        finally:
+            async with self._space:
+                self._pending_rows -= len(records) - requeued
+                self._space.notify_all()
+
+    def _requeue(self, key: BufferKey, batch: _PendingBatch) -> int:
+        """把寫入失敗的批次放回緩衝區，寫入期間新加入的同鍵行優先；返回放回後新增的行數"""
+        current = self._batches.get(key)
+        if current is None:
+            self._batches[key] = batch
+            return len(batch.rows)
+        count = len(current.rows)
+        for row_key, record in batch.rows.items():
+            current.rows.setdefault(row_key, record)
+        current.created = min(current.created, batch.created)
+        current.attempts = max(current.attempts, batch.attempts)
+        return len(current.rows) - count
+
+    def stats(self) -> Dict[str, Any]:
+        """緩衝指標"""
+        return dict(self._metrics,
+                    rows_coalesced=self._metrics['rows_added'] - self._metrics['rows_written']
+                    - self._metrics['rows_failed'] - self._pending_rows,
+                    pending_rows=self._pending_rows, batches_pending=len(self._batches))
@@ -3,6 +3,53 @@ import axios from 'axios';
 // Use the correct backend API URL with port
 const API_URL = 'http://localhost:5000/api';
 
+// Packed binary K-line format (see backend/api/kline_encoding.py):
+// 'KLB1' | uint32 count | uint32 metaLength | meta JSON | pad to 8 bytes |
+// int64 time[n] | float64 open[n] | high[n] | low[n] | close[n] | volume[n]  (little endian)
+const KLINE_BINARY_MIME = 'application/vnd.kline.binary';
+const KLINE_FLOAT_COLUMNS = ['open', 'high', 'low', 'close', 'volume'];
+
+/**
+ * Decode a packed binary K-line response into the row format used by the chart
+ * @param {ArrayBuffer} buffer - Response body
+ * @returns {Object} - Response metadata with `data` as an array of candles
+ */
+export function decodeKlineBinary(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+  if (magic !== 'KLB1') {
+    // Not a binary payload (e.g. an error returned as JSON)
+    return JSON.parse(new TextDecoder().decode(buffer));
+  }
+  
+  const count = view.getUint32(4, true);
+  const metaLength = view.getUint32(8, true);
+  const meta = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 12, metaLength)));
+  
+  let offset = 12 + metaLength;
+  offset += (8 - (offset % 8)) % 8;
+  const time = new BigInt64Array(buffer, offset, count);
+  offset += count * 8;
+  const columns = {};
+  for (const name of KLINE_FLOAT_COLUMNS) {
+    columns[name] = new Float64Array(buffer, offset, count);
+    offset += count * 8;
+  }
+  
+  const data = new Array(count);
+  for (let i = 0; i < count; i++) {
+    data[i] = {
+      time: Number(time[i]),
+      open: columns.open[i],
+      high: columns.high[i],
+      low: columns.low[i],
+      close: columns.close[i],
+      volume: columns.volume[i]
+    };
+  }
+  return { ...meta, data };
+}
+
 /**
  * Service for fetching K-line chart data from the backend
  */
@@ -27,6 +74,31 @@ export default {
     return axios.get(`${API_URL}/kline-data`, { params });
   },
   
+  /**
+   * Get one page of K-line data using keyset pagination
+   * @param {string} symbol - Trading pair symbol (e.g., BTC-USDT)
+   * @param {string} interval - Time interval (e.g., 1m, 5m, 1h)
+   * @param {Object} options - { before, after, pageSize, maxPoints }; before/after are unix seconds (exclusive)
+   * @returns {Promise} - Promise with K-line data and pagination cursors (transferred as packed binary)
+   */
+  getKlinePage(symbol, interval, { before = null, after = null, pageSize = 1000, maxPoints = null } = {}) {
+    const params = {
+      symbol,
+      interval,
+      page_size: pageSize,
+      ...(before !== null && { before }),
+      ...(after !== null && { after }),
+      ...(maxPoints !== null && { max_points: maxPoints })
+    };
+    
+    // Request the packed binary encoding and decode it into the usual { data, pagination } shape
+    return axios.get(`${API_URL}/kline-data`, {
+      params,
+      responseType: 'arraybuffer',
+      headers: { Accept: KLINE_BINARY_MIME }
+    }).then(response => ({ ...response, data: decodeKlineBinary(response.data) }));
+  },
+  
   /**
    * Get available trading pairs
    * @returns {Promise} - Promise with list of available symbols
@@ -50,5 +122,34 @@ export default {
    */
   getMarketStats(symbol) {
     return axios.get(`${API_URL}/market-stats/${symbol}`);
+  },
+  
+  /**
+   * Get rolling 24h statistics for every symbol (or the given ones) in one request
+   * @param {string[]} symbols - Optional list of trading pair symbols
+   * @returns {Promise} - Promise with a map of symbol to statistics
+   */
+  getAllMarketStats(symbols = null) {
+    const params = symbols && symbols.length ? { symbols: symbols.join(',') } : {};
+    return axios.get(`${API_URL}/market-stats`, { params });
+  },
+  
+  /**
+   * Subscribe to newly written candles for a symbol and interval (Server-Sent Events)
+   * @param {string} symbol - Trading pair symbol (e.g., BTC-USDT)
+   * @param {string} interval - Time interval (e.g., 1m, 5m, 1h)
+   * @param {Object} handlers - `onCandles(candles)` for each push, `onResync()` when writes may have been missed
+   * @returns {EventSource} - Call `close()` to unsubscribe
+   */
+  openKlineStream(symbol, interval, { onCandles, onResync } = {}) {
+    const params = new URLSearchParams({ symbol, interval });
+    const source = new EventSource(`${API_URL}/kline-stream?${params}`);
+    source.addEventListener('candles', (event) => {
+      if (onCandles) onCandles(JSON.parse(event.data).data);
+    });
+    source.addEventListener('resync', () => {
+      if (onResync) onResync();
+    });
+    return source;
   }
 };
\ No newline at end of file
@@ -93,6 +93,23 @@ const useDataCollectionStore = defineStore('dataCollection', {
       }
     },
     
+    // 合併服務器推送的進度增量（只包含該事件改變的字段）
+    applyProgressDelta(delta) {
+      if (delta.progress !== undefined) this.collectionProgress = delta.progress
+      if (delta.collectedKlines !== undefined) this.collectedKlines = delta.collectedKlines
+      if (delta.totalKlines) this.totalKlines = delta.totalKlines
+      if (delta.batchCount !== undefined) this.batchCount = delta.batchCount
+      if (delta.currentBatch) this.currentBatch = { ...delta.currentBatch }
+      if (delta.error) this.error = delta.error
+
+      if (delta.history) {
+        this.collectionHistory.push(delta.history)
+        if (this.collectionHistory.length > 100) {
+          this.collectionHistory.shift()
+        }
+      }
+    },
+
     completeCollection() {
       this.isCollecting = false
       this.collectionProgress = 100